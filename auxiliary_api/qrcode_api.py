@@ -6,6 +6,10 @@ https://lovelace.oulu.fi/ohjelmoitava-web/ohjelmoitava-web/auxiliary-api-example
 
 import ast
 import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from io import BytesIO
 
 import cv2
@@ -24,11 +28,20 @@ app.config["INVENTORYMANAGER_API_SERVER"] = "http://localhost:5000"
 app.config["INVENTORYMANAGER_API_TIMEOUT"] = 5
 app.config["CACHE_TYPE"] = "FileSystemCache"
 app.config["CACHE_DIR"] = "cache"
+# QReader instances kept loaded, each used by one request at a time
+app.config["QREADER_POOL_SIZE"] = 1
+# load the first QReader instance in the background at startup
+app.config["QREADER_WARM_UP"] = True
+# seconds a request waits for a QReader instance before failing with 503
+app.config["QREADER_WAIT_TIMEOUT"] = 60
 
 cache = Cache(app)
 api = Api(app)
 
 MASON = "application/vnd.mason+json"
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+# seconds between two checks of a request waiting for a QReader instance
+POOL_POLL_INTERVAL = 1.0
 
 
 #minmal version of version from
@@ -78,6 +91,125 @@ class MasonBuilder(dict):
         self["@controls"][ctrl_name]["href"] = href
 
 
+class DetectorPool:
+    """
+    QReader instances shared by the requests of the process. Loading the
+    detection model takes much longer than a detection, so instances are
+    created lazily, at most size of them, and reused by later requests. The
+    time spent loading and detecting is recorded for /metrics.
+    """
+
+    def __init__(self, size, wait_timeout):
+        """
+        :param size: maximum number of instances
+        :param wait_timeout: seconds to wait for an instance
+        """
+        self.size = size
+        self.wait_timeout = wait_timeout
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.detections = 0
+        self.detection_seconds = 0.0
+
+    def _load(self):
+        """Loads the model into a new QReader instance.
+
+        :return: QReader
+        """
+        started = time.perf_counter()
+        detector = QReader()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.loads += 1
+            self.load_seconds += elapsed
+        app.logger.info("Loaded the QReader model in %.2f s", elapsed)
+        return detector
+
+    def _acquire(self):
+        """Takes an idle instance, creating one if the pool isn't full and
+        waiting for one to be returned otherwise. Waiting requests check
+        regularly whether the pool has room again, so that they load the
+        model themselves when a load failed.
+
+        :return: QReader
+        :raises ServiceUnavailable: if no instance was available in time
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    return self._load()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ServiceUnavailable("QR code reader unavailable")
+            try:
+                return self._idle.get(timeout=min(remaining, POOL_POLL_INTERVAL))
+            except queue.Empty:
+                pass
+
+    @contextmanager
+    def detector(self):
+        """Lends an instance for the duration of the block.
+
+        :return: QReader
+        :raises ServiceUnavailable: if no instance was available in time
+        """
+        detector = self._acquire()
+        try:
+            yield detector
+        finally:
+            self._idle.put(detector)
+
+    def detect_and_decode(self, image):
+        """Decodes the QR codes of an image.
+
+        :param image: image in OpenCV format
+        :return: tuple of the decoded texts
+        """
+        with self.detector() as detector:
+            started = time.perf_counter()
+            decoded = detector.detect_and_decode(image=image)
+            elapsed = time.perf_counter() - started
+        with self._lock:
+            self.detections += 1
+            self.detection_seconds += elapsed
+        return decoded
+
+    def warm_up(self):
+        """Loads the first instance in a background thread, so that neither
+        the startup nor the first scan waits for the model.
+        """
+
+        def load():
+            try:
+                with self.detector():
+                    pass
+            except Exception:  # pylint: disable=broad-exception-caught
+                app.logger.exception("Failed to load the QReader model")
+
+        threading.Thread(target=load, name="qreader-warm-up", daemon=True).start()
+
+
+detectors = DetectorPool(
+    app.config["QREADER_POOL_SIZE"], app.config["QREADER_WAIT_TIMEOUT"]
+)
+
+
 def call_api(s, path):
     """calls the inventorymanager api with the given path and returns the response as a json object
 
@@ -192,14 +324,12 @@ class QrRead(Resource):
         except Exception as e:
             raise BadRequest("No image file provided under key 'image'") from e
         try:
-            # Create a QReader instance
-            qreader = QReader()
-
             # Convert the image to OpenCV format
             image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), -1)
 
-            # Use the detect_and_decode function to get the decoded QR data
-            decoded_text = qreader.detect_and_decode(image=image)[0]
+            # Use the detect_and_decode function of a shared QReader instance
+            # to get the decoded QR data
+            decoded_text = detectors.detect_and_decode(image=image)[0]
             decoded_dict = ast.literal_eval(decoded_text)
 
             item_name = decoded_dict["item_name"]
@@ -242,5 +372,35 @@ def entry():
     return Response(json.dumps(resp_data), 200, mimetype=MASON)
 
 
+@app.route("/metrics")
+def metrics():
+    """Time spent loading the QReader model and detecting QR codes, in the
+    Prometheus text format
+    :return: Response
+    """
+    lines = []
+    for name, help_text, value in (
+        ("qrcode_model_loads_total", "QReader models loaded", detectors.loads),
+        (
+            "qrcode_model_load_seconds_total",
+            "Time spent loading QReader models",
+            detectors.load_seconds,
+        ),
+        ("qrcode_detections_total", "QR code detections", detectors.detections),
+        (
+            "qrcode_detection_seconds_total",
+            "Time spent detecting QR codes",
+            detectors.detection_seconds,
+        ),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    return Response("\n".join(lines) + "\n", 200, content_type=PROMETHEUS)
+
+
 api.add_resource(QrGenerate, "/api/qrGenerate/")
 api.add_resource(QrRead, "/api/qrRead/")
+
+if app.config["QREADER_WARM_UP"]:
+    detectors.warm_up()
@@ -0,0 +1,170 @@
+"""
+This module contains the local response cache of the handheld client. GET
+responses of the Inventory Manager API are kept by URL along with their ETag
+and Last-Modified validators. The next request for the same URL sends them in
+If-None-Match and If-Modified-Since, and a 304 answer is served from the
+cache, so refreshing an unchanged screen doesn't transfer its body again.
+
+It also maps item names to item IDs, learned from the responses already
+received, so that writing a stock doesn't need a request to look the ID up.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote
+
+from client_constants import RESPONSE_CACHE_SIZE, ITEM_ID_CACHE_SIZE
+
+# self link of a stock, which is the only place its item name appears
+STOCK_HREF = re.compile(r"/api/stocks/\d+/item/([^/]+)/$")
+
+
+class ResponseCache:
+    """
+    Bounded, thread safe cache of responses keyed by URL. The least recently
+    used response is evicted once max_size responses are stored.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url, max_age=None):
+        """The cached response of a URL, e.g. to show it while offline.
+
+        :param url: URL of the request
+        :param max_age: seconds since the response was last received or
+            revalidated, None to accept any age
+        :return: requests.Response or None
+        """
+        with self._lock:
+            entry = self._responses.get(url)
+        if entry is None:
+            return None
+        response, checked_at = entry
+        if max_age is not None and time.monotonic() - checked_at > max_age:
+            return None
+        return response
+
+    def validators(self, url):
+        """Conditional request headers for a URL.
+
+        :param url: URL of the request
+        :return: dictionary of headers, empty if the URL isn't cached
+        """
+        response = self.get(url)
+        if response is None:
+            return {}
+        headers = {}
+        if "ETag" in response.headers:
+            headers["If-None-Match"] = response.headers["ETag"]
+        if "Last-Modified" in response.headers:
+            headers["If-Modified-Since"] = response.headers["Last-Modified"]
+        return headers
+
+    def update(self, url, response):
+        """Stores a response that can be revalidated, or returns the cached
+        response when the server answered 304.
+
+        :param url: URL of the request
+        :param response: requests.Response
+        :return: the response to use
+        """
+        with self._lock:
+            if response.status_code == 304:
+                entry = self._responses.get(url)
+                if entry is not None:
+                    self._responses[url] = (entry[0], time.monotonic())
+                    self._responses.move_to_end(url)
+                    return entry[0]
+                return response
+
+            if response.status_code == 200 and (
+                "ETag" in response.headers or "Last-Modified" in response.headers
+            ):
+                self._responses[url] = (response, time.monotonic())
+                self._responses.move_to_end(url)
+                while len(self._responses) > self.max_size:
+                    self._responses.popitem(last=False)
+            else:
+                self._responses.pop(url, None)
+        return response
+
+    def discard(self, url):
+        """Removes the response of a URL, e.g. once the resource was changed.
+
+        :param url: URL of the request
+        """
+        with self._lock:
+            self._responses.pop(url, None)
+
+    def clear(self):
+        """Removes every response."""
+        with self._lock:
+            self._responses.clear()
+
+
+class ItemIds:
+    """
+    Bounded, thread safe mapping of item names to item IDs. The least
+    recently used name is evicted once max_size names are stored.
+    """
+
+    def __init__(self, max_size=ITEM_ID_CACHE_SIZE):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """The ID of an item.
+
+        :param name: name of the item
+        :return: item ID or None if it isn't known
+        """
+        with self._lock:
+            item_id = self._ids.get(name)
+            if item_id is not None:
+                self._ids.move_to_end(name)
+            return item_id
+
+    def learn(self, document):
+        """Stores the IDs of every item and stock of a response body,
+        including the embedded ones.
+
+        :param document: decoded JSON body of a response
+        """
+        if isinstance(document, list):
+            for value in document:
+                self.learn(value)
+            return
+        if not isinstance(document, dict):
+            return
+
+        if "item_id" in document:
+            name = document.get("name")
+            if name is None:
+                href = document.get("@controls", {}).get("self", {}).get("href", "")
+                match = STOCK_HREF.search(href)
+                if match:
+                    name = unquote(match.group(1))
+            if isinstance(name, str):
+                with self._lock:
+                    self._ids[name] = document["item_id"]
+                    self._ids.move_to_end(name)
+                    while len(self._ids) > self.max_size:
+                        self._ids.popitem(last=False)
+
+        for key, value in document.items():
+            if key != "@controls":
+                self.learn(value)
+
+    def forget(self, name):
+        """Removes the ID of an item, e.g. after it was renamed or deleted.
+
+        :param name: name of the item
+        """
+        with self._lock:
+            self._ids.pop(name, None)
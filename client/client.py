@@ -8,9 +8,18 @@ import curses
 from curses import wrapper
 import requests
 from requests.exceptions import Timeout, RequestException
-from error import APIError
 from util import menu, ask_inputs, display_dict, display_nested_dict
-from client_constants import INVENTORY_MANAGER_API, AUX_API, NAMESPACE, TIMEOUT_DURATION
+from client_constants import NAMESPACE, TIMEOUT_DURATION
+from session import api_client
+from offline import BackgroundSync, WriteQueue
+from prefetch import Prefetcher
+
+# stock changes not sent yet, kept on disk while the API is unreachable
+write_queue = WriteQueue()
+# sends the queued changes without blocking the UI
+sync = BackgroundSync(write_queue, api_client)
+# views of the selected stock loaded in the background
+prefetcher = Prefetcher(api_client)
 
 
 def main(stdscr):
@@ -61,10 +70,17 @@ def main(stdscr):
         while True:
             # new menu to interact with stock
             menu_title = f"Selected {item_name} in warehouse {warehouse_id}"
-            stock_response, stock_response_clean, current_quantity = get_stock(
-                warehouse_id, item_name
-            )
+            report_sync(stdscr)
+            sync.start()
+            stock = get_stock(warehouse_id, item_name)
+            if stock is None:
+                prefetcher.clear()
+                stdscr.addstr(20, 0, "Failed to retrieve stock. Try again.")
+                stdscr.refresh()
+                break
+            stock_response, stock_response_clean, current_quantity = stock
             display_dict(stock_window, stock_response_clean, title="STOCK")
+            prefetch_related(stock_response, item_name)
 
             selected_option = menu(
                 menu_window,
@@ -130,9 +146,7 @@ def main(stdscr):
                         ask_inputs(user_entry_window, ["Enter New Price: "])
                     )
                     new_price = float(price_input)
-                    update_price(
-                        stdscr, warehouse_id, item_name, current_quantity, new_price
-                    )
+                    update_price(stdscr, warehouse_id, item_name, new_price)
                 except StopIteration:
                     stdscr.addstr(20, 0, "No price entered.")
                 except ValueError:
@@ -144,52 +158,81 @@ def main(stdscr):
                 view_item_info(stdscr, stock_item_window, item_name)
             elif selected_option == "Item-Stock in other Warehouses":
                 item_stock_response = follow_relation(stock_response, "stock-item-all")
-                display_nested_dict(
-                    stock_item_window, item_stock_response["items"], title="ITEM-STOCK"
-                )
+                if item_stock_response is None:
+                    stdscr.addstr(20, 0, "Failed to retrieve the item stocks.")
+                    stdscr.refresh()
+                else:
+                    display_nested_dict(
+                        stock_item_window,
+                        item_stock_response["items"],
+                        title="ITEM-STOCK",
+                    )
             elif selected_option == "Back":
+                prefetcher.clear()
                 menu_window.clear()
                 stdscr.refresh()
                 break
 
 
 def get_stock(warehouse_id, item_name):
-    """ Get stock of item in warehouse
+    """ Get stock of item in warehouse. While the API is unreachable, the last
+    response received is used instead. Changes waiting in the write queue are
+    applied to the quantity and price shown.
 
     :param warehouse_id: ID of the warehouse where the stock is stored.
     :param item_name: The name of the item whose ID is required.
     :return: Tuple containing the stock response, cleaned stock response, and current quantity if available.
     """
     try:
-        stock_response = requests.get(
-            INVENTORY_MANAGER_API + f"/api/stocks/{warehouse_id}/item/{item_name}/",
-            timeout=TIMEOUT_DURATION,
-        ).json()
+        path = api_client.controls.href(
+            "stock-item", warehouse=warehouse_id, item=item_name
+        )
+    except RequestException as e:
+        print(f"An error occurred while carrying out the request: {e}")
+        return None
+    try:
+        stock_response = api_client.inventory("GET", path).json()
     except Timeout:
         print(f"The request timed out after {TIMEOUT_DURATION} seconds")
         stock_response = None
-        return None
     except RequestException as e:
         print(f"An error occurred while carrying out the request: {e}")
         stock_response = None
-        return None
-    stock_quantity = stock_response["quantity"]
-    stock_shelf_price = stock_response["shelf_price"]
+    if stock_response is None:
+        cached = api_client.cached(path)
+        if cached is None:
+            return None
+        stock_response = cached.json()
+    quantity_delta, pending_price = write_queue.pending_change(warehouse_id, item_name)
+    stock_quantity = stock_response["quantity"] + quantity_delta
+    stock_shelf_price = (
+        stock_response["shelf_price"] if pending_price is None else pending_price
+    )
     stock_response_clean = {k: v for k, v in stock_response.items() if "@" not in k}
+    stock_response_clean["quantity"] = stock_quantity
+    stock_response_clean["shelf_price"] = stock_shelf_price
     NAMESPACE = list(stock_response["@namespaces"].keys())[0]
     return stock_response, stock_response_clean, stock_quantity
 
 
 def get_item_id_by_name(warehouse_id, item_name):
     """
-    GET requests for the item ID from the Inventory Manager API by item name.
+    GET requests for the item ID from the Inventory Manager API by item name,
+    unless it was already learned from an earlier response.
 
     :param item_name: The name of the item whose ID is required.
     :return: The ID of the item if found, else None.
     """
+    item_id = api_client.item_ids.get(item_name)
+    if item_id is not None:
+        return item_id
     try:
-        url = f"{INVENTORY_MANAGER_API}/api/stocks/{warehouse_id}/item/{item_name}/"
-        response = requests.get(url=url, timeout=TIMEOUT_DURATION)
+        response = api_client.inventory(
+            "GET",
+            api_client.controls.href(
+                "stock-item", warehouse=warehouse_id, item=item_name
+            ),
+        )
         response.raise_for_status()
         item_data = response.json()
 
@@ -219,92 +262,65 @@ def modify_quantity(stdscr, warehouse_id, item_name, action, current_quantity):
     :return: The new quantity of stock
     """
     quantity = int(action.split()[1])
-    if "Add" in action:
-        quantity = quantity + current_quantity
-        update_stock(stdscr, warehouse_id, item_name, quantity)
-    elif "Remove" in action:
-        quantity = -quantity + current_quantity
-        update_stock(stdscr, warehouse_id, item_name, quantity)
-    modified_quantity = quantity
+    if "Remove" in action:
+        quantity = -quantity
+    update_stock(stdscr, warehouse_id, item_name, quantity)
+    modified_quantity = current_quantity + quantity
     return modified_quantity
 
 
-def update_stock(stdscr, warehouse_id, item_name, quantity):
+def update_stock(stdscr, warehouse_id, item_name, quantity_delta):
     """
-    Updates the stock quantity for a given item in a warehouse.
+    Updates the stock quantity for a given item in a warehouse. The change is
+    queued and sent right away, or once the API is reachable again.
 
     :param stdscr: The curses window object for displaying messages.
     :param warehouse_id: ID of the warehouse where the stock is stored.
     :param item_name: Name of the item to update.
-    :param quantity: Quantity to update in the stock.
+    :param quantity_delta: Quantity added to the stock, negative when removed.
     """
-    item_id = get_item_id_by_name(warehouse_id, item_name)
-
-    if item_id is None:
-        stdscr.addstr(20, 0, "Failed to find the item ID for the given item name.")
-        stdscr.refresh()
-        return
-
-    url = f"{INVENTORY_MANAGER_API}/api/stocks/{warehouse_id}/item/{item_name}/"
-    data = {"warehouse_id": warehouse_id, "item_id": item_id, "quantity": quantity}
-
-    try:
-        response = requests.put(url, json=data, timeout=TIMEOUT_DURATION)
-        if response.status_code in {200, 204}:
-            stdscr.addstr(20, 0, "Stock updated successfully.")
-        else:
-            raise APIError(response.status_code, response.text, url)
-    except Timeout as t:
-        stdscr.addstr(20, 0, f"Request Timed Out: {str(t)}")
-    except requests.RequestException as e:
-        stdscr.addstr(20, 0, f"Network or request issue: {str(e)}")
-    except APIError as api_error:
-        error_message = str(api_error) if str(api_error) else "Unknown API error."
-        stdscr.addstr(20, 0, error_message)
+    write_queue.record(warehouse_id, item_name, quantity_delta=quantity_delta)
+    sync.start(force=True)
+    stdscr.addstr(20, 0, "Stock change saved, sending it.")
     stdscr.refresh()
 
 
-def update_price(stdscr, warehouse_id, item_name, modifeid_quantity, new_price):
+def update_price(stdscr, warehouse_id, item_name, new_price):
     """
-    Updates the price of a given item in a warehouse.
+    Updates the price of a given item in a warehouse. The change is queued
+    and sent right away, or once the API is reachable again.
 
     :param stdscr: The curses window object for displaying messages.
     :param warehouse_id: ID of the warehouse where the item is stored.
     :param item_name: Name of the item to update.
     :param new_price: New price to set for the item.
     """
-    item_id = get_item_id_by_name(warehouse_id, item_name)
+    write_queue.record(warehouse_id, item_name, shelf_price=new_price)
+    sync.start(force=True)
+    stdscr.addstr(20, 0, "Price change saved, sending it.")
+    stdscr.refresh()
 
-    if item_id is None:
-        stdscr.addstr(20, 0, "Failed to find the item ID for the given item name.")
-        stdscr.refresh()
-        return
 
-    url = f"{INVENTORY_MANAGER_API}/api/stocks/{warehouse_id}/item/{item_name}/"
-    data = {
-        "warehouse_id": warehouse_id,
-        "item_id": item_id,
-        "quantity": modifeid_quantity,
-        "shelf_price": new_price,
-    }
+def report_sync(stdscr):
+    """
+    Reports the outcome of the last background sync of the queued stock
+    changes, if one finished since the last report.
 
-    try:
-        response = requests.put(url, json=data, timeout=TIMEOUT_DURATION)
-        if response.status_code in {200, 204}:
-            stdscr.addstr(20, 0, "Price updated successfully.")
-        else:
-            raise APIError(response.status_code, response.text, url)
-        stdscr.refresh()
-    except Timeout as t:
-        stdscr.addstr(20, 0, f"Request TimedOut: {str(t)}")
-        stdscr.refresh()
-    except requests.RequestException as e:
-        stdscr.addstr(20, 0, f"Network or request issue: {str(e)}")
-        stdscr.refresh()
-    except APIError as api_error:
-        error_message = str(api_error) if str(api_error) else "Unknown API error."
-        stdscr.addstr(20, 0, error_message)
-        stdscr.refresh()
+    :param stdscr: The curses window object for displaying messages.
+    """
+    outcome = sync.outcome()
+    if outcome is None:
+        return
+    written, errors, pending = outcome
+    if written:
+        prefetcher.clear()
+    if errors:
+        stdscr.addstr(20, 0, "; ".join(errors))
+    elif pending:
+        stdscr.addstr(20, 0, f"API unreachable, {pending} stock changes queued.")
+    elif written:
+        stdscr.addstr(20, 0, "Queued changes sent.")
+    stdscr.refresh()
 
 
 def scan_stock(stdscr, user_entry_window):
@@ -319,9 +335,7 @@ def scan_stock(stdscr, user_entry_window):
     try:
         with open(image_path, "rb") as file:
             files = {"image": file}
-            response = requests.post(
-                f"{AUX_API}/api/qrRead/", files=files, timeout=TIMEOUT_DURATION
-            )
+            response = api_client.aux("POST", "/api/qrRead/", files=files)
             response.raise_for_status()
             stock_info = response.json()
             return stock_info["warehouse_id"], stock_info["item_name"]
@@ -344,9 +358,10 @@ def print_qr_code(stdscr, warehouse_id, item_name):
     :param item_name: Name of the item to update.
     """
     try:
-        response = requests.get(
-            f"{AUX_API}/api/qrGenerate/?warehouse_id={warehouse_id}&item_name={item_name}",
-            timeout=TIMEOUT_DURATION,
+        response = api_client.aux(
+            "GET",
+            "/api/qrGenerate/",
+            params={"warehouse_id": warehouse_id, "item_name": item_name},
         )
         if response.status_code == 200:
             with open("output_qr.png", "wb") as f:
@@ -372,14 +387,17 @@ def view_item_info(stdscr, stock_window, item_name):
     :param item_name: Name of stock item
     """
     try:
-        response = requests.get(
-            url=f"{INVENTORY_MANAGER_API}/api/items/{item_name}/",
-            timeout=TIMEOUT_DURATION,
-        )
+        response = prefetcher.get(api_client.controls.href("item", item=item_name))
+        body = response.json()
     except Timeout as t:
         stdscr.addstr(20, 0, f"Request Timed Out: {str(t)}")
         stdscr.refresh()
-    response_clean = {k: v for k, v in response.json().items() if "@" not in k}
+        return
+    except (RequestException, ValueError) as e:
+        stdscr.addstr(20, 0, f"Network or request issue: {str(e)}")
+        stdscr.refresh()
+        return
+    response_clean = {k: v for k, v in body.items() if "@" not in k}
     if response.status_code == 200:
         item_details = response_clean
         display_dict(stock_window, item_details, title="Item Details")
@@ -388,22 +406,49 @@ def view_item_info(stdscr, stock_window, item_name):
         stdscr.refresh()
 
 
+def prefetch_related(stock_response, item_name):
+    """Starts loading the item details and the stock of the item in other
+    warehouses, the views usually opened after selecting a stock.
+
+    :param stock_response: The API response of the selected stock
+    :param item_name: Name of stock item
+    """
+    try:
+        item_url = api_client.controls.href("item", item=item_name)
+    except RequestException:
+        return
+    prefetcher.prefetch(
+        item_url, stock_response["@controls"][f"{NAMESPACE}:stock-item-all"]["href"]
+    )
+
+
 def follow_relation(response, relation):
     """Follow the link relation in the given response
 
     :param response: The API response
     :param relation: The link relation that needs to be followed
+    :return: The decoded response, or None if the request failed
     """
     relation_url = response["@controls"][f"{NAMESPACE}:{relation}"]["href"]
     try:
-        return requests.get(
-            INVENTORY_MANAGER_API + relation_url, timeout=TIMEOUT_DURATION
-        ).json()
+        relation_response = prefetcher.get(relation_url)
+        relation_response.raise_for_status()
+        return relation_response.json()
     except Timeout:
         print("Request Timed Out")
         return None
+    except (RequestException, ValueError) as e:
+        print(f"An error occurred while carrying out the request: {e}")
+        return None
     # return requests.get(INVENTORY_MANAGER_API + relation_url).json()
 
 
 if __name__ == "__main__":
-    wrapper(main)
+    try:
+        wrapper(main)
+    finally:
+        prefetcher.close()
+        api_client.close()
+        # a flush still waiting for the API is abandoned, the queue is durable
+        if sync.wait(timeout=1):
+            write_queue.close()
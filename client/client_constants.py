@@ -1,4 +1,31 @@
 INVENTORY_MANAGER_API = "http://localhost:5000"
 AUX_API = "http://localhost:5001"
 NAMESPACE = "invmanager"
-TIMEOUT_DURATION = 30
\ No newline at end of file
+TIMEOUT_DURATION = 30
+# connections kept open per API, see session.py
+POOL_MAXSIZE = 10
+# attempts after a failed connection or a 502/503/504 response, waiting
+# RETRY_BACKOFF * 2 ** (attempt - 1) seconds in between
+RETRIES = 3
+RETRY_BACKOFF = 0.3
+# GET responses kept for revalidation, see cache.py
+RESPONSE_CACHE_SIZE = 256
+# local database of the stock changes not sent yet, see offline.py
+OFFLINE_QUEUE_PATH = "offline_queue.db"
+# stocks read per /api/batch/ request when syncing, at most BATCH_LIMIT
+SYNC_BATCH_SIZE = 20
+# seconds before queued changes are sent again after a sync left them queued,
+# unless a new change is recorded
+SYNC_RETRY_INTERVAL = 60
+# item name to item ID mappings kept, see cache.py
+ITEM_ID_CACHE_SIZE = 512
+# a stock response revalidated less than this many seconds ago is used as the
+# base quantity of a write instead of reading the stock again, the write being
+# refused if the stock changed since
+WRITE_BASE_MAX_AGE = 30
+# seconds the controls of the API entry point are used before loading it
+# again, see controls.py
+CONTROL_TTL = 300
+# threads loading the views of the selected stock in the background, see
+# prefetch.py
+PREFETCH_WORKERS = 4
@@ -0,0 +1,88 @@
+"""
+This module contains the hypermedia control cache of the handheld client. The
+controls of the API entry point are loaded once and kept per link relation for
+CONTROL_TTL seconds. Resources are reached by expanding the URI templates of
+these controls locally, instead of hard coding their paths or following links
+from the entry point on every request.
+"""
+
+import threading
+import time
+from urllib.parse import quote
+
+from requests.exceptions import RequestException
+
+from client_constants import NAMESPACE, CONTROL_TTL
+
+ENTRY_POINT = "/api/"
+
+
+class ControlCache:
+    """
+    Controls of the API entry point, keyed by link relation.
+    """
+
+    def __init__(self, api_client, ttl=CONTROL_TTL):
+        """
+        :param api_client: session.ApiClient loading the entry point
+        :param ttl: seconds a control is used before the entry point is
+            loaded again
+        """
+        self.api_client = api_client
+        self.ttl = ttl
+        self._controls = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Loads the controls of the entry point."""
+        response = self.api_client.inventory("GET", ENTRY_POINT)
+        response.raise_for_status()
+        expires_at = time.monotonic() + self.ttl
+        for name, control in response.json()["@controls"].items():
+            self._controls[name] = (control, expires_at)
+
+    def control(self, relation):
+        """The control of a link relation. The entry point is loaded again
+        once the control expired, but the expired control is still used while
+        the API is unreachable.
+
+        :param relation: link relation, without namespace, e.g. "stock-item"
+        :return: dictionary of the control
+        :raises RequestException: if the entry point was never loaded and
+            can't be
+        :raises KeyError: if the entry point has no such control
+        """
+        name = f"{NAMESPACE}:{relation}"
+        with self._lock:
+            entry = self._controls.get(name)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            try:
+                self._load()
+            except RequestException:
+                if entry is None:
+                    raise
+                return entry[0]
+            return self._controls[name][0]
+
+    def href(self, relation, **variables):
+        """The href of a link relation, with the variables of its URI
+        template expanded.
+
+        :param relation: link relation, without namespace, e.g. "stock-item"
+        :param variables: values of the template variables, e.g. item="Laptop"
+        :return: path of the resource
+        """
+        control = self.control(relation)
+        href = control["href"]
+        if control.get("isHrefTemplate"):
+            for name, value in variables.items():
+                href = href.replace("{" + name + "}", quote(str(value), safe=""))
+            if "{" in href:
+                raise ValueError(f"Missing variables to expand {href}")
+        return href
+
+    def clear(self):
+        """Removes every control, e.g. after the API was updated."""
+        with self._lock:
+            self._controls.clear()
@@ -0,0 +1,328 @@
+"""
+This module contains the offline write queue of the handheld client. Stock
+changes are recorded in a local SQLite database before they are sent, so that
+they survive a dropped connection or a restart of the client. Changes to the
+same stock are coalesced into one row: quantity changes are summed as a delta
+and the last price wins.
+
+Syncing writes each stock once, with the delta applied to its current
+quantity. The quantity and item ID come from the client's caches when they are
+recent, otherwise the stocks are read in bulk through the /api/batch/ endpoint.
+A write based on a cached stock carries its ETag in If-Match, so that it is
+refused instead of overwriting a change made by another client since.
+
+Syncing runs on a background thread, see BackgroundSync, so that the UI doesn't
+wait for the timeouts and retries of an unreachable API.
+"""
+
+import sqlite3
+import threading
+import time
+
+from requests.exceptions import RequestException
+
+from client_constants import (
+    OFFLINE_QUEUE_PATH,
+    SYNC_BATCH_SIZE,
+    SYNC_RETRY_INTERVAL,
+    WRITE_BASE_MAX_AGE,
+)
+
+
+def stock_path(api_client, warehouse_id, item_name):
+    """
+    :return: path of a stock in the Inventory Manager API
+    """
+    return api_client.controls.href(
+        "stock-item", warehouse=warehouse_id, item=item_name
+    )
+
+
+class WriteQueue:
+    """
+    Durable queue of stock changes, keyed by warehouse and item name.
+    """
+
+    def __init__(self, path=OFFLINE_QUEUE_PATH):
+        """
+        :param path: path of the SQLite database, created if missing
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " warehouse_id INTEGER NOT NULL,"
+            " item_name TEXT NOT NULL,"
+            " quantity_delta INTEGER NOT NULL DEFAULT 0,"
+            " shelf_price REAL,"
+            " revision INTEGER NOT NULL DEFAULT 0,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (warehouse_id, item_name))"
+        )
+
+    def record(self, warehouse_id, item_name, quantity_delta=0, shelf_price=None):
+        """Adds a change to the queue, merging it with the pending change of the
+        same stock.
+
+        :param warehouse_id: ID of the warehouse of the stock
+        :param item_name: name of the item of the stock
+        :param quantity_delta: quantity added, negative when removed
+        :param shelf_price: new shelf price, None to keep the current one
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO pending"
+                " (warehouse_id, item_name, quantity_delta, shelf_price, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (warehouse_id, item_name) DO UPDATE SET"
+                " quantity_delta = quantity_delta + excluded.quantity_delta,"
+                " shelf_price = COALESCE(excluded.shelf_price, shelf_price),"
+                " revision = revision + 1,"
+                " updated_at = excluded.updated_at",
+                (warehouse_id, item_name, quantity_delta, shelf_price, time.time()),
+            )
+
+    def pending(self):
+        """Lists the pending changes, oldest first.
+
+        :return: list of (warehouse_id, item_name, quantity_delta, shelf_price,
+            revision) tuples
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT warehouse_id, item_name, quantity_delta, shelf_price, revision"
+                " FROM pending ORDER BY updated_at"
+            ).fetchall()
+
+    def pending_change(self, warehouse_id, item_name):
+        """The pending change of one stock.
+
+        :return: tuple of the quantity delta and the shelf price (or None)
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT quantity_delta, shelf_price FROM pending"
+                " WHERE warehouse_id = ? AND item_name = ?",
+                (warehouse_id, item_name),
+            ).fetchone()
+        return row if row is not None else (0, None)
+
+    def _applied(self, warehouse_id, item_name, quantity_delta, revision):
+        """Removes a change once it has been written, keeping what was recorded
+        for the same stock while it was being sent.
+        """
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM pending"
+                " WHERE warehouse_id = ? AND item_name = ? AND revision = ?",
+                (warehouse_id, item_name, revision),
+            ).rowcount
+            if not removed:
+                self._connection.execute(
+                    "UPDATE pending SET quantity_delta = quantity_delta - ?"
+                    " WHERE warehouse_id = ? AND item_name = ?",
+                    (quantity_delta, warehouse_id, item_name),
+                )
+
+    def flush(self, api_client):
+        """Sends the pending changes. A stock whose item ID is known and whose
+        response was revalidated in the last WRITE_BASE_MAX_AGE seconds is
+        written in a single request, conditional on the ETag of that response.
+        The other stocks are read through the batch endpoint first, and so are
+        the ones whose write failed with 412 because the stock changed since
+        it was cached, with 404 because the item ID was outdated, or with 409
+        because the quantity computed from the cached stock was refused. Stops
+        at the first connection failure or server error, leaving the remaining
+        changes queued. Changes the API rejects, and changes of stocks that no
+        longer exist (404 or 410), are dropped and reported. A stock that
+        can't be read for another reason keeps its change queued, and so do
+        the stocks of a batch request the API rejects.
+
+        :param api_client: session.ApiClient
+        :return: tuple of the number of stocks written and a list of error
+            messages
+        """
+        written = 0
+        errors = []
+        unread = []
+        try:
+            for row in self.pending():
+                warehouse_id, item_name = row[0], row[1]
+                path = stock_path(api_client, warehouse_id, item_name)
+                item_id = api_client.item_ids.get(item_name)
+                cached = api_client.cached(path, max_age=WRITE_BASE_MAX_AGE)
+                if item_id is None or cached is None:
+                    unread.append(row)
+                    continue
+                status = self._write(
+                    api_client, row, item_id, cached.json(), cached.headers.get("ETag")
+                )
+                if status in {404, 409, 412}:
+                    api_client.item_ids.forget(item_name)
+                    unread.append(row)
+                    continue
+                if self._report(status, path, errors):
+                    written += 1
+                self._applied(warehouse_id, item_name, row[2], row[4])
+
+            for start in range(0, len(unread), SYNC_BATCH_SIZE):
+                chunk = unread[start : start + SYNC_BATCH_SIZE]
+                paths = [stock_path(api_client, row[0], row[1]) for row in chunk]
+                response = api_client.inventory(
+                    "POST", "/api/batch/", json={"requests": paths}
+                )
+                if response.status_code >= 500:
+                    response.raise_for_status()
+                if response.status_code != 200:
+                    errors.append(
+                        f"Error {response.status_code} while reading the stocks"
+                    )
+                    break
+                stocks = response.json()["responses"]
+
+                for row, path, stock in zip(chunk, paths, stocks):
+                    warehouse_id, item_name, quantity_delta, _, revision = row
+                    if stock["status"] != 200:
+                        errors.append(f"Error {stock['status']} while reading {path}")
+                        if stock["status"] not in {404, 410}:
+                            continue
+                    else:
+                        api_client.item_ids.learn(stock["body"])
+                        current = stock["body"]
+                        status = self._write(
+                            api_client, row, current["item_id"], current
+                        )
+                        if self._report(status, path, errors):
+                            written += 1
+                    self._applied(warehouse_id, item_name, quantity_delta, revision)
+        except RequestException:
+            pass
+        return written, errors
+
+    @staticmethod
+    def _write(api_client, row, item_id, current, etag=None):
+        """Applies a pending change to the current state of its stock.
+
+        :param api_client: session.ApiClient
+        :param row: pending change, as listed by pending()
+        :param item_id: ID of the item of the stock
+        :param current: current stock, as returned by the API
+        :param etag: ETag of current, sent in If-Match when it may be outdated
+        :return: status code of the response
+        """
+        warehouse_id, item_name, quantity_delta, shelf_price, _ = row
+        data = {
+            "warehouse_id": warehouse_id,
+            "item_id": item_id,
+            "quantity": current["quantity"] + quantity_delta,
+            "shelf_price": (
+                current["shelf_price"] if shelf_price is None else shelf_price
+            ),
+        }
+        headers = {"If-Match": etag} if etag else {}
+        response = api_client.inventory(
+            "PUT",
+            stock_path(api_client, warehouse_id, item_name),
+            json=data,
+            headers=headers,
+        )
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response.status_code
+
+    @staticmethod
+    def _report(status, path, errors):
+        """Adds an error message unless a write succeeded.
+
+        :return: True if the write succeeded
+        """
+        if status in {200, 204}:
+            return True
+        errors.append(f"Error {status} while writing {path}")
+        return False
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM pending"
+            ).fetchone()
+        return count
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self._connection.close()
+
+
+class BackgroundSync:
+    """
+    Flushes a WriteQueue on a background thread, one flush at a time. Once a
+    flush left changes queued, e.g. because the API is unreachable, the next
+    one only starts after retry_interval seconds, unless a new change is
+    recorded.
+    """
+
+    def __init__(self, write_queue, api_client, retry_interval=SYNC_RETRY_INTERVAL):
+        """
+        :param write_queue: WriteQueue to flush
+        :param api_client: session.ApiClient
+        :param retry_interval: seconds between two flushes leaving changes queued
+        """
+        self.write_queue = write_queue
+        self.api_client = api_client
+        self.retry_interval = retry_interval
+        self._thread = None
+        self._outcome = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, force=False):
+        """Starts a flush, unless one is running, nothing is queued, or the
+        last flush left changes queued less than retry_interval seconds ago.
+
+        :param force: ignore the retry interval, e.g. after a new change
+        :return: True if a flush was started
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            if not force and time.monotonic() < self._retry_at:
+                return False
+            if not len(self.write_queue):
+                return False
+            self._thread = threading.Thread(target=self._run, name="sync", daemon=True)
+            self._thread.start()
+        return True
+
+    def _run(self):
+        written, errors = self.write_queue.flush(self.api_client)
+        pending = len(self.write_queue)
+        with self._lock:
+            self._retry_at = time.monotonic() + self.retry_interval if pending else 0.0
+            self._outcome = (written, errors, pending)
+
+    def outcome(self):
+        """The outcome of the last flush, returned once.
+
+        :return: tuple of the number of stocks written, the list of error
+            messages and the number of changes still queued, or None if no
+            flush finished since the last call
+        """
+        with self._lock:
+            outcome, self._outcome = self._outcome, None
+        return outcome
+
+    def wait(self, timeout=None):
+        """Waits for the running flush, if any.
+
+        :param timeout: seconds to wait at most
+        :return: True if no flush is running anymore
+        """
+        thread = self._thread
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
@@ -0,0 +1,72 @@
+"""
+This module contains the prefetcher of the handheld client. Once a stock is
+selected, the resources of the views the user usually opens next are requested
+on a background thread pool, so that opening these views doesn't wait for the
+API while the curses UI is frozen.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from client_constants import PREFETCH_WORKERS
+
+
+class Prefetcher:
+    """
+    GET requests to the Inventory Manager API sent in the background, keyed by
+    path. Each prefetched response is used once.
+    """
+
+    def __init__(self, api_client, max_workers=PREFETCH_WORKERS):
+        """
+        :param api_client: session.ApiClient sending the requests
+        :param max_workers: requests sent at once
+        """
+        self.api_client = api_client
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, *paths):
+        """Starts GET requests in the background, unless they are already
+        pending or their response wasn't used yet.
+
+        :param paths: paths of the resources, e.g. "/api/items/Laptop/"
+        """
+        with self._lock:
+            for path in paths:
+                if path not in self._futures:
+                    self._futures[path] = self._executor.submit(
+                        self.api_client.inventory, "GET", path
+                    )
+
+    def get(self, path):
+        """The response of a GET request, waiting for it if it was prefetched
+        and sending it now otherwise.
+
+        :param path: path of the resource
+        :return: requests.Response
+        :raises RequestException: if the request failed
+        """
+        with self._lock:
+            future = self._futures.pop(path, None)
+        if future is None:
+            return self.api_client.inventory("GET", path)
+        return future.result()
+
+    def clear(self):
+        """Forgets the prefetched responses, e.g. once they are outdated by a
+        write or the user left the stock.
+        """
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    def close(self):
+        """
+        Stops the worker threads without waiting for pending requests.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,147 @@
+"""
+This module contains the HTTP client shared by the functions of the handheld
+client. It keeps one requests.Session per API, so that connections are pooled
+and kept alive between menu actions instead of being opened for every request,
+and retries failed connections and overloaded responses with a backoff. GET
+requests to the Inventory Manager API are revalidated against the local
+response cache of cache.py, and the item IDs they contain are remembered so
+that stock writes don't need to look them up. Paths of resources are expanded
+from the cached controls of the API entry point, see controls.py.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import ResponseCache, ItemIds
+from controls import ControlCache
+from client_constants import (
+    INVENTORY_MANAGER_API,
+    AUX_API,
+    TIMEOUT_DURATION,
+    POOL_MAXSIZE,
+    RETRIES,
+    RETRY_BACKOFF,
+)
+
+
+class ApiClient:
+    """
+    Pooled keep-alive sessions to the Inventory Manager API and the auxiliary
+    API. Requests are sent with paths relative to the root of each API.
+    """
+
+    def __init__(
+        self,
+        inventory_url=INVENTORY_MANAGER_API,
+        aux_url=AUX_API,
+        timeout=TIMEOUT_DURATION,
+        pool_maxsize=POOL_MAXSIZE,
+        retries=RETRIES,
+        backoff=RETRY_BACKOFF,
+        cache=None,
+        item_ids=None,
+    ):
+        """
+        :param inventory_url: root URL of the Inventory Manager API
+        :param aux_url: root URL of the auxiliary API
+        :param timeout: seconds to wait for a connection and for a response
+        :param pool_maxsize: connections kept open per API
+        :param retries: attempts after a failure
+        :param backoff: backoff factor between attempts, in seconds
+        :param cache: ResponseCache of the GET responses, defaults to a new one
+        :param item_ids: ItemIds learned from the responses, defaults to a new
+            one
+        """
+        self.inventory_url = inventory_url
+        self.aux_url = aux_url
+        self.timeout = timeout
+        self.cache = cache if cache is not None else ResponseCache()
+        self.item_ids = item_ids if item_ids is not None else ItemIds()
+        self.controls = ControlCache(self)
+        self.inventory_session = self._create_session(pool_maxsize, retries, backoff)
+        self.aux_session = self._create_session(pool_maxsize, retries, backoff)
+
+    @staticmethod
+    def _create_session(pool_maxsize, retries, backoff):
+        """Creates a session retrying idempotent requests. POST requests are
+        only retried when the connection failed before they were sent.
+
+        :return: requests.Session
+        """
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def inventory(self, method, path, **kwargs):
+        """Sends a request to the Inventory Manager API. GET requests are
+        revalidated against the cached response of the URL, which is returned
+        when the server answers 304 Not Modified. Other methods discard it.
+
+        :param method: HTTP method, e.g. "GET"
+        :param path: path of the resource, e.g. "/api/items/"
+        :return: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.inventory_url + path
+        if method != "GET":
+            self.cache.discard(url)
+            return self.inventory_session.request(method, url, **kwargs)
+
+        headers = kwargs.pop("headers", {})
+        response = self.inventory_session.get(
+            url, headers={**self.cache.validators(url), **headers}, **kwargs
+        )
+        response = self.cache.update(url, response)
+        if response.status_code == 304:
+            # evicted from the cache in the meantime
+            response = self.inventory_session.get(url, headers=headers, **kwargs)
+            response = self.cache.update(url, response)
+        if response.status_code == 200 and "json" in response.headers.get(
+            "Content-Type", ""
+        ):
+            self.item_ids.learn(response.json())
+        return response
+
+    def cached(self, path, max_age=None):
+        """The last response received for a GET request to the Inventory
+        Manager API, without contacting it.
+
+        :param path: path of the resource
+        :param max_age: seconds since the response was last received or
+            revalidated, None to accept any age
+        :return: requests.Response or None
+        """
+        return self.cache.get(self.inventory_url + path, max_age)
+
+    def aux(self, method, path, **kwargs):
+        """Sends a request to the auxiliary API.
+
+        :param method: HTTP method, e.g. "POST"
+        :param path: path of the resource, e.g. "/api/qrRead/"
+        :return: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.aux_session.request(method, self.aux_url + path, **kwargs)
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        self.inventory_session.close()
+        self.aux_session.close()
+
+
+# the client shared by the whole application
+api_client = ApiClient()
@@ -4,9 +4,9 @@ This module is used to start and retrieve a Flask application complete with all
 
 import json
 import os
+import weakref
 
-from flasgger import Swagger
-from flask import Flask, Response, send_from_directory
+from flask import Flask, Response, request
 from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
 
@@ -16,6 +16,24 @@ from inventorymanager.constants import LINK_RELATIONS_URL, MASON, NAMESPACE
 db = SQLAlchemy()
 cache = Cache()
 
+# engines of the applications created in this process, held weakly so that
+# discarded applications can be collected
+_engines = weakref.WeakSet()
+
+
+def _dispose_engines() -> None:
+    """Drops the pooled connections inherited by a forked process, without
+    closing them, as they still belong to the parent.
+    """
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+# pooled connections must not be shared with forked worker processes, e.g.
+# with gunicorn --preload
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_engines)
+
 # Structure learned from the following sources:
 # https://flask-sqlalchemy.palletsprojects.com/en/3.0.x/quickstart/
 # https://www.digitalocean.com/community/tutorials/how-to-structure-a-large-flask-application-with-flask-blueprints-and-flask-sqlalchemy#the-target-application-structure
@@ -55,20 +73,99 @@ def create_app(test_config=None) -> Flask:
     except OSError:
         pass
 
+    # Settings applied to every SQLite connection. WAL lets readers and a
+    # writer work concurrently, and is safe with synchronous=NORMAL
+    app.config.setdefault(
+        "SQLITE_PRAGMAS",
+        {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+    )
+
+    # Connection pool of the engine. Every thread serving a request checks out
+    # its own connection, and pooled SQLite connections move between threads.
+    # In-memory databases are left to Flask-SQLAlchemy, which shares a single
+    # connection for them
+    uri = app.config["SQLALCHEMY_DATABASE_URI"]
+    engine_options = {}
+    if uri not in ("sqlite://", "sqlite:///:memory:"):
+        engine_options = {
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_timeout": 30,
+            "pool_pre_ping": True,
+        }
+        if uri.startswith("sqlite"):
+            engine_options["connect_args"] = {"check_same_thread": False}
+        else:
+            engine_options["pool_recycle"] = 1800
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options,
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+    }
+
+    # Requests, CLI commands and background threads each push their own
+    # application context, so every one of them gets its own session
     db.init_app(app)
-    app.app_context().push()
 
-    # Swagger
-    Swagger(app, template_file="doc/hub.yml")
+    from inventorymanager.models import init_sqlite_profile
+
+    with app.app_context():
+        init_sqlite_profile(app)
+        _engines.add(db.engine)
+
+    # Swagger UI at /apidocs/. The spec is compiled on its first request, or
+    # read from APIDOCS_SPEC when built with "flask build-apidocs". Production
+    # workers can leave it out with SWAGGER_ENABLED = False
+    app.config.setdefault("SWAGGER_ENABLED", True)
+    app.config.setdefault(
+        "APIDOCS_SPEC", os.path.join(app.instance_path, "openapi.json")
+    )
+    from inventorymanager.apidocs import (TEMPLATE_FILE, LazySwagger,
+                                          build_apidocs_command)
+
+    if app.config["SWAGGER_ENABLED"]:
+        LazySwagger(app, template_file=TEMPLATE_FILE)
 
     # Cache Initialization
-    app.config["CACHE_TYPE"] = "FileSystemCache"
-    if test_config is None or "CACHE_DIR" not in test_config:
-        app.config["CACHE_DIR"] = os.path.join(app.instance_path, "cache")
-    else:
-        app.config["CACHE_DIR"] = test_config["CACHE_DIR"]
+    # CACHE_TYPE selects the shared tier (e.g. "RedisCache" with CACHE_REDIS_URL
+    # when running several workers), CACHE_THRESHOLD bounds its number of
+    # entries, CACHE_LOCAL_SIZE bounds the in-process LRU tier and
+    # CACHE_TIMEOUTS maps endpoint names (e.g. "api.itemcollection") to TTLs
+    app.config.setdefault("CACHE_TYPE", "FileSystemCache")
+    app.config.setdefault("CACHE_DIR", os.path.join(app.instance_path, "cache"))
+    app.config.setdefault("CACHE_THRESHOLD", 1000)
+    app.config.setdefault("CACHE_DEFAULT_TIMEOUT", 300)
+    app.config.setdefault("CACHE_LOCAL_SIZE", 256)
+    # seconds a worker trusts the tag versions it read, before reading them
+    # again to see the invalidations made by other workers
+    app.config.setdefault("CACHE_TAG_VERSION_TTL", 1)
+    app.config.setdefault("CACHE_TIMEOUTS", {})
+    # seconds a stale entry of a read-mostly resource is served while it is
+    # regenerated in the background
+    app.config.setdefault(
+        "CACHE_STALE_TIMEOUTS",
+        {"api.cataloguecollection": 30, "api.warehousecollection": 30},
+    )
+    # seconds a worker may spend rendering a missing entry while the other
+    # workers wait for it
+    app.config.setdefault("CACHE_LOCK_TIMEOUT", 10)
+    # cache warm-up, see "flask warm-cache"
+    app.config.setdefault("CACHE_WARM_ON_STARTUP", False)
+    app.config.setdefault("CACHE_WARM_WORKERS", 4)
+    app.config.setdefault("CACHE_WARM_LIMIT", 100)
 
     cache.init_app(app)
+
+    from inventorymanager import caching
+
+    caching.init_app(app)
+
     # CLI commands to populate db
     from inventorymanager.models import (create_dummy_data,
                                          generate_catalogue_key,
@@ -77,6 +174,15 @@ def create_app(test_config=None) -> Flask:
     app.cli.add_command(init_db_command)
     app.cli.add_command(create_dummy_data)
     app.cli.add_command(generate_catalogue_key)
+    app.cli.add_command(caching.warm_cache_command)
+
+    from inventorymanager.queryplan import explain_queries_command
+
+    app.cli.add_command(explain_queries_command)
+    app.cli.add_command(build_apidocs_command)
+
+    # maximum number of requests in one /api/batch/ request
+    app.config.setdefault("BATCH_LIMIT", 20)
 
     from inventorymanager.api import api_bp
     from inventorymanager.utils import (ItemConverter, LocationConverter,
@@ -87,22 +193,38 @@ def create_app(test_config=None) -> Flask:
     app.url_map.converters["location"] = LocationConverter
     app.register_blueprint(api_bp)
 
+    # Request metrics, exposed at /metrics, and per request SQL query stats
+    # reported in headers and logs in debug mode or with QUERY_STATS
+    from inventorymanager import metrics
+
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.config.setdefault("QUERY_STATS", False)
+    if app.config["METRICS_ENABLED"]:
+        metrics.init_app(app)
+    metrics.init_query_stats(app)
+
     # Static routes related to profiles and link relations
     # from sensorhub project example and Exercise 3 material on Lovelace
+    # The pages are held in memory, see inventorymanager/staticpages.py
+    app.config.setdefault("STATIC_PAGES_MAX_AGE", 300)
+    from inventorymanager.staticpages import StaticPages
+
+    static_pages = StaticPages(app.static_folder, app.config["STATIC_PAGES_MAX_AGE"])
+
     @app.route("/profiles/<resource>/")
     def send_profile_html(resource):
         """
         Send the profile file
         :param resource: resource to send profile for
         """
-        return send_from_directory(app.static_folder, f"profiles/{resource}.html")
+        return static_pages.response(f"profiles/{resource}.html")
 
     @app.route(LINK_RELATIONS_URL)
     def send_link_relations_html():
         """
         Send the link relations file
         """
-        return send_from_directory(app.static_folder, "link-relations.html")
+        return static_pages.response("link-relations.html")
 
     from inventorymanager.builder import InventoryManagerBuilder
 
@@ -117,6 +239,26 @@ def create_app(test_config=None) -> Flask:
         body.add_control_all_warehouses()
         body.add_control_all_items()
         body.add_control_all_stock()
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        body.add_control_template("item", "api.itemitem", "Get item by name")
+        body.add_control_template(
+            "warehouse", "api.warehouseitem", "Get warehouse by ID"
+        )
+        body.add_control_template(
+            "stock-item", "api.stockitem", "Get stock of an item in a warehouse"
+        )
+        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response.add_etag()
+        return response.make_conditional(request)
+
+    # On-demand profiling of requests sent with the admin key and ?_profile=1
+    app.config.setdefault("PROFILING_ENABLED", True)
+    app.config.setdefault("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+    if app.config["PROFILING_ENABLED"]:
+        from inventorymanager.profiling import ProfilerMiddleware
+
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app)
+
+    if app.config["CACHE_WARM_ON_STARTUP"]:
+        caching.start_warm_up(app)
 
     return app
@@ -5,6 +5,7 @@ This module instantiates the Api object and adds to it all the endpoints for the
 from flask import Blueprint
 from flask_restful import Api
 
+from inventorymanager.resources.batch import Batch
 from inventorymanager.resources.catalogue import (CatalogueCollection,
                                                   CatalogueItem,
                                                   CatalogueItemCollection,
@@ -42,3 +43,5 @@ api.add_resource(StockWarehouseCollection, "/stocks/warehouse/<warehouse:warehou
 
 api.add_resource(LocationCollection, "/locations/")
 api.add_resource(LocationItem, "/locations/<location:location>/")
+
+api.add_resource(Batch, "/batch/")
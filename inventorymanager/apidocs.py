@@ -0,0 +1,117 @@
+"""
+This module contains the Swagger set-up of the API docs served at /apidocs/.
+The OpenAPI spec is compiled from the YAML files of inventorymanager/doc on the
+first request for it instead of when the app starts, and "flask build-apidocs"
+compiles it ahead of time into a JSON file that is then loaded as is.
+"""
+
+import json
+import os
+import threading
+
+import click
+from flasgger import Swagger
+from flask import current_app
+from flask.cli import with_appcontext
+
+SPEC_ENDPOINT = "apispec_1"
+TEMPLATE_FILE = "doc/hub.yml"
+
+
+class LazySwagger(Swagger):
+    """
+    Swagger extension deferring all the parsing of the API docs to the first
+    request of the spec. The spec is read from the APIDOCS_SPEC file when it
+    is newer than the docs and the code, and compiled otherwise.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app, decorators=None):
+        # the template is loaded along with the rest of the spec
+        template_file, self.template_file = self.template_file, None
+        super().init_app(app, decorators)
+        self.template_file = template_file
+
+    def get_apispecs(self, endpoint=SPEC_ENDPOINT):
+        if not self.app.debug and endpoint in self.apispecs:
+            return self.apispecs[endpoint]
+
+        with self._lock:
+            if not self.app.debug and endpoint in self.apispecs:
+                return self.apispecs[endpoint]
+            spec = None
+            if endpoint == SPEC_ENDPOINT:
+                spec = self.load_compiled(self.app.config["APIDOCS_SPEC"])
+            if spec is None:
+                return self.compile(endpoint)
+            self.apispecs[endpoint] = spec
+            return spec
+
+    def compile(self, endpoint=SPEC_ENDPOINT) -> dict:
+        """Compiles the spec from the YAML docs and the URL rules of the app.
+
+        :param endpoint: endpoint of the spec, defaults to SPEC_ENDPOINT
+        :return: the OpenAPI spec
+        """
+        if self.template is None and self.template_file is not None:
+            self.template = self.load_swagger_file(self.template_file)
+        self.apispecs.pop(endpoint, None)
+        return super().get_apispecs(endpoint)
+
+    def load_compiled(self, path: str):
+        """Reads a spec written by "flask build-apidocs", unless it is missing
+        or older than a file it was compiled from.
+
+        :param path: path of the JSON file
+        :return: the OpenAPI spec, or None
+        """
+        try:
+            built = os.path.getmtime(path)
+        except OSError:
+            return None
+        if built < source_mtime(self.app.root_path):
+            self.app.logger.warning(
+                "%s is older than the API docs, compiling them instead. "
+                "Rebuild it with flask build-apidocs",
+                path,
+            )
+            return None
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+
+
+def source_mtime(root_path: str) -> float:
+    """Latest modification time of the files the spec is compiled from, i.e.
+    the YAML docs and the modules defining the routes.
+
+    :param root_path: root directory of the inventorymanager package
+    :return: timestamp
+    """
+    latest = 0.0
+    for directory, _, files in os.walk(root_path):
+        for name in files:
+            if name.endswith((".yml", ".yaml", ".py")):
+                latest = max(latest, os.path.getmtime(os.path.join(directory, name)))
+    return latest
+
+
+@click.command("build-apidocs")
+@with_appcontext
+def build_apidocs_command() -> None:
+    """
+    Compiles the API docs into the APIDOCS_SPEC JSON file as click function
+    """
+    app = current_app._get_current_object()
+    swagger = getattr(app, "swag", None)
+    if swagger is None:
+        raise click.ClickException("Swagger is disabled, see SWAGGER_ENABLED")
+
+    spec = swagger.compile()
+    path = app.config["APIDOCS_SPEC"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(app.json.dumps(spec))
+    click.echo(f"Wrote {len(spec['paths'])} paths to {path}")
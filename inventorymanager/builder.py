@@ -3,11 +3,16 @@
     responses to the client. 
 """
 
-from flask import url_for
+import re
+
+from flask import current_app, request, url_for
 
 from inventorymanager.constants import NAMESPACE
 from inventorymanager.models import Item, Warehouse
 
+# variable of a URL rule, e.g. <item:item>
+RULE_VARIABLE = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
 
 # from https://github.com/enkwolf/pwp-course-sensorhub-api-example/tree/master
 class MasonBuilder(dict):
@@ -72,6 +77,21 @@ class MasonBuilder(dict):
         self["@controls"][ctrl_name] = kwargs
         self["@controls"][ctrl_name]["href"] = href
 
+    def add_embedded(self, name: str, value) -> None:
+        """
+        Adds a related resource inlined under the @embedded property, so that
+        clients don't need to follow the control leading to it. Also adds the
+        @embedded property if it doesn't exist on the object yet.
+
+        :param name: name of the related resource
+        :param value: the related resource, or a list of them
+        """
+
+        if "@embedded" not in self:
+            self["@embedded"] = {}
+
+        self["@embedded"][name] = value
+
     # https://github.com/lorenzo-medici/PWP_StudentManager/blob/main/studentmanager/builder.py#L150
     def add_control_post(self, ctrl_name, title, href, schema):
         """
@@ -258,6 +278,30 @@ class InventoryManagerBuilder(MasonBuilder):
             title="All stock entries for this warehouse",
         )
 
+    def add_control_template(self, relation: str, endpoint: str, title: str) -> None:
+        """Adds a control whose href is the URI template of an endpoint, e.g.
+        /api/items/{item}/, so that clients can expand it to reach a resource
+        directly instead of following links to it.
+
+        :param relation: link relation of the control, without namespace
+        :param endpoint: endpoint of the resource, e.g. "api.itemitem"
+        :param title: human-readable title for the control
+        """
+        rule = next(current_app.url_map.iter_rules(endpoint))
+        variables = sorted(rule.arguments)
+        self.add_control(
+            f"{NAMESPACE}:{relation}",
+            request.script_root + RULE_VARIABLE.sub(r"{\1}", rule.rule),
+            method="GET",
+            title=title,
+            isHrefTemplate=True,
+            schema={
+                "type": "object",
+                "properties": {name: {"type": "string"} for name in variables},
+                "required": variables,
+            },
+        )
+
     def add_control_all_catalogue_supplier(self, supplier) -> None:
         """Adds a control to the Mason object that links to the catalogue entries
         filtered by supplier name.
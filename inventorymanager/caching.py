@@ -0,0 +1,700 @@
+"""
+This module contains the tag based caching layer used by the resources.
+
+Every cached response records the tags it depends on: a table tag for
+collections ("item"), a row tag for single resources ("item:1") and column
+tags for filtered collections ("stock.item_id:1"). Each tag has a version
+token stored in the cache backend, and a cached response is only served while
+the versions it was rendered with are still current. Commits bump the versions
+of every tag touched by the flushed rows through SQLAlchemy session hooks, so
+only the affected entries are invalidated.
+
+Responses are kept in two tiers: a bounded in-process LRU tier in front of the
+configured shared cache backend. Tag versions live in the shared backend so
+that invalidations are seen by every worker. Each process keeps a copy of the
+versions it read for CACHE_TAG_VERSION_TTL seconds, so that serving an entry
+from the local tier doesn't read the backend. A version missing from the
+backend, e.g. pruned by FileSystemCache, makes the entries using it stale.
+
+Resources with a staleness window (CACHE_STALE_TIMEOUTS) keep serving an
+invalidated or expired entry for that many seconds while a background thread
+renders a fresh one.
+
+Cached responses carry an ETag hashed from their body and a Last-Modified
+date taken from their newest tag version, so clients can revalidate them with
+If-None-Match or If-Modified-Since and get a 304 while nothing changed.
+"""
+
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import chain
+
+import click
+from flask import Flask, Response, current_app, g, has_app_context, request, url_for
+from flask.cli import with_appcontext
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from inventorymanager import cache
+from inventorymanager.utils import request_path_cache_key
+
+TAG_VERSION_PREFIX = "tag-version:"
+PENDING_TAGS = "pending_cache_tags"
+LOCK_PREFIX = "render-lock:"
+LOCK_POLL_INTERVAL = 0.05
+LOCAL_CACHE = "local_response_cache"
+LOCAL_TAG_VERSIONS = "local_tag_versions"
+LOCAL_TAG_VERSIONS_SIZE = 4096
+REVALIDATE_ENVIRON = "inventorymanager.cache_revalidate"
+
+# collections rendered by the cache warm-up, their members are warmed as well
+WARM_COLLECTIONS = (
+    "api.itemcollection",
+    "api.warehousecollection",
+    "api.cataloguecollection",
+    "api.locationcollection",
+    "api.stockcollection",
+)
+
+
+class LocalLRUCache:
+    """
+    Bounded, thread safe in-process cache for response entries. The least
+    recently used entry is evicted once max_size entries are stored, and
+    entries past their expiry time and staleness window are never returned.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the entry stored under key, or None if missing or expired.
+
+        :param key: cache key
+        :return: entry dictionary or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires = entry["expires"]
+            if expires is not None and expires + entry["stale"] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: dict) -> None:
+        """Stores an entry, evicting the least recently used ones if needed.
+
+        :param key: cache key
+        :param entry: entry dictionary with an "expires" timestamp or None and
+            a "stale" window in seconds
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalTagVersions:
+    """
+    Bounded, thread safe in-process copy of tag versions read from the shared
+    backend. A version is used for ttl seconds after it was read, or after
+    this process changed it.
+    """
+
+    def __init__(self, ttl: float, max_size: int = LOCAL_TAG_VERSIONS_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, tags) -> tuple:
+        """Looks up the versions of several tags.
+
+        :param tags: list of tag strings
+        :return: tuple of a dictionary of the known versions and a list of the
+            tags whose version is unknown or too old
+        """
+        now = time.monotonic()
+        known = {}
+        unknown = []
+        with self._lock:
+            for tag in tags:
+                entry = self._versions.get(tag)
+                if entry is not None and now - entry[1] < self.ttl:
+                    known[tag] = entry[0]
+                else:
+                    unknown.append(tag)
+        return known, unknown
+
+    def update(self, versions: dict) -> None:
+        """Stores versions read from or written to the shared backend.
+
+        :param versions: dictionary mapping tags to versions
+        """
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for tag, version in versions.items():
+                self._versions[tag] = (version, now)
+                self._versions.move_to_end(tag)
+            while len(self._versions) > self.max_size:
+                self._versions.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes every version."""
+        with self._lock:
+            self._versions.clear()
+
+
+def init_app(app: Flask) -> None:
+    """Sets up the in-process tier for the given application. Must be called
+    after the shared cache has been initialized.
+
+    :param app: Flask application
+    """
+    app.extensions[LOCAL_CACHE] = LocalLRUCache(app.config["CACHE_LOCAL_SIZE"])
+    app.extensions[LOCAL_TAG_VERSIONS] = LocalTagVersions(
+        app.config["CACHE_TAG_VERSION_TTL"]
+    )
+
+
+def table_tag(model) -> str:
+    """Tag for everything stored in the table of a model.
+
+    :param model: model class or instance
+    :return: tag string, e.g. "item"
+    """
+    return model.__table__.name
+
+
+def row_tag(obj) -> str:
+    """Tag for a single row, built from its primary key.
+
+    :param obj: model instance
+    :return: tag string, e.g. "stock:1,2"
+    """
+    mapper = inspect(obj).mapper
+    values = mapper.primary_key_from_instance(obj)
+    return _row_tag(mapper.local_table.name, values)
+
+
+def column_tag(model, column: str, value) -> str:
+    """Tag for the rows of a table that have the given value in a column.
+
+    :param model: model class or instance
+    :param column: column name
+    :param value: column value
+    :return: tag string, e.g. "stock.item_id:1"
+    """
+    return _column_tag(model.__table__.name, column, value)
+
+
+def add_cache_tags(*tags) -> None:
+    """Adds tags to the response currently being rendered by a cached resource.
+    Used for dependencies only known while rendering, e.g. the items listed
+    in a collection.
+
+    :param tags: tag strings
+    """
+    if "cache_tags" in g:
+        g.cache_tags.update(tags)
+
+
+def cached_resource(*tags, timeout=None, stale=0):
+    """Decorator that caches the response of a GET method under the request path.
+    Only 200 responses are cached.
+
+    :param tags: tag strings, or callables that receive the view arguments as
+        keyword arguments and return an iterable of tags
+    :param timeout: cache timeout, overridden by the CACHE_TIMEOUTS entry of
+        the endpoint and defaulting to CACHE_DEFAULT_TIMEOUT
+    :param stale: seconds a stale entry is served while it is regenerated,
+        overridden by the CACHE_STALE_TIMEOUTS entry of the endpoint
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = request_path_cache_key(*args, **kwargs)
+            window = _endpoint_setting("CACHE_STALE_TIMEOUTS", stale)
+            render = partial(
+                _render_entry, cache_key, tags, timeout, window, func, args, kwargs
+            )
+
+            if request.environ.get(REVALIDATE_ENVIRON):
+                response = render()
+            else:
+                entry, stale_since = _lookup(cache_key)
+                if entry is not None and stale_since is None:
+                    response = _entry_response(entry)
+                elif entry is not None and time.time() - stale_since < window:
+                    _revalidate_in_background(cache_key)
+                    response = _entry_response(entry)
+                else:
+                    response = _single_flight(cache_key, render)
+
+            if window:
+                response.headers["Cache-Control"] = (
+                    f"max-age=0, stale-while-revalidate={window}"
+                )
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate_tags(tags) -> None:
+    """Invalidates every cached response that depends on any of the tags.
+
+    :param tags: iterable of tag strings
+    """
+    versions = {tag: _new_version() for tag in tags}
+    cache.set_many(
+        {TAG_VERSION_PREFIX + tag: version for tag, version in versions.items()},
+        timeout=0,
+    )
+    _local_tag_versions().update(versions)
+
+
+def warm_cache(app: Flask) -> tuple:
+    """Renders every cached collection, and the first CACHE_WARM_LIMIT members
+    of each, into the configured cache. Requests go through the test client on
+    a pool of CACHE_WARM_WORKERS threads.
+
+    :param app: Flask application
+    :return: tuple of the number of rendered resources and the elapsed seconds
+    """
+    start = time.perf_counter()
+    with app.test_request_context():
+        collections = [url_for(endpoint) for endpoint in WARM_COLLECTIONS]
+
+    limit = app.config["CACHE_WARM_LIMIT"]
+    render = partial(_warm_resource, app)
+    with ThreadPoolExecutor(max_workers=app.config["CACHE_WARM_WORKERS"]) as pool:
+        members = []
+        for body in pool.map(render, collections):
+            for value in body.values():
+                if isinstance(value, list):
+                    members.extend(
+                        member["@controls"]["self"]["href"] for member in value[:limit]
+                    )
+        list(pool.map(render, members))
+
+    return len(collections) + len(members), time.perf_counter() - start
+
+
+def start_warm_up(app: Flask) -> threading.Thread:
+    """Warms the cache on a background thread so that startup isn't delayed.
+
+    :param app: Flask application
+    :return: the started thread
+    """
+
+    def run():
+        try:
+            count, elapsed = warm_cache(app)
+            app.logger.info("Warmed %d cached resources in %.2f s", count, elapsed)
+        except Exception:  # pylint: disable=broad-exception-caught
+            app.logger.exception("Cache warm-up failed")
+
+    thread = threading.Thread(target=run, name="cache-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_resource(app: Flask, path: str) -> dict:
+    response = app.test_client().get(path)
+    if response.status_code != 200:
+        app.logger.warning(
+            "Cache warm-up of %s returned %d", path, response.status_code
+        )
+        return {}
+    return json.loads(response.data)
+
+
+def _local_cache() -> LocalLRUCache:
+    return current_app.extensions[LOCAL_CACHE]
+
+
+def _local_tag_versions() -> LocalTagVersions:
+    return current_app.extensions[LOCAL_TAG_VERSIONS]
+
+
+class _KeyLocks:
+    """
+    Per-key locks of this process. Locks are created on demand and dropped
+    once no thread holds or waits for them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, key: str):
+        """Context manager holding the lock of the given key.
+
+        :param key: cache key
+        """
+        with self._lock:
+            lock_entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            lock_entry[1] += 1
+        try:
+            with lock_entry[0]:
+                yield
+        finally:
+            with self._lock:
+                lock_entry[1] -= 1
+                if not lock_entry[1]:
+                    del self._locks[key]
+
+
+_key_locks = _KeyLocks()
+
+
+def _single_flight(cache_key: str, render) -> Response:
+    """Renders a missing entry unless another thread or process is already
+    rendering it, in which case its result is waited for. Threads of this
+    process are coordinated with a per-key lock, processes with a short-lived
+    lock entry in the shared backend.
+
+    :param cache_key: cache key
+    :param render: function rendering and storing the response
+    :return: Response
+    """
+    with _key_locks.hold(cache_key):
+        entry = _fresh_entry(cache_key)
+        if entry is not None:
+            return _entry_response(entry)
+
+        lock_key = LOCK_PREFIX + cache_key
+        lock_timeout = current_app.config["CACHE_LOCK_TIMEOUT"]
+        token = secrets.token_hex(8)
+        if not cache.add(lock_key, token, timeout=lock_timeout):
+            entry = _wait_for_entry(cache_key, lock_key, lock_timeout)
+            if entry is not None:
+                return _entry_response(entry)
+            # the other process failed or is too slow, render it here
+            token = None
+        try:
+            return render()
+        finally:
+            if token is not None and cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+
+def _wait_for_entry(cache_key: str, lock_key: str, lock_timeout: int):
+    """Polls for an entry being rendered by another process.
+
+    :param cache_key: cache key
+    :param lock_key: key of the lock entry held by the other process
+    :param lock_timeout: maximum number of seconds to wait
+    :return: entry dictionary, or None if the lock was released without a
+        valid entry or the wait timed out
+    """
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = _fresh_entry(cache_key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            return None
+    return None
+
+
+def _revalidate_in_background(cache_key: str) -> None:
+    """Renders a fresh version of the current request on a background thread,
+    unless another thread or process is already rendering it.
+
+    :param cache_key: cache key
+    """
+    app = current_app._get_current_object()
+    lock_key = LOCK_PREFIX + cache_key
+    token = secrets.token_hex(8)
+    if not cache.add(lock_key, token, timeout=app.config["CACHE_LOCK_TIMEOUT"]):
+        return
+    path = request.full_path
+
+    def run():
+        try:
+            app.test_client().get(path, environ_overrides={REVALIDATE_ENVIRON: True})
+        except Exception:  # pylint: disable=broad-exception-caught
+            app.logger.exception("Revalidation of %s failed", path)
+        finally:
+            with app.app_context():
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+    threading.Thread(target=run, name="cache-revalidate", daemon=True).start()
+
+
+def _render_entry(
+    cache_key: str, tags, timeout, window: int, func, args, kwargs
+) -> Response:
+    """Renders the response of a cached resource and stores it if it is a 200.
+
+    :return: Response
+    """
+    static_tags = set()
+    for tag in tags:
+        if callable(tag):
+            static_tags.update(tag(**kwargs))
+        else:
+            static_tags.add(tag)
+    # versions are read before rendering so that a commit happening
+    # during the rendering makes the stored entry stale right away
+    versions = _tag_versions(static_tags)
+
+    g.cache_tags = set()
+    try:
+        response = func(*args, **kwargs)
+        dynamic_tags = g.cache_tags - static_tags
+    finally:
+        g.pop("cache_tags", None)
+
+    if response.status_code == 200:
+        versions.update(_tag_versions(dynamic_tags))
+        # validators, stored with the entry
+        response.add_etag()
+        times = [_version_time(version) for version in versions.values() if version]
+        if times:
+            response.last_modified = max(times)
+        entry_timeout = _endpoint_setting("CACHE_TIMEOUTS", timeout)
+        if entry_timeout is None:
+            entry_timeout = current_app.config["CACHE_DEFAULT_TIMEOUT"]
+        entry = {
+            "body": response.get_data(),
+            "status": response.status_code,
+            "headers": list(response.headers.items()),
+            "tags": versions,
+            "expires": time.time() + entry_timeout if entry_timeout else None,
+            "stale": window,
+        }
+        _local_cache().set(cache_key, entry)
+        cache.set(
+            cache_key, entry, timeout=entry_timeout + window if entry_timeout else 0
+        )
+    return response
+
+
+def _entry_response(entry: dict) -> Response:
+    return Response(entry["body"], entry["status"], entry["headers"])
+
+
+def _stale_since(entry: dict):
+    """Time at which an entry became stale, either because one of its tags was
+    invalidated or because it expired. An entry is stale from now on if the
+    version of one of its tags is missing, as its changes can't be tracked.
+
+    :param entry: entry dictionary
+    :return: timestamp, or None if the entry is fresh
+    """
+    current = _tag_versions(entry["tags"])
+    changed = []
+    for tag, version in current.items():
+        if version is None or entry["tags"][tag] is None:
+            changed.append(time.time())
+        elif version != entry["tags"][tag]:
+            changed.append(_version_time(version))
+    if changed:
+        return max(changed)
+    if entry["expires"] is not None and entry["expires"] <= time.time():
+        return entry["expires"]
+    return None
+
+
+def _lookup(cache_key: str) -> tuple:
+    """Reads an entry from the local tier, or else from the shared tier,
+    copying fresh shared entries into the local tier.
+
+    :param cache_key: cache key
+    :return: tuple of the entry (or None) and the time it became stale (or
+        None if it is fresh)
+    """
+    local_entry = _local_cache().get(cache_key)
+    if local_entry is not None:
+        local_stale_since = _stale_since(local_entry)
+        if local_stale_since is None:
+            return local_entry, None
+
+    entry = cache.get(cache_key)
+    if entry is not None:
+        stale_since = _stale_since(entry)
+        if stale_since is None:
+            _local_cache().set(cache_key, entry)
+        return entry, stale_since
+
+    if local_entry is not None:
+        return local_entry, local_stale_since
+    return None, None
+
+
+def _fresh_entry(cache_key: str):
+    entry, stale_since = _lookup(cache_key)
+    return entry if stale_since is None else None
+
+
+def _endpoint_setting(name: str, default):
+    """Reads the entry of the current endpoint from a configuration mapping
+    such as CACHE_TIMEOUTS.
+
+    :param name: configuration key
+    :param default: value used if the endpoint has no entry
+    :return: configured value
+    """
+    return current_app.config[name].get(request.endpoint, default)
+
+
+def _new_version() -> str:
+    return f"{time.time():.6f}-{secrets.token_hex(4)}"
+
+
+def _version_time(version: str) -> float:
+    return float(version.split("-")[0])
+
+
+def _row_tag(table: str, values) -> str:
+    return f"{table}:" + ",".join(str(value) for value in values)
+
+
+def _column_tag(table: str, column: str, value) -> str:
+    return f"{table}.{column}:{value}"
+
+
+def _tag_versions(tags) -> dict:
+    """Reads the current version of each tag, from the local copy if it is
+    recent enough and else from the shared backend, creating missing ones.
+
+    :param tags: iterable of tag strings
+    :return: dictionary mapping tags to versions, None for a version the
+        backend couldn't store
+    """
+    tags = list(tags)
+    if not tags:
+        return {}
+    local_versions = _local_tag_versions()
+    versions, unknown = local_versions.get_many(tags)
+    if not unknown:
+        return versions
+
+    keys = [TAG_VERSION_PREFIX + tag for tag in unknown]
+    read = cache.get_many(*keys)
+    missing = [key for key, version in zip(keys, read) if version is None]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), timeout=0)
+        read = cache.get_many(*keys)
+    read = dict(zip(unknown, read))
+    local_versions.update(
+        {tag: version for tag, version in read.items() if version is not None}
+    )
+    versions.update(read)
+    return versions
+
+
+def _changed_row_tags(obj, modified_only: bool = False) -> set:
+    """Tags affected by a new, modified or deleted row, using both the old and
+    the new column values.
+
+    :param obj: flushed model instance
+    :param modified_only: return nothing if no column value changed
+    :return: set of tags
+    """
+    state = inspect(obj)
+    mapper = state.mapper
+    table = mapper.local_table.name
+
+    new_values = {}
+    old_values = {}
+    changed = False
+    for attr in mapper.column_attrs:
+        column = attr.columns[0].name
+        history = state.attrs[attr.key].history
+        new_values[column] = getattr(obj, attr.key)
+        if history.deleted and history.deleted[0] is not None:
+            old_values[column] = history.deleted[0]
+            changed = True
+        else:
+            old_values[column] = new_values[column]
+        changed = changed or bool(history.added)
+
+    if modified_only and not changed:
+        return set()
+
+    tags = {table}
+    pk_columns = [column.name for column in mapper.local_table.primary_key]
+    for values in (new_values, old_values):
+        tags.add(_row_tag(table, [values[column] for column in pk_columns]))
+        tags.update(
+            _column_tag(table, column, value) for column, value in values.items()
+        )
+    return tags
+
+
+@event.listens_for(Session, "after_flush")
+def collect_cache_tags(session, flush_context):
+    """
+    Called after each flush. Records the tags of the flushed rows until the
+    transaction is committed or rolled back.
+    """
+    tags = session.info.setdefault(PENDING_TAGS, set())
+    for obj in chain(session.new, session.deleted):
+        tags.update(_changed_row_tags(obj))
+    for obj in session.dirty:
+        tags.update(_changed_row_tags(obj, modified_only=True))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_tags(session):
+    """
+    Called after a commit. Invalidates the cached responses depending on the
+    committed rows.
+    """
+    tags = session.info.pop(PENDING_TAGS, None)
+    if tags and has_app_context():
+        invalidate_tags(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_pending_tags(session):
+    """
+    Called after a rollback. Nothing was written so nothing is invalidated.
+    """
+    session.info.pop(PENDING_TAGS, None)
+
+
+@click.command("warm-cache")
+@with_appcontext
+def warm_cache_command() -> None:
+    """
+    Renders the cached collections and their members into the cache as click
+    function. Only useful with a shared cache backend such as FileSystemCache
+    or RedisCache, as the in-process tier dies with the command.
+    """
+    count, elapsed = warm_cache(current_app._get_current_object())
+    click.echo(f"Warmed {count} cached resources in {elapsed:.2f} s")
@@ -2,9 +2,12 @@
 This module contains constants used by the API
 """
 
+import os
+
 MASON = "application/vnd.mason+json"
 LINK_RELATIONS_URL = "/inventorymanager/link-relations/"
-DOC_FOLDER = "/inventorymanager/doc/"
+# absolute, so that the API docs load whatever the working directory is
+DOC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc", "")
 
 # profile paths for all resources
 ITEM_PROFILE = "/profiles/item/"
@@ -16,4 +19,7 @@ ERROR_PROFILE = "/profiles/error/"
 
 NAMESPACE = "invmanager"
 
+# WSGI environ key holding the [query count, database seconds] of a request
+QUERY_STATS_ENVIRON = "inventorymanager.query_stats"
+
 # MEASUREMENT_PAGE_SIZE = 50
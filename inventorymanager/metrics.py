@@ -0,0 +1,308 @@
+"""
+This module contains the request instrumentation of the API. Latency
+histograms, status counts, response sizes and in-flight gauges are recorded
+per endpoint and method, and exposed in the Prometheus text format at /metrics.
+The number of SQL queries and the database time of each request can also be
+reported in response headers and logs.
+
+Each thread writes to its own shard of counters, so recording a request never
+takes a lock. Shards are only merged when /metrics is scraped, and the shard of
+a thread that exited is merged into a base aggregate so they don't pile up.
+
+Latency is measured from the moment the WSGI app is called, so that the
+database lookups of the URL converters are included.
+"""
+
+import json
+import threading
+import time
+import weakref
+
+from flask import Flask, Response, g, request
+
+from inventorymanager.constants import QUERY_STATS_ENVIRON
+
+METRICS_URL = "/metrics"
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "inventorymanager"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# WSGI environ key holding the perf_counter() value at which a request arrived
+REQUEST_START_ENVIRON = "inventorymanager.request_start"
+
+
+class _Shard:
+    """Counters written by a single thread."""
+
+    def __init__(self):
+        # (endpoint, method) -> [bucket counts..., latency sum, count, size sum]
+        self.requests = {}
+        # (endpoint, method, status) -> count
+        self.statuses = {}
+        # (endpoint, method) -> started - finished
+        self.in_flight = {}
+
+    def merge(self, other: "_Shard") -> None:
+        """Adds the counters of another shard to this one.
+
+        :param other: shard to add
+        """
+        for key, values in list(other.requests.items()):
+            merged = self.requests.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+        for key, count in list(other.statuses.items()):
+            self.statuses[key] = self.statuses.get(key, 0) + count
+        for key, count in list(other.in_flight.items()):
+            self.in_flight[key] = self.in_flight.get(key, 0) + count
+
+
+class _ShardHolder:
+    """Thread-local reference to a shard, dropped when its thread exits."""
+
+    def __init__(self, shard: _Shard):
+        self.shard = shard
+
+
+def _retire(shards: list, base: _Shard, lock: threading.Lock, shard: _Shard) -> None:
+    """Merges the shard of an exited thread into the base aggregate."""
+    with lock:
+        shards.remove(shard)
+        base.merge(shard)
+
+
+class RequestMetrics:
+    """
+    Per-thread request aggregates. Threads register their shard once, on
+    their first request, everything else is lock free.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._base = _Shard()
+        self._register_lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            shard = _Shard()
+            holder = self._local.holder = _ShardHolder(shard)
+            with self._register_lock:
+                self._shards.append(shard)
+            weakref.finalize(
+                holder, _retire, self._shards, self._base, self._register_lock, shard
+            )
+        return holder.shard
+
+    def started(self, endpoint: str, method: str) -> None:
+        """Records the start of a request.
+
+        :param endpoint: endpoint name
+        :param method: HTTP method
+        """
+        in_flight = self._shard().in_flight
+        key = (endpoint, method)
+        in_flight[key] = in_flight.get(key, 0) + 1
+
+    def finished(self, endpoint: str, method: str) -> None:
+        """Records the end of a request, whatever its outcome.
+
+        :param endpoint: endpoint name
+        :param method: HTTP method
+        """
+        in_flight = self._shard().in_flight
+        key = (endpoint, method)
+        in_flight[key] = in_flight.get(key, 0) - 1
+
+    def observe(
+        self, endpoint: str, method: str, status: int, seconds: float, size: int
+    ) -> None:
+        """Records the outcome of a request.
+
+        :param endpoint: endpoint name
+        :param method: HTTP method
+        :param status: response status code
+        :param seconds: request latency
+        :param size: response body size in bytes
+        """
+        shard = self._shard()
+        key = (endpoint, method)
+        values = shard.requests.get(key)
+        if values is None:
+            values = shard.requests[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                values[index] += 1
+        values[-3] += seconds
+        values[-2] += 1
+        values[-1] += size
+
+        status_key = (endpoint, method, status)
+        shard.statuses[status_key] = shard.statuses.get(status_key, 0) + 1
+
+    def collect(self) -> tuple:
+        """Merges the shards of every thread.
+
+        :return: tuple of the merged requests, statuses and in-flight dictionaries
+        """
+        merged = _Shard()
+        with self._register_lock:
+            merged.merge(self._base)
+            for shard in self._shards:
+                merged.merge(shard)
+        return merged.requests, merged.statuses, merged.in_flight
+
+    def render(self) -> str:
+        """Renders the merged metrics in the Prometheus text format.
+
+        :return: metrics document
+        """
+        requests, statuses, in_flight = self.collect()
+        lines = [
+            f"# HELP {PREFIX}_request_duration_seconds Request latency",
+            f"# TYPE {PREFIX}_request_duration_seconds histogram",
+        ]
+        for (endpoint, method), values in sorted(requests.items()):
+            labels = _labels(endpoint=endpoint, method=method)
+            for bound, count in zip(LATENCY_BUCKETS, values):
+                lines.append(
+                    f"{PREFIX}_request_duration_seconds_bucket"
+                    f"{_labels(endpoint=endpoint, method=method, le=bound)} {count}"
+                )
+            lines.append(
+                f"{PREFIX}_request_duration_seconds_bucket"
+                f"{_labels(endpoint=endpoint, method=method, le='+Inf')} {values[-2]}"
+            )
+            lines.append(f"{PREFIX}_request_duration_seconds_sum{labels} {values[-3]}")
+            lines.append(
+                f"{PREFIX}_request_duration_seconds_count{labels} {values[-2]}"
+            )
+
+        lines += [
+            f"# HELP {PREFIX}_response_size_bytes Response body size",
+            f"# TYPE {PREFIX}_response_size_bytes summary",
+        ]
+        for (endpoint, method), values in sorted(requests.items()):
+            labels = _labels(endpoint=endpoint, method=method)
+            lines.append(f"{PREFIX}_response_size_bytes_sum{labels} {values[-1]}")
+            lines.append(f"{PREFIX}_response_size_bytes_count{labels} {values[-2]}")
+
+        lines += [
+            f"# HELP {PREFIX}_requests_total Requests by status code",
+            f"# TYPE {PREFIX}_requests_total counter",
+        ]
+        for (endpoint, method, status), count in sorted(statuses.items()):
+            labels = _labels(endpoint=endpoint, method=method, status=status)
+            lines.append(f"{PREFIX}_requests_total{labels} {count}")
+
+        lines += [
+            f"# HELP {PREFIX}_requests_in_flight Requests being processed",
+            f"# TYPE {PREFIX}_requests_in_flight gauge",
+        ]
+        for (endpoint, method), count in sorted(in_flight.items()):
+            labels = _labels(endpoint=endpoint, method=method)
+            lines.append(f"{PREFIX}_requests_in_flight{labels} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def _endpoint() -> str:
+    return request.endpoint or "unmatched"
+
+
+class TimingMiddleware:
+    """
+    WSGI middleware recording when a request arrived, before Flask matches its
+    URL and runs the converters.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        environ[REQUEST_START_ENVIRON] = time.perf_counter()
+        return self.wsgi_app(environ, start_response)
+
+
+def init_app(app: Flask) -> RequestMetrics:
+    """Registers the request instrumentation and the /metrics route.
+
+    :param app: Flask application
+    :return: the metrics of the application
+    """
+    metrics = RequestMetrics()
+    app.extensions["metrics"] = metrics
+    app.wsgi_app = TimingMiddleware(app.wsgi_app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = request.environ.get(
+            REQUEST_START_ENVIRON, time.perf_counter()
+        )
+        metrics.started(_endpoint(), request.method)
+
+    @app.after_request
+    def record_request(response):
+        if "request_start" in g:
+            size = response.calculate_content_length() or 0
+            metrics.observe(
+                _endpoint(),
+                request.method,
+                response.status_code,
+                time.perf_counter() - g.request_start,
+                size,
+            )
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        if g.pop("request_start", None) is not None:
+            metrics.finished(_endpoint(), request.method)
+
+    @app.route(METRICS_URL)
+    def send_metrics() -> Response:
+        """
+        Send the request metrics in the Prometheus text format
+        """
+        return Response(metrics.render(), 200, content_type=PROMETHEUS)
+
+    return metrics
+
+
+def init_query_stats(app: Flask) -> None:
+    """Reports the number of SQL queries and the database time of each request,
+    counted by the cursor listeners in models.py, as X-Query-Count and
+    Server-Timing headers and as a JSON log line. Only active in debug mode or
+    when QUERY_STATS is set.
+
+    :param app: Flask application
+    """
+
+    @app.after_request
+    def report_query_stats(response):
+        if not (app.debug or app.config["QUERY_STATS"]):
+            return response
+        count, seconds = request.environ.get(QUERY_STATS_ENVIRON, (0, 0.0))
+        duration = seconds * 1000
+        response.headers["X-Query-Count"] = str(count)
+        response.headers.add(
+            "Server-Timing", f'db;dur={duration:.2f};desc="{count} queries"'
+        )
+        app.logger.info(
+            json.dumps(
+                {
+                    "event": "query_stats",
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": request.endpoint,
+                    "status": response.status_code,
+                    "queries": count,
+                    "db_ms": round(duration, 2),
+                }
+            )
+        )
+        return response
@@ -11,14 +11,20 @@ The functions are responsible for initiliazing and populating the database
 """
 
 import hashlib
+import json
+import random
 import secrets
+import time
+from itertools import islice
 
 import click
+from flask import Flask, has_request_context, request
 from flask.cli import with_appcontext
-from sqlalchemy import CheckConstraint, event, text
+from sqlalchemy import CheckConstraint, event, func, insert, select, text
 from sqlalchemy.engine import Engine
 
 from inventorymanager import db
+from inventorymanager.constants import QUERY_STATS_ENVIRON
 
 
 # from the Exercise 1 webpage
@@ -34,6 +40,110 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor.close()
 
 
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """
+    Called before a query is executed. Records its start time on the execution
+    context, which is discarded with the statement even if it fails.
+    """
+    if context is not None:
+        context.query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    """
+    Called after a query is executed. Adds it to the query count and the
+    database time of the current request.
+    """
+    started = getattr(context, "query_start_time", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    if has_request_context():
+        stats = request.environ.setdefault(QUERY_STATS_ENVIRON, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+# endpoints that only read whatever their method, e.g. the batch endpoint
+# dispatching GET requests through POST
+READ_ENDPOINTS = ("api.batch",)
+# values PRAGMA returns for the named settings
+SQLITE_PRAGMA_VALUES = {
+    "synchronous": {"OFF": 0, "NORMAL": 1, "FULL": 2, "EXTRA": 3},
+    "temp_store": {"DEFAULT": 0, "FILE": 1, "MEMORY": 2},
+}
+
+
+def init_sqlite_profile(app: Flask) -> dict:
+    """
+    Applies the SQLITE_PRAGMAS of the application to every new connection of
+    its engine, then reads them back from a fresh connection and logs the
+    effective settings. A warning is logged for each setting SQLite did not
+    accept, e.g. journal_mode=WAL on an in-memory database.
+    Transactions of requests that may write are started with BEGIN IMMEDIATE.
+    :param app: Flask application, with an application context pushed
+    :return: dictionary of the effective settings, empty if not using SQLite
+    """
+    engine = db.engine
+    pragmas = app.config["SQLITE_PRAGMAS"]
+    if engine.dialect.name != "sqlite":
+        return {}
+
+    @event.listens_for(engine, "connect")
+    def apply_sqlite_profile(dbapi_connection, connection_record):
+        """
+        Called when a connection to the database is established.
+        Applies the configured performance settings, and leaves starting
+        transactions to begin_sqlite_transaction instead of the driver.
+        """
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+            cursor.fetchall()
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin_sqlite_transaction(conn):
+        """
+        Called when a transaction starts. Requests that may write take the
+        write lock right away, so that concurrent writers wait for each other
+        (up to busy_timeout) instead of failing when the snapshot they read
+        is outdated by the time they write. Read-only endpoints don't, so
+        that they don't hold writers up.
+        """
+        write = (
+            has_request_context()
+            and request.method not in READ_METHODS
+            and request.endpoint not in READ_ENDPOINTS
+        )
+        conn.connection.driver_connection.execute(
+            "BEGIN IMMEDIATE" if write else "BEGIN"
+        )
+
+    if not pragmas:
+        return {}
+    with engine.connect() as connection:
+        effective = {
+            name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in pragmas
+        }
+    app.logger.info("SQLite settings: %s", json.dumps(effective))
+    for name, value in pragmas.items():
+        expected = SQLITE_PRAGMA_VALUES.get(name, {}).get(str(value).upper(), value)
+        if str(effective[name]).lower() != str(expected).lower():
+            app.logger.warning(
+                "SQLite ignored %s=%s, the effective value is %s",
+                name,
+                value,
+                effective[name],
+            )
+    return effective
+
+
 # Location model
 class Location(db.Model):
     """Location class for the database."""
@@ -129,6 +239,7 @@ class Warehouse(db.Model):
         db.Integer,
         db.ForeignKey("location.location_id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
 
     api_key = db.relationship("ApiKey", back_populates="warehouse", uselist=False)
@@ -189,7 +300,7 @@ class Item(db.Model):
 
     item_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False, unique=True)
-    category = db.Column(db.String(64), nullable=True)
+    category = db.Column(db.String(64), nullable=True, index=True)
     weight = db.Column(db.Float, nullable=True)
 
     stock = db.relationship(
@@ -253,10 +364,13 @@ class Stock(db.Model):
     item_id = db.Column(
         db.Integer, db.ForeignKey("item.item_id", ondelete="RESTRICT"), primary_key=True
     )
+    # second in the primary key, so it needs its own index for the stock of a
+    # warehouse
     warehouse_id = db.Column(
         db.Integer,
         db.ForeignKey("warehouse.warehouse_id", ondelete="CASCADE"),
         primary_key=True,
+        index=True,
     )
     # quantity should be >= 0
     quantity = db.Column(db.Integer, nullable=False)
@@ -324,7 +438,7 @@ class Catalogue(db.Model):
     item_id = db.Column(
         db.Integer, db.ForeignKey("item.item_id", ondelete="CASCADE"), primary_key=True
     )
-    supplier_name = db.Column(db.String(64), primary_key=True)
+    supplier_name = db.Column(db.String(64), primary_key=True, index=True)
     min_order = db.Column(db.Integer, nullable=False)
     order_price = db.Column(db.Float, nullable=True)
 
@@ -388,9 +502,9 @@ class ApiKey(db.Model):
 
     key = db.Column(db.String(32), nullable=False, unique=True, primary_key=True)
     warehouse_id = db.Column(
-        db.Integer, db.ForeignKey("warehouse.warehouse_id"), nullable=True
+        db.Integer, db.ForeignKey("warehouse.warehouse_id"), nullable=True, index=True
     )
-    admin = db.Column(db.Boolean, default=False)
+    admin = db.Column(db.Boolean, default=False, index=True)
 
     warehouse = db.relationship("Warehouse", back_populates="api_key", uselist=False)
 
@@ -408,18 +522,50 @@ class ApiKey(db.Model):
 @with_appcontext
 def init_db_command() -> None:
     """
-    Initializes the database
+    Initializes the database, adding the indexes missing from existing tables
     """
     db.create_all()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
 
 @click.command("populate-db")
+@click.option(
+    "--scale",
+    is_flag=True,
+    help="Generate a synthetic dataset of the given size instead of the dummy data.",
+)
+@click.option("--locations", default=100, show_default=True)
+@click.option("--warehouses", default=1000, show_default=True)
+@click.option("--items", default=50000, show_default=True)
+@click.option(
+    "--stock-density",
+    default=0.02,
+    show_default=True,
+    help="Fraction of the warehouses stocking each item.",
+)
+@click.option("--suppliers", default=200, show_default=True)
+@click.option("--suppliers-per-item", default=2, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option(
+    "--chunk-size", default=50000, show_default=True, help="Rows per transaction."
+)
 @with_appcontext
-def create_dummy_data() -> None:
+def create_dummy_data(scale: bool, **sizes) -> None:
     """
-    Populates the database with dummy data as click function
+    Populates the database with dummy data as click function, or with a
+    generated dataset with --scale
     """
-    populate_db()
+    if not scale:
+        populate_db()
+        return
+    start = time.perf_counter()
+    counts = generate_data(**sizes)
+    click.echo(
+        ", ".join(f"{count} {table}" for table, count in counts.items())
+        + f" generated in {time.perf_counter() - start:.2f} s"
+    )
 
 
 @click.command("catalogue-key")
@@ -505,3 +651,221 @@ def populate_db() -> None:
         locations + warehouses + items + stocks + catalogues + warehouse_api_keys
     )
     db.session.commit()
+
+
+# Reference data of the synthetic dataset: city, postal code, latitude, longitude
+SCALE_CITIES = (
+    ("Helsinki", "00100", 60.1699, 24.9384),
+    ("Espoo", "02100", 60.2055, 24.6559),
+    ("Tampere", "33100", 61.4978, 23.7610),
+    ("Oulu", "90100", 65.0121, 25.4651),
+    ("Turku", "20100", 60.4518, 22.2666),
+    ("Jyväskylä", "40100", 62.2426, 25.7473),
+    ("Kuopio", "70100", 62.8924, 27.6770),
+    ("Lahti", "15100", 60.9827, 25.6612),
+)
+SCALE_STREETS = (
+    "Mannerheimintie",
+    "Aurakatu",
+    "Hämeenkatu",
+    "Kauppurienkatu",
+    "Kauppakatu",
+    "Rautatienkatu",
+    "Kirkkokatu",
+    "Satamakatu",
+)
+SCALE_FIRST_NAMES = (
+    "Aino",
+    "Eero",
+    "Helmi",
+    "Juha",
+    "Leena",
+    "Mikko",
+    "Sanna",
+    "Ville",
+)
+SCALE_LAST_NAMES = (
+    "Korhonen",
+    "Virtanen",
+    "Mäkinen",
+    "Nieminen",
+    "Hämäläinen",
+    "Laine",
+)
+# category: (min weight, max weight, min price, max price)
+SCALE_CATEGORIES = {
+    "Electronics": (0.1, 15.0, 20.0, 2000.0),
+    "Groceries": (0.1, 5.0, 0.5, 30.0),
+    "Clothing": (0.1, 2.0, 5.0, 200.0),
+    "Toys": (0.1, 5.0, 3.0, 150.0),
+    "Tools": (0.2, 25.0, 5.0, 500.0),
+    "Furniture": (2.0, 80.0, 30.0, 1500.0),
+}
+
+
+def generate_data(
+    locations: int = 100,
+    warehouses: int = 1000,
+    items: int = 50000,
+    stock_density: float = 0.02,
+    suppliers: int = 200,
+    suppliers_per_item: int = 2,
+    seed: int = 0,
+    chunk_size: int = 50000,
+) -> dict:
+    """
+    Adds a synthetic dataset to the database. The same seed always generates
+    the same rows. Rows are generated in batches and inserted with bulk INSERT
+    statements, committing every chunk_size rows, and the new rows get ids
+    after the existing ones.
+    :param locations: number of locations
+    :param warehouses: number of warehouses, spread over the locations
+    :param items: number of items
+    :param stock_density: fraction of the warehouses stocking each item
+    :param suppliers: number of suppliers
+    :param suppliers_per_item: number of catalogue entries of each item
+    :param seed: random seed
+    :param chunk_size: rows per INSERT statement and transaction
+    :raise ValueError: if the sizes are inconsistent
+    :return: number of rows added to each table
+    """
+    # imported here as caching depends on utils, which depends on this module
+    from inventorymanager.caching import column_tag, invalidate_tags, table_tag
+
+    if warehouses and not locations:
+        raise ValueError("Warehouses need at least one location")
+    if not 0 <= stock_density <= 1:
+        raise ValueError("Stock density must be between 0 and 1")
+    if suppliers_per_item > suppliers:
+        raise ValueError("Items can't have more suppliers than there are")
+
+    rng = random.Random(seed)
+    first_location = _next_id(Location.location_id)
+    first_warehouse = _next_id(Warehouse.warehouse_id)
+    first_item = _next_id(Item.item_id)
+    categories = list(SCALE_CATEGORIES)
+    supplier_names = [f"Supplier-{number}" for number in range(1, suppliers + 1)]
+    used_suppliers = set()
+    prices = []
+
+    # rows are tuples in table column order, generated a batch at a time and
+    # in primary key order, which keeps the SQLite B-tree inserts sequential
+    def location_rows():
+        cities = rng.choices(SCALE_CITIES, k=locations)
+        streets = rng.choices(SCALE_STREETS, k=locations)
+        for number, (city, postal_code, latitude, longitude), street in zip(
+            range(first_location, first_location + locations), cities, streets
+        ):
+            yield (
+                number,
+                round(latitude + rng.uniform(-0.1, 0.1), 4),
+                round(longitude + rng.uniform(-0.1, 0.1), 4),
+                "Finland",
+                postal_code,
+                city,
+                f"{street} {rng.randint(1, 200)}",
+            )
+
+    def warehouse_rows():
+        first_names = rng.choices(SCALE_FIRST_NAMES, k=warehouses)
+        last_names = rng.choices(SCALE_LAST_NAMES, k=warehouses)
+        location_ids = rng.choices(
+            range(first_location, first_location + locations), k=warehouses
+        )
+        for number, first_name, last_name, location_id in zip(
+            range(first_warehouse, first_warehouse + warehouses),
+            first_names,
+            last_names,
+            location_ids,
+        ):
+            yield (number, f"{first_name} {last_name}", location_id)
+
+    def item_rows():
+        for number, category in zip(
+            range(first_item, first_item + items), rng.choices(categories, k=items)
+        ):
+            min_weight, max_weight, min_price, max_price = SCALE_CATEGORIES[category]
+            prices.append(rng.uniform(min_price, max_price))
+            yield (
+                number,
+                f"{category}-{number}",
+                category,
+                round(rng.uniform(min_weight, max_weight), 2),
+            )
+
+    stocked = round(stock_density * warehouses)
+
+    def stock_rows():
+        warehouse_ids = range(first_warehouse, first_warehouse + warehouses)
+        for number, price in zip(range(first_item, first_item + items), prices):
+            chosen = sorted(rng.sample(warehouse_ids, stocked))
+            quantities = rng.choices(range(500), k=stocked)
+            for warehouse_id, quantity in zip(chosen, quantities):
+                yield (
+                    number,
+                    warehouse_id,
+                    quantity,
+                    round(price * (1.1 + 0.5 * rng.random()), 2),
+                )
+
+    def catalogue_rows():
+        for number, price in zip(range(first_item, first_item + items), prices):
+            chosen = sorted(rng.sample(supplier_names, suppliers_per_item))
+            used_suppliers.update(chosen)
+            min_orders = rng.choices((1, 5, 10, 25, 50, 100), k=suppliers_per_item)
+            for supplier_name, min_order in zip(chosen, min_orders):
+                yield (
+                    number,
+                    supplier_name,
+                    min_order,
+                    round(price * (0.6 + 0.3 * rng.random()), 2),
+                )
+
+    counts = {}
+    for model, rows in (
+        (Location, location_rows()),
+        (Warehouse, warehouse_rows()),
+        (Item, item_rows()),
+        (Stock, stock_rows()),
+        (Catalogue, catalogue_rows()),
+    ):
+        counts[model.__table__.name] = _insert_chunks(model, rows, chunk_size)
+
+    # bulk inserts bypass the session hooks of the cache. The new rows only
+    # reference each other, except for the catalogue suppliers which may exist
+    invalidate_tags(
+        [table_tag(model) for model in (Location, Warehouse, Item, Stock, Catalogue)]
+        + [column_tag(Catalogue, "supplier_name", name) for name in used_suppliers]
+    )
+    return counts
+
+
+def _next_id(column) -> int:
+    return (db.session.scalar(select(func.max(column))) or 0) + 1
+
+
+def _insert_chunks(model, rows, chunk_size: int) -> int:
+    """
+    Inserts the rows in chunks with executemany, each chunk in its own
+    transaction
+    :param model: model class of the table
+    :param rows: iterable of tuples in table column order
+    :param chunk_size: rows per chunk
+    :return: number of inserted rows
+    """
+    table = model.__table__
+    statement = table.insert().compile(dialect=db.engine.dialect)
+    columns = [column.name for column in table.columns]
+    count = 0
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        if statement.positional:
+            # skips building a parameter dictionary per row
+            db.session.connection().exec_driver_sql(str(statement), chunk)
+        else:
+            db.session.execute(
+                insert(table), [dict(zip(columns, row)) for row in chunk]
+            )
+        db.session.commit()
+        count += len(chunk)
+    return count
@@ -0,0 +1,136 @@
+"""
+This module contains the on-demand request profiler. A request sent with the
+admin key in the InventoryManager-Api-Key header and a "_profile" query
+parameter is run under cProfile, or under pyinstrument's sampling profiler with
+"_profile=sample" when it is installed. The profile is stored in PROFILE_DIR
+and the functions with the most own time are summarized in the X-Profile-Top
+response header.
+
+Profiling happens at the WSGI level so that URL converters are included, and
+profiled requests always render their response instead of reading it from
+the cache.
+"""
+
+import cProfile
+import os
+import pstats
+import secrets
+import time
+
+from flask import Flask
+from werkzeug.wrappers import Request
+
+from inventorymanager.caching import REVALIDATE_ENVIRON
+from inventorymanager.utils import is_admin_key
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+PROFILE_PARAM = "_profile"
+TOP_FUNCTIONS = 5
+
+
+class ProfilerMiddleware:
+    """
+    WSGI middleware profiling the requests that ask for it with the admin key.
+    Every other request is passed through untouched.
+    """
+
+    def __init__(self, wsgi_app, app: Flask):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        mode = request.args.get(PROFILE_PARAM)
+        if not mode or mode == "0":
+            return self.wsgi_app(environ, start_response)
+
+        with self.app.app_context():
+            authorized = is_admin_key(request.headers.get("InventoryManager-Api-Key"))
+        if not authorized:
+            return self.wsgi_app(environ, start_response)
+
+        environ[REVALIDATE_ENVIRON] = True
+        captured = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        resource = request.path.strip("/").replace("/", ".") or "root"
+        name = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(2)}"
+            f"-{request.method}-{resource}"
+        )
+        if mode == "sample" and SamplingProfiler is not None:
+            body, extra_headers = self._run_sampling(
+                environ, capture_start_response, name
+            )
+        else:
+            body, extra_headers = self._run_cprofile(
+                environ, capture_start_response, name
+            )
+
+        status, headers, exc_info = captured
+        start_response(status, list(headers) + extra_headers, exc_info)
+        return body
+
+    def _profile_path(self, name: str, extension: str) -> str:
+        profile_dir = self.app.config["PROFILE_DIR"]
+        os.makedirs(profile_dir, exist_ok=True)
+        return os.path.join(profile_dir, f"{name}.{extension}")
+
+    def _run_cprofile(self, environ, start_response, name: str) -> tuple:
+        """Runs the request under cProfile and stores the stats as a .prof file.
+
+        :return: tuple of the response body and the profile headers
+        """
+        profiler = cProfile.Profile()
+        body = profiler.runcall(_consume, self.wsgi_app, environ, start_response)
+
+        path = self._profile_path(name, "prof")
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler)
+        top = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        summary = "; ".join(
+            f"{own_time * 1000:.2f}ms {os.path.basename(filename)}:{line}({function})"
+            for (filename, line, function), (_, _, own_time, _, _) in top[
+                :TOP_FUNCTIONS
+            ]
+        )
+        return body, [
+            ("X-Profile-Top", summary),
+            ("X-Profile-File", os.path.basename(path)),
+        ]
+
+    def _run_sampling(self, environ, start_response, name: str) -> tuple:
+        """Runs the request under the sampling profiler and stores an HTML report.
+
+        :return: tuple of the response body and the profile headers
+        """
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            body = _consume(self.wsgi_app, environ, start_response)
+        finally:
+            profiler.stop()
+
+        path = self._profile_path(name, "html")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(profiler.output_html())
+        return body, [("X-Profile-File", os.path.basename(path))]
+
+
+def _consume(wsgi_app, environ, start_response) -> list:
+    """Calls the WSGI app and reads its whole body, so that lazily generated
+    responses are profiled too.
+    """
+    iterable = wsgi_app(environ, start_response)
+    try:
+        return list(iterable)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
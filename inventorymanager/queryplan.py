@@ -0,0 +1,133 @@
+"""
+This module contains the "flask explain-queries" command. It sends a request
+to every GET endpoint of the API, records the SELECT statements they issue and
+prints the SQLite query plan of each one. Filtered queries that scan a whole
+table instead of searching an index are reported, and make the command fail.
+"""
+
+import click
+from flask import Flask, current_app, url_for
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from inventorymanager import db
+from inventorymanager.caching import REVALIDATE_ENVIRON
+from inventorymanager.models import (ApiKey, Catalogue, Item, Location, Stock,
+                                     Warehouse)
+
+
+def endpoint_urls(app: Flask) -> list:
+    """Builds the URL of every GET endpoint of the API from existing rows.
+
+    :param app: Flask application
+    :return: list of URLs
+    """
+    stock = Stock.query.first()
+    entry = Catalogue.query.first()
+    item = stock.item if stock is not None else Item.query.first()
+    values = {
+        "item": item,
+        "warehouse": stock.warehouse if stock is not None else Warehouse.query.first(),
+        "location": Location.query.first(),
+    }
+
+    urls = []
+    with app.test_request_context():
+        for rule in app.url_map.iter_rules():
+            if not rule.endpoint.startswith("api.") or "GET" not in rule.methods:
+                continue
+            if "supplier" in rule.arguments:
+                if entry is None:
+                    continue
+                arguments = {"supplier": entry.supplier_name, "item": entry.item}
+            else:
+                arguments = {name: values[name] for name in rule.arguments}
+            if any(value is None for value in arguments.values()):
+                continue
+            urls.append(url_for(rule.endpoint, **arguments))
+    return sorted(urls)
+
+
+def record_queries(app: Flask, urls: list) -> dict:
+    """Sends the requests, bypassing the response cache, and records the
+    distinct SELECT statements they issue, along with the API key lookups of
+    the key decorators.
+
+    :param app: Flask application
+    :param urls: URLs to request
+    :return: dictionary mapping statements to their first parameters and source
+    """
+    queries = {}
+    source = None
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            queries.setdefault(statement, (parameters, source))
+
+    client = app.test_client()
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for source in urls:
+            client.get(source, environ_overrides={REVALIDATE_ENVIRON: True})
+        source = "API key lookup"
+        ApiKey.query.filter_by(admin=True).first()
+        ApiKey.query.filter_by(warehouse_id=0).first()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+        db.session.rollback()
+    return queries
+
+
+def query_plan(statement: str, parameters) -> list:
+    """Runs EXPLAIN QUERY PLAN for a statement.
+
+    :param statement: SQL statement
+    :param parameters: parameters of the statement
+    :return: list of plan details, e.g. "SEARCH stock USING INDEX ..."
+    """
+    rows = db.session.connection().exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + statement, parameters
+    )
+    return [row[-1] for row in rows]
+
+
+def table_scans(statement: str, plan: list) -> list:
+    """Plan steps reading a whole table for a filtered statement. Statements
+    without a WHERE clause list a whole table anyway, so they never scan.
+
+    :param statement: SQL statement
+    :param plan: plan details as returned by query_plan
+    :return: list of scanning plan details
+    """
+    if " WHERE " not in " ".join(statement.split()).upper():
+        return []
+    return [detail for detail in plan if detail.startswith("SCAN ")]
+
+
+@click.command("explain-queries")
+@with_appcontext
+def explain_queries_command() -> None:
+    """
+    Prints the query plan of every query issued by the GET endpoints as click
+    function. Fails if a filtered query scans a whole table.
+    """
+    app = current_app._get_current_object()
+    queries = record_queries(app, endpoint_urls(app))
+
+    scans = 0
+    for statement, (parameters, url) in queries.items():
+        plan = query_plan(statement, parameters)
+        problems = table_scans(statement, plan)
+        scans += len(problems)
+        click.echo(f"-- {url}")
+        click.echo(" ".join(statement.split()))
+        for detail in plan:
+            click.echo(f"   {'!!' if detail in problems else '  '} {detail}")
+        click.echo()
+    db.session.rollback()
+
+    if scans:
+        raise click.ClickException(
+            f"{scans} table scans in filtered queries, see the lines marked !!"
+        )
+    click.echo(f"{len(queries)} queries, no table scans in filtered queries")
@@ -0,0 +1,110 @@
+"""
+This module contains the resource for the batch endpoint. It answers several
+GET requests in one round trip, e.g. the stock, item and catalogue of one
+screen of the client.
+"""
+
+import json
+
+from flasgger import swag_from
+from flask import Response, abort, current_app, g, request, url_for
+from flask_restful import Resource
+from jsonschema import ValidationError, validate
+from werkzeug.test import EnvironBuilder
+
+from inventorymanager.constants import DOC_FOLDER
+
+# request headers passed on to the batched requests
+FORWARDED_HEADERS = ("InventoryManager-Api-Key", "Accept", "Accept-Language")
+
+
+class Batch(Resource):
+    """
+    Resource dispatching a list of GET requests, provides POST method
+    /batch/
+    """
+
+    @staticmethod
+    def get_schema(limit: int) -> dict:
+        """Schema of a batch
+
+        :param limit: maximum number of requests
+        :return: Schema
+        """
+        return {
+            "type": "object",
+            "required": ["requests"],
+            "properties": {
+                "requests": {
+                    "type": "array",
+                    "minItems": 1,
+                    "maxItems": limit,
+                    "items": {"type": "string", "pattern": "^/api/"},
+                }
+            },
+        }
+
+    @swag_from(f"{DOC_FOLDER}batch/post.yml")
+    def post(self):
+        """Runs every GET request of the batch inside this request's
+        application context, so they share its database session and identity
+        map, and returns their responses in order
+
+        :return: Response
+        """
+        try:
+            validate(request.json, Batch.get_schema(current_app.config["BATCH_LIMIT"]))
+        except ValidationError as e:
+            return abort(400, e.message)
+
+        batch_url = url_for("api.batch")
+        responses = []
+        for path in request.json["requests"]:
+            if path.split("?", 1)[0] == batch_url:
+                return abort(400, "batches can't be nested")
+            responses.append(dispatch(path))
+        return Response(
+            json.dumps({"responses": responses}), 200, mimetype="application/json"
+        )
+
+
+def dispatch(path: str) -> dict:
+    """Runs a GET request through the app without leaving the current
+    application context.
+
+    :param path: path of the request, with its query string
+    :return: dictionary of the path, status and body of the response
+    """
+    app = current_app._get_current_object()
+    environ = EnvironBuilder(
+        path=path,
+        base_url=request.root_url,
+        headers={
+            name: request.headers[name]
+            for name in FORWARDED_HEADERS
+            if name in request.headers
+        },
+        environ_base={"REMOTE_ADDR": request.remote_addr},
+    ).get_environ()
+
+    # the request hooks keep their state in g, which belongs to the
+    # application context shared with the batch request
+    saved = dict(g.__dict__)
+    try:
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                response = app.handle_exception(e)
+            body = response.get_data(as_text=True)
+            status = response.status_code
+            response.close()
+    finally:
+        g.__dict__.clear()
+        g.__dict__.update(saved)
+
+    try:
+        body = json.loads(body)
+    except ValueError:
+        pass
+    return {"href": path, "status": status, "body": body}
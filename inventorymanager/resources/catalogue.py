@@ -3,7 +3,6 @@ This module contains the resources for the catalogue endpoints.
 """
 
 import json
-import os
 
 from flasgger import swag_from
 from flask import Response, abort, request, url_for
@@ -11,13 +10,14 @@ from flask_restful import Resource
 from jsonschema import ValidationError, validate
 from sqlalchemy.exc import IntegrityError
 
-from inventorymanager import cache, db
+from inventorymanager import db
 from inventorymanager.builder import InventoryManagerBuilder
+from inventorymanager.caching import (add_cache_tags, cached_resource,
+                                      column_tag, row_tag, table_tag)
 from inventorymanager.constants import (CATALOGUE_PROFILE, DOC_FOLDER,
                                         LINK_RELATIONS_URL, MASON, NAMESPACE)
 from inventorymanager.models import Catalogue, Item
-from inventorymanager.utils import (create_error_response,
-                                    request_path_cache_key)
+from inventorymanager.utils import create_error_response
 
 
 class CatalogueCollection(Resource):
@@ -26,8 +26,8 @@ class CatalogueCollection(Resource):
     /catalogue/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/collection/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}catalogue/collection/get.yml")
+    @cached_resource(table_tag(Catalogue), table_tag(Item))
     def get(self):
         """Returns a list of all catalogue entries in the database
 
@@ -61,7 +61,7 @@ class CatalogueCollection(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/collection/post.yml")
+    @swag_from(f"{DOC_FOLDER}catalogue/collection/post.yml")
     def post(self):
         """Adds a new catalogue to the database
 
@@ -86,7 +86,6 @@ class CatalogueCollection(Resource):
             db.session.rollback()
             return abort(409, "Catalogue already exists")
         # if api fails after this line, resource will be added to db anyway
-        self._clear_cache()
         return Response(
             status=201,
             headers={
@@ -98,9 +97,6 @@ class CatalogueCollection(Resource):
             },
         )
 
-    def _clear_cache(self):
-        cache.delete(request.path)
-
 
 class CatalogueItem(Resource):
     """
@@ -108,8 +104,8 @@ class CatalogueItem(Resource):
     /catalogue/supplier/<string:supplier>/item/<item:item>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/item/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}catalogue/item/get.yml")
+    @cached_resource(lambda supplier, item: [row_tag(item)])
     def get(self, supplier, item):
         """returns a single catalogue entry in the database
 
@@ -125,6 +121,7 @@ class CatalogueItem(Resource):
             return create_error_response(
                 404, "supplier and item combination does not exist"
             )
+        add_cache_tags(row_tag(catalogue_entry))
 
         self_url = url_for("api.catalogueitem", supplier=supplier, item=item)
         body = InventoryManagerBuilder(catalogue_entry.serialize())
@@ -142,7 +139,7 @@ class CatalogueItem(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/item/put.yml")
+    @swag_from(f"{DOC_FOLDER}catalogue/item/put.yml")
     def put(self, supplier, item):
         """updates a single catalogue entry in the database
 
@@ -175,10 +172,9 @@ class CatalogueItem(Resource):
                 ),
             )
 
-        self._clear_cache()
         return Response(status=204)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/item/delete.yml")
+    @swag_from(f"{DOC_FOLDER}catalogue/item/delete.yml")
     def delete(self, supplier, item):
         """deletes a single catalogue entry in the database
 
@@ -196,13 +192,8 @@ class CatalogueItem(Resource):
         db.session.delete(catalogue_entry)
         db.session.commit()
 
-        self._clear_cache()
         return Response(status=204)
 
-    def _clear_cache(self):
-        collection_path = url_for("api.cataloguecollection")
-        cache.delete_many(collection_path, request.path)
-
 
 class CatalogueItemCollection(Resource):
     """
@@ -210,7 +201,10 @@ class CatalogueItemCollection(Resource):
     /catalogue/item/<item:item>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/itemcollection/get.yml")
+    @swag_from(f"{DOC_FOLDER}catalogue/itemcollection/get.yml")
+    @cached_resource(
+        lambda item: [row_tag(item), column_tag(Catalogue, "item_id", item.item_id)]
+    )
     def get(self, item: Item):
         """Returns a list of catalogue entries in the database filtered by item name
 
@@ -251,7 +245,11 @@ class CatalogueSupplierCollection(Resource):
     /catalogue/supplier/<string:supplier>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}catalogue/suppliercollection/get.yml")
+    @swag_from(f"{DOC_FOLDER}catalogue/suppliercollection/get.yml")
+    @cached_resource(
+        lambda supplier: [column_tag(Catalogue, "supplier_name", supplier)],
+        table_tag(Item),
+    )
     def get(self, supplier: str):
         """Returns a list of catalogue entries in the database filtered by supplier name
 
@@ -1,7 +1,6 @@
 """ Item resource module """
 
 import json
-import os
 
 from flasgger import swag_from
 from flask import Response, abort, request, url_for
@@ -9,13 +8,13 @@ from flask_restful import Resource
 from jsonschema import ValidationError, validate
 from sqlalchemy.exc import IntegrityError
 
-from inventorymanager import cache, db
+from inventorymanager import db
 from inventorymanager.builder import InventoryManagerBuilder
+from inventorymanager.caching import cached_resource, row_tag, table_tag
 from inventorymanager.constants import (DOC_FOLDER, ITEM_PROFILE,
                                         LINK_RELATIONS_URL, MASON, NAMESPACE)
 from inventorymanager.models import Item
-from inventorymanager.utils import (create_error_response,
-                                    request_path_cache_key)
+from inventorymanager.utils import create_error_response
 
 
 class ItemCollection(Resource):
@@ -24,8 +23,8 @@ class ItemCollection(Resource):
     /items/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}item/collection/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}item/collection/get.yml")
+    @cached_resource(table_tag(Item))
     def get(self) -> Response:
         """Returns a list of all items in the database
 
@@ -50,7 +49,7 @@ class ItemCollection(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}item/collection/post.yml")
+    @swag_from(f"{DOC_FOLDER}item/collection/post.yml")
     def post(self) -> Response:
         """Adds a new item to the database
 
@@ -72,14 +71,10 @@ class ItemCollection(Resource):
             db.session.rollback()
             return abort(409, "Item already exists")
 
-        self._clear_cache()
         return Response(
             status=201, headers={"Location": url_for("api.itemitem", item=item)}
         )
 
-    def _clear_cache(self):
-        cache.delete(request.path)
-
 
 class ItemItem(Resource):
     """
@@ -87,8 +82,8 @@ class ItemItem(Resource):
     /items/<item:item>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}item/item/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}item/item/get.yml")
+    @cached_resource(lambda item: [row_tag(item)])
     def get(self, item: Item) -> Response:
         """returns a single item
 
@@ -112,7 +107,7 @@ class ItemItem(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}item/item/put.yml")
+    @swag_from(f"{DOC_FOLDER}item/item/put.yml")
     def put(self, item: Item) -> Response:
         """Updates an item in the database
 
@@ -135,10 +130,9 @@ class ItemItem(Resource):
                 "Already exists",
                 f"Item with name {request.json['name']} already exists.",
             )
-        self._clear_cache()
         return Response(status=204)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}item/item/delete.yml")
+    @swag_from(f"{DOC_FOLDER}item/item/delete.yml")
     def delete(self, item: Item) -> Response:
         """deletes an item from the database
 
@@ -148,9 +142,4 @@ class ItemItem(Resource):
 
         db.session.delete(item)
         db.session.commit()
-        self._clear_cache()
         return Response(status=204)
-
-    def _clear_cache(self):
-        collection_path = url_for("api.itemcollection")
-        cache.delete_many(collection_path, request.path)
@@ -6,7 +6,6 @@ https://lovelace.oulu.fi/ohjelmoitava-web/ohjelmoitava-web/implementing-rest-api
 """
 
 import json
-import os
 
 from flasgger import swag_from
 from flask import Response, abort, request, url_for
@@ -14,12 +13,12 @@ from flask_restful import Resource
 from jsonschema import ValidationError, validate
 from sqlalchemy.exc import IntegrityError
 
-from inventorymanager import cache, db
+from inventorymanager import db
 from inventorymanager.builder import InventoryManagerBuilder
+from inventorymanager.caching import cached_resource, row_tag, table_tag
 from inventorymanager.constants import (DOC_FOLDER, LINK_RELATIONS_URL,
                                         LOCATION_PROFILE, MASON, NAMESPACE)
 from inventorymanager.models import Location
-from inventorymanager.utils import request_path_cache_key
 
 
 class LocationCollection(Resource):
@@ -27,8 +26,8 @@ class LocationCollection(Resource):
     /locations/
     """
 
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}location/collection/get.yml")
+    @swag_from(f"{DOC_FOLDER}location/collection/get.yml")
+    @cached_resource(table_tag(Location))
     def get(self):
         """Gets all locations present in the database
 
@@ -59,7 +58,7 @@ class LocationCollection(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}location/collection/post.yml")
+    @swag_from(f"{DOC_FOLDER}location/collection/post.yml")
     def post(self):
         """Add a new location to the database
 
@@ -81,24 +80,19 @@ class LocationCollection(Resource):
             db.session.rollback()
             return {"message": "Location already exists"}, 409
 
-        self._clear_cache()
-
         return Response(
             status=201,
             headers={"Location": url_for("api.locationitem", location=location)},
         )
 
-    def _clear_cache(self):
-        cache.delete(request.path)
-
 
 class LocationItem(Resource):
     """Class for a location resource.
     /locations/<location:location>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}location/item/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}location/item/get.yml")
+    @cached_resource(lambda location: [row_tag(location)])
     def get(self, location: Location) -> Response:
         """Retrieves location
 
@@ -130,7 +124,7 @@ class LocationItem(Resource):
         # location_json["uri"] = url_for("api.locationitem", location=location)
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}location/item/put.yml")
+    @swag_from(f"{DOC_FOLDER}location/item/put.yml")
     def put(self, location):
         """
         Updates existing location_id. Validates against JSON schema.
@@ -157,10 +151,9 @@ class LocationItem(Resource):
             db.session.rollback()
             return abort(409, "stock already exists")
 
-        self._clear_cache()
         return {}, 204
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}location/item/delete.yml")
+    @swag_from(f"{DOC_FOLDER}location/item/delete.yml")
     def delete(self, location):
         """
         Deletes existing location. Returns status code 204 if deletion is successful.
@@ -172,9 +165,4 @@ class LocationItem(Resource):
         db.session.delete(location)
         db.session.commit()
 
-        self._clear_cache()
         return Response(status=204)
-
-    def _clear_cache(self):
-        collection_path = url_for("api.locationcollection")
-        cache.delete_many(collection_path, request.path)
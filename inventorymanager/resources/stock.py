@@ -3,46 +3,61 @@ This module contains the resources for the stock endpoints.
 """
 
 import json
-import os
 
 from flasgger import swag_from
 from flask import Response, abort, request, url_for
 from flask_restful import Resource
 from jsonschema import ValidationError, validate
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from inventorymanager import db
 from inventorymanager.builder import InventoryManagerBuilder
-from inventorymanager.constants import (DOC_FOLDER, LINK_RELATIONS_URL, MASON,
-                                        NAMESPACE, STOCK_PROFILE)
-from inventorymanager.models import Item, Stock, Warehouse
+from inventorymanager.caching import (add_cache_tags, cached_resource,
+                                      column_tag, row_tag, table_tag)
+from inventorymanager.constants import (CATALOGUE_PROFILE, DOC_FOLDER,
+                                        ITEM_PROFILE, LINK_RELATIONS_URL, MASON,
+                                        NAMESPACE, STOCK_PROFILE,
+                                        WAREHOUSE_PROFILE)
+from inventorymanager.models import (Catalogue, Item, Location, Stock,
+                                     Warehouse)
 from inventorymanager.utils import create_error_response
 
 
+# related resources that can be inlined with ?embed=
+EMBEDDABLE = ("item", "warehouse", "catalogue")
+
+
 class StockCollection(Resource):
     """
     Resource for the collection of stocks, provides GET and POST methods
     /stocks/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/collection/get.yml")
+    @swag_from(f"{DOC_FOLDER}stock/collection/get.yml")
+    @cached_resource(table_tag(Stock), table_tag(Item), table_tag(Warehouse))
     def get(self):
-        """Returns a list of all stocks in the database
+        """Returns a list of all stocks in the database, with the resources
+        listed in the embed query parameter inlined
 
         :return: Response
         """
+        embed = get_embed()
+        if embed is None:
+            return embed_error()
 
         body = InventoryManagerBuilder(items=[])
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
         body.add_control("self", url_for("api.stockcollection"))
 
-        for stock in Stock.query.all():
+        for stock in Stock.query.options(*embed_options(embed)):
             item = InventoryManagerBuilder(stock.serialize())
             item.add_control(
                 "self",
                 url_for("api.stockitem", warehouse=stock.warehouse, item=stock.item),
             )
             item.add_control("profile", STOCK_PROFILE)
+            add_embedded_resources(item, stock, embed)
             body["items"].append(item)
 
         body.add_control_post(
@@ -56,7 +71,7 @@ class StockCollection(Resource):
 
         return Response(json.dumps(body), 200)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/collection/post.yml")
+    @swag_from(f"{DOC_FOLDER}stock/collection/post.yml")
     def post(self):
         """Adds a new stock to the database
 
@@ -103,38 +118,37 @@ class StockItem(Resource):
     /stocks/<warehouse:warehouse>/item/<item:item>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/item/get.yml")
+    @swag_from(f"{DOC_FOLDER}stock/item/get.yml")
+    @cached_resource(lambda warehouse, item: [row_tag(warehouse), row_tag(item)])
     def get(self, warehouse: Warehouse, item: Item):
-        """returns a single stock in the database
+        """returns a single stock in the database, with the resources listed
+        in the embed query parameter inlined
 
         :param warehouse: warehouse id of the stock to return
         :param item: item name of the stock to return
         :return: Response
         """
+        embed = get_embed()
+        if embed is None:
+            return embed_error()
+
+        stock = (
+            Stock.query.options(*embed_options(embed))
+            .filter_by(warehouse=warehouse, item=item)
+            .first()
+        )
+        add_cache_tags(row_tag(stock))
 
-        stock = Stock.query.filter_by(warehouse=warehouse, item=item).first()
-
-        self_url = url_for("api.stockitem", warehouse=warehouse, item=item)
-        body = InventoryManagerBuilder(stock.serialize())
-
-        body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
-        body.add_control("self", self_url)
-        body.add_control("profile", STOCK_PROFILE)
-        body.add_control("collection", url_for("api.stockcollection"))
-        body.add_control_put("Modify this stock", self_url, Stock.get_schema())
-        body.add_control_delete("Delete this stock", self_url)
-        body.add_control_get_warehouse(warehouse)
-        body.add_control_get_item(item)
-        body.add_control_all_stock_item(item)
-        body.add_control_all_stock_warehouse(warehouse)
-
-        return Response(json.dumps(body), 200, mimetype=MASON)
+        return stock_response(warehouse, item, stock, embed)
 
         # return Response(json.dumps(stock_json), 200)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/item/put.yml")
+    @swag_from(f"{DOC_FOLDER}stock/item/put.yml")
     def put(self, warehouse: Warehouse, item: Item):
-        """Updates a stock in the database
+        """Updates a stock in the database. With an If-Match header, the
+        stock is only updated if it still has the given ETag, so that a
+        client writing a quantity computed from its copy doesn't overwrite
+        the changes it hasn't seen.
 
         :param warehouse: warehouse id of the stock to update
         :param item: item name of the stock to update
@@ -153,6 +167,16 @@ class StockItem(Resource):
             stock_entry = Stock.query.filter_by(
                 item_id=item.item_id, warehouse_id=warehouse.warehouse_id
             ).first()
+            if (
+                stock_entry is not None
+                and request.if_match
+                and stock_etag(warehouse, item, stock_entry) not in request.if_match
+            ):
+                return create_error_response(
+                    412,
+                    "Precondition failed",
+                    "the stock was modified since it was read",
+                )
             stock_entry.deserialize(request.json)
             db.session.commit()
 
@@ -174,7 +198,7 @@ class StockItem(Resource):
 
         return Response(status=204)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/item/delete.yml")
+    @swag_from(f"{DOC_FOLDER}stock/item/delete.yml")
     def delete(self, warehouse: Warehouse, item: Item):
         """Deletes a stock in the database
 
@@ -198,24 +222,33 @@ class StockItemCollection(Resource):
     /stocks/item/<item:item>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/itemcollection/get.yml")
+    @swag_from(f"{DOC_FOLDER}stock/itemcollection/get.yml")
+    @cached_resource(
+        lambda item: [row_tag(item), column_tag(Stock, "item_id", item.item_id)],
+        table_tag(Warehouse),
+    )
     def get(self, item: Item):
-        """Returns a list of stocks in the database filtered by item name
+        """Returns a list of stocks in the database filtered by item name, with
+        the resources listed in the embed query parameter inlined
 
         :param item: item name to filter stocks with
         :return: Response
         """
+        embed = get_embed()
+        if embed is None:
+            return embed_error()
 
         body = InventoryManagerBuilder(items=[])
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
         body.add_control("self", url_for("api.stockitemcollection", item=item))
-        for stock in Stock.query.filter_by(item=item):
+        for stock in Stock.query.options(*embed_options(embed)).filter_by(item=item):
             item = InventoryManagerBuilder(stock.serialize())
             item.add_control(
                 "self",
                 url_for("api.stockitem", warehouse=stock.warehouse, item=stock.item),
             )
             item.add_control("profile", STOCK_PROFILE)
+            add_embedded_resources(item, stock, embed)
             body["items"].append(item)
 
         body.add_control_all_stock()
@@ -229,28 +262,166 @@ class StockWarehouseCollection(Resource):
     /stocks/warehouse/<warehouse:warehouse>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}stock/warehousecollection/get.yml")
+    @swag_from(f"{DOC_FOLDER}stock/warehousecollection/get.yml")
+    @cached_resource(
+        lambda warehouse: [
+            row_tag(warehouse),
+            column_tag(Stock, "warehouse_id", warehouse.warehouse_id),
+        ],
+        table_tag(Item),
+    )
     def get(self, warehouse: Warehouse):
-        """Returns a list of stocks in the database filtered by warehouse id
+        """Returns a list of stocks in the database filtered by warehouse id, with
+        the resources listed in the embed query parameter inlined
 
         :param warehouse: warehouse id to filter stocks with
         :return: Response
         """
+        embed = get_embed()
+        if embed is None:
+            return embed_error()
 
         body = InventoryManagerBuilder(items=[])
         body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
         body.add_control(
             "self", url_for("api.stockwarehousecollection", warehouse=warehouse)
         )
-        for stock in Stock.query.filter_by(warehouse=warehouse):
+        for stock in Stock.query.options(*embed_options(embed)).filter_by(
+            warehouse=warehouse
+        ):
             item = InventoryManagerBuilder(stock.serialize())
             item.add_control(
                 "self",
                 url_for("api.stockitem", warehouse=stock.warehouse, item=stock.item),
             )
             item.add_control("profile", STOCK_PROFILE)
+            add_embedded_resources(item, stock, embed)
             body["items"].append(item)
 
         body.add_control_all_stock()
 
         return Response(json.dumps(body), 200)
+
+
+def stock_response(
+    warehouse: Warehouse, item: Item, stock: Stock, embed: set
+) -> Response:
+    """Renders the Mason document of a single stock
+
+    :param warehouse: warehouse of the stock
+    :param item: item of the stock
+    :param stock: stock loaded with embed_options
+    :param embed: names of the embedded resources
+    :return: Response
+    """
+    self_url = url_for("api.stockitem", warehouse=warehouse, item=item)
+    body = InventoryManagerBuilder(stock.serialize())
+
+    body.add_namespace(NAMESPACE, LINK_RELATIONS_URL)
+    body.add_control("self", self_url)
+    body.add_control("profile", STOCK_PROFILE)
+    body.add_control("collection", url_for("api.stockcollection"))
+    body.add_control_put("Modify this stock", self_url, Stock.get_schema())
+    body.add_control_delete("Delete this stock", self_url)
+    body.add_control_get_warehouse(warehouse)
+    body.add_control_get_item(item)
+    body.add_control_all_stock_item(item)
+    body.add_control_all_stock_warehouse(warehouse)
+    add_embedded_resources(body, stock, embed)
+
+    return Response(json.dumps(body), 200, mimetype=MASON)
+
+
+def stock_etag(warehouse: Warehouse, item: Item, stock: Stock) -> str:
+    """ETag of the current document of a stock, as sent with a GET request
+    without embedded resources
+
+    :param warehouse: warehouse of the stock
+    :param item: item of the stock
+    :param stock: stock
+    :return: ETag, without quotes
+    """
+    response = stock_response(warehouse, item, stock, set())
+    response.add_etag()
+    return response.get_etag()[0]
+
+
+def get_embed():
+    """Reads the comma separated names of the embed query parameter, e.g.
+    ?embed=item,warehouse
+
+    :return: set of names, or None if one of them can't be embedded
+    """
+    embed = {name for name in request.args.get("embed", "").split(",") if name}
+    if not embed <= set(EMBEDDABLE):
+        return None
+    return embed
+
+
+def embed_error() -> Response:
+    """Error response for an invalid embed query parameter
+
+    :return: Response
+    """
+    return create_error_response(
+        400,
+        "Invalid embed",
+        f"embed is a comma separated list of {', '.join(EMBEDDABLE)}",
+    )
+
+
+def embed_options(embed: set) -> list:
+    """Loader options fetching the embedded resources along with the stock
+    in the same joined query
+
+    :param embed: names of the embedded resources
+    :return: list of loader options
+    """
+    options = []
+    if "warehouse" in embed:
+        options.append(joinedload(Stock.warehouse).joinedload(Warehouse.location))
+    if "catalogue" in embed:
+        options.append(joinedload(Stock.item).joinedload(Item.catalogue))
+    elif "item" in embed:
+        options.append(joinedload(Stock.item))
+    return options
+
+
+def add_embedded_resources(body: InventoryManagerBuilder, stock: Stock, embed: set):
+    """Inlines the related resources of a stock under @embedded, and tags the
+    cached response with them
+
+    :param body: Mason object of the stock
+    :param stock: stock loaded with embed_options
+    :param embed: names of the embedded resources
+    """
+    if "item" in embed:
+        item = InventoryManagerBuilder(stock.item.serialize())
+        item.add_control("self", url_for("api.itemitem", item=stock.item))
+        item.add_control("profile", ITEM_PROFILE)
+        body.add_embedded("item", item)
+
+    if "warehouse" in embed:
+        warehouse = InventoryManagerBuilder(stock.warehouse.serialize())
+        warehouse["location"] = stock.warehouse.location.serialize()
+        warehouse.add_control(
+            "self", url_for("api.warehouseitem", warehouse=stock.warehouse)
+        )
+        warehouse.add_control("profile", WAREHOUSE_PROFILE)
+        body.add_embedded("warehouse", warehouse)
+        add_cache_tags(table_tag(Location))
+
+    if "catalogue" in embed:
+        entries = []
+        for entry in stock.item.catalogue:
+            catalogue = InventoryManagerBuilder(entry.serialize())
+            catalogue.add_control(
+                "self",
+                url_for(
+                    "api.catalogueitem", supplier=entry.supplier_name, item=stock.item
+                ),
+            )
+            catalogue.add_control("profile", CATALOGUE_PROFILE)
+            entries.append(catalogue)
+        body.add_embedded("catalogue", entries)
+        add_cache_tags(table_tag(Catalogue))
@@ -3,7 +3,6 @@ This module contains the resources for the warehouse endpoints.
 """
 
 import json
-import os
 
 from flasgger import swag_from
 from flask import Response, abort, request, url_for
@@ -11,13 +10,13 @@ from flask_restful import Resource
 from jsonschema import validate
 from sqlalchemy.exc import IntegrityError
 
-from inventorymanager import cache, db
+from inventorymanager import db
 from inventorymanager.builder import InventoryManagerBuilder
+from inventorymanager.caching import cached_resource, row_tag, table_tag
 from inventorymanager.constants import (DOC_FOLDER, LINK_RELATIONS_URL, MASON,
                                         NAMESPACE, WAREHOUSE_PROFILE)
 from inventorymanager.models import Warehouse
-from inventorymanager.utils import (create_error_response,
-                                    request_path_cache_key)
+from inventorymanager.utils import create_error_response
 
 
 class WarehouseCollection(Resource):
@@ -26,8 +25,8 @@ class WarehouseCollection(Resource):
     /warehouses/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}warehouse/collection/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}warehouse/collection/get.yml")
+    @cached_resource(table_tag(Warehouse))
     def get(self):
         """Returns a list of all warehouses in the database
 
@@ -59,7 +58,7 @@ class WarehouseCollection(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}warehouse/collection/post.yml")
+    @swag_from(f"{DOC_FOLDER}warehouse/collection/post.yml")
     def post(self):
         """Adds a new warehouse to the database
 
@@ -77,15 +76,11 @@ class WarehouseCollection(Resource):
             db.session.rollback()
             return abort(409, "Warehouse already exists")
 
-        self._clear_cache()
         return Response(
             status=201,
             headers={"Location": url_for("api.warehouseitem", warehouse=warehouse)},
         )
 
-    def _clear_cache(self):
-        cache.delete(request.path)
-
 
 class WarehouseItem(Resource):
     """
@@ -93,8 +88,8 @@ class WarehouseItem(Resource):
     /warehouses/<warehouse:warehouse>/
     """
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}warehouse/item/get.yml")
-    @cache.cached(timeout=None, make_cache_key=request_path_cache_key)
+    @swag_from(f"{DOC_FOLDER}warehouse/item/get.yml")
+    @cached_resource(lambda warehouse: [row_tag(warehouse)])
     def get(self, warehouse: Warehouse):
         """returns a single warehouse in the database with its location details
 
@@ -120,7 +115,7 @@ class WarehouseItem(Resource):
 
         return Response(json.dumps(body), 200, mimetype=MASON)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}warehouse/item/put.yml")
+    @swag_from(f"{DOC_FOLDER}warehouse/item/put.yml")
     def put(self, warehouse: Warehouse):
         """updates a single warehouse in the database
 
@@ -142,10 +137,9 @@ class WarehouseItem(Resource):
                 ),
             )
 
-        self._clear_cache()
         return Response(status=204)
 
-    @swag_from(os.getcwd() + f"{DOC_FOLDER}warehouse/item/delete.yml")
+    @swag_from(f"{DOC_FOLDER}warehouse/item/delete.yml")
     def delete(self, warehouse: Warehouse):
         """deletes a single warehouse in the database
 
@@ -155,9 +149,4 @@ class WarehouseItem(Resource):
         db.session.delete(warehouse)
         db.session.commit()
 
-        self._clear_cache()
         return Response(status=204)
-
-    def _clear_cache(self):
-        collection_path = url_for("api.warehousecollection")
-        cache.delete_many(collection_path, request.path)
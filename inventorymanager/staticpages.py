@@ -0,0 +1,66 @@
+"""
+This module contains the in-memory copies of the static profile and link
+relation pages. They are read once when the app starts, along with a gzipped
+variant and a hash of their content used as ETag, so serving one of them is a
+dictionary lookup. Their URLs carry no version, so browsers and proxies only
+keep them for STATIC_PAGES_MAX_AGE seconds, then revalidate them with the ETag
+and get a 304 response while the page is unchanged.
+"""
+
+import gzip
+import hashlib
+import os
+
+from flask import Response, abort, request
+
+
+class StaticPage:
+    """A static document with its precompressed variant and ETag."""
+
+    def __init__(self, body: bytes, mimetype: str = "text/html"):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.mimetype = mimetype
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        # tiny pages grow when compressed
+        self.gzipped = compressed if len(compressed) < len(body) else None
+
+
+class StaticPages:
+    """
+    The pages of a directory, keyed by their path relative to it.
+    """
+
+    def __init__(self, directory: str, max_age: int):
+        self.pages = {}
+        self.cache_control = f"public, max-age={max_age}"
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.endswith(".html"):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "rb") as file:
+                    key = os.path.relpath(path, directory).replace(os.sep, "/")
+                    self.pages[key] = StaticPage(file.read())
+
+    def response(self, path: str) -> Response:
+        """Serves a page, gzipped when the client accepts it, or a 304 response
+        when the client already has it.
+
+        :param path: path of the page relative to the directory
+        :return: response
+        """
+        page = self.pages.get(path)
+        if page is None:
+            abort(404)
+
+        gzipped = page.gzipped is not None and "gzip" in request.accept_encodings
+        body = page.gzipped if gzipped else page.body
+        response = Response(body, mimetype=page.mimetype)
+        # each encoding is a representation of its own
+        response.set_etag(page.etag + "-gzip" if gzipped else page.etag)
+        response.headers["Cache-Control"] = self.cache_control
+        response.vary.add("Accept-Encoding")
+        if gzipped:
+            response.content_encoding = "gzip"
+        return response.make_conditional(request)
@@ -7,6 +7,7 @@ objects.
 
 import json
 import secrets
+from urllib.parse import urlencode
 
 from flask import Response, request
 from werkzeug.exceptions import Forbidden, NotFound
@@ -16,6 +17,10 @@ from inventorymanager.builder import MasonBuilder
 from inventorymanager.constants import ERROR_PROFILE, MASON
 from inventorymanager.models import ApiKey, Item, Location, Warehouse
 
+# query parameters read by the cached resources, each a comma separated list
+# of names, see inventorymanager.resources.stock.get_embed
+CACHE_KEY_PARAMS = ("embed",)
+
 
 # from https://github.com/enkwolf/pwp-course-sensorhub-api-example/tree/master
 def create_error_response(
@@ -131,9 +136,33 @@ def request_path_cache_key(*args, **kwargs):
     """
     Helper function for caching Resources
     Used in all get functions in the application
-    :return: returns a string which is the desired cache key "request.path"
+    :return: returns a string which is the desired cache key "request.path",
+        followed by the CACHE_KEY_PARAMS the request has, with their names
+        sorted and deduplicated. Other parameters don't change the response,
+        so they don't get cache entries of their own
+    """
+    params = []
+    for name in CACHE_KEY_PARAMS:
+        names = {value for value in request.args.get(name, "").split(",") if value}
+        if names:
+            params.append((name, ",".join(sorted(names))))
+    if not params:
+        return request.path
+    return f"{request.path}?{urlencode(params)}"
+
+
+def is_admin_key(token: str) -> bool:
     """
-    return request.path
+    Checks whether the given token is the admin key
+    :param token: token sent in the InventoryManager-Api-Key header, or None
+    :return: True if the token matches the admin key stored in the database
+    """
+    if not token:
+        return False
+    db_key = ApiKey.query.filter_by(admin=True).first()
+    if db_key is None:
+        return False
+    return secrets.compare_digest(ApiKey.key_hash(token.strip()), db_key.key)
 
 
 def require_admin_key(func):
@@ -144,11 +173,7 @@ def require_admin_key(func):
     """
 
     def wrapper(*args, **kwargs):
-        key_hash = ApiKey.key_hash(
-            request.headers.get("InventoryManager-Api-Key").strip()
-        )
-        db_key = ApiKey.query.filter_by(admin=True).first()
-        if secrets.compare_digest(key_hash, db_key.key):
+        if is_admin_key(request.headers.get("InventoryManager-Api-Key")):
             return func(*args, **kwargs)
         raise Forbidden
 
@@ -0,0 +1,17 @@
+"""
+Asynchronous Python SDK of the Inventory Manager API, for jobs that integrate
+with it. It requires httpx, installed with the "sdk" extra.
+"""
+
+from inventorymanager_sdk.client import ApiError, AsyncInventoryClient
+from inventorymanager_sdk.models import Catalogue, Item, Location, Stock, Warehouse
+
+__all__ = [
+    "ApiError",
+    "AsyncInventoryClient",
+    "Catalogue",
+    "Item",
+    "Location",
+    "Stock",
+    "Warehouse",
+]
@@ -0,0 +1,442 @@
+"""
+This module contains the asynchronous client of the Inventory Manager API. It
+keeps one pool of keep-alive connections, limits the number of requests in
+flight, and retries failed connections and overloaded responses with a
+backoff, so that jobs can gather many requests at once, e.g.
+
+    async with AsyncInventoryClient("http://localhost:5000") as client:
+        stocks = await asyncio.gather(
+            *(client.stocks_of_warehouse(w) for w in warehouse_ids)
+        )
+"""
+
+import asyncio
+from typing import List, Optional
+from urllib.parse import quote
+
+import httpx
+
+from inventorymanager_sdk.models import Catalogue, Item, Location, Stock, Warehouse
+
+# statuses worth retrying, as the server or a proxy was overloaded
+RETRY_STATUSES = frozenset({502, 503, 504})
+# methods that can be sent again without changing the result
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+class ApiError(Exception):
+    """
+    Error response of the API.
+    """
+
+    def __init__(self, status_code: int, message: str, url: str):
+        """
+        :param status_code: HTTP status of the response
+        :param message: body of the response
+        :param url: URL of the request
+        """
+        super().__init__(f"Error {status_code} for {url}: {message}")
+        self.status_code = status_code
+        self.message = message
+        self.url = url
+
+
+def _segment(value) -> str:
+    """
+    :return: value quoted as one segment of a path
+    """
+    return quote(str(value), safe="")
+
+
+class AsyncInventoryClient:
+    """
+    Asynchronous client covering every resource of inventorymanager.api. Use
+    it as an async context manager, or call aclose() when done.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str] = None,
+        max_connections: int = 10,
+        max_concurrency: int = 10,
+        retries: int = 3,
+        backoff: float = 0.3,
+        timeout: float = 30,
+    ):
+        """
+        :param base_url: root URL of the API, e.g. "http://localhost:5000"
+        :param api_key: sent in the InventoryManager-Api-Key header
+        :param max_connections: keep-alive connections kept open
+        :param max_concurrency: requests in flight at once
+        :param retries: attempts after a failure
+        :param backoff: backoff factor between attempts, in seconds
+        :param timeout: seconds to wait for a connection and for a response
+        """
+        headers = {}
+        if api_key is not None:
+            headers["InventoryManager-Api-Key"] = api_key
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """
+        Closes the pooled connections.
+        """
+        await self._http.aclose()
+
+    async def _request(
+        self, method: str, path: str, json: Optional[dict] = None
+    ) -> httpx.Response:
+        """Sends a request, retrying it with an exponential backoff. Requests
+        that aren't idempotent are only retried when the connection failed
+        before they were sent.
+
+        :param method: HTTP method, e.g. "GET"
+        :param path: path of the resource, e.g. "/api/items/"
+        :param json: request body
+        :return: httpx.Response
+        :raises ApiError: if the API answered with an error status
+        """
+        idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    response = await self._http.request(method, path, json=json)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= self.retries:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= self.retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or not idempotent
+                    or attempt >= self.retries
+                ):
+                    break
+            await asyncio.sleep(self.backoff * 2**attempt)
+            attempt += 1
+
+        if response.status_code >= 400:
+            raise ApiError(response.status_code, response.text, str(response.url))
+        return response
+
+    async def _get(self, path: str) -> dict:
+        """
+        :return: decoded body of a GET request
+        """
+        response = await self._request("GET", path)
+        return response.json()
+
+    async def _collection(self, path: str, key: str, model) -> list:
+        """Reads every member of a collection. The API doesn't page its
+        collections, so this is a single request; a "next" control is
+        followed only so that paged collections keep working if the API ever
+        adds them.
+
+        :param path: path of the collection
+        :param key: key of the members in the body, e.g. "items"
+        :param model: model class of the members
+        :return: list of models
+        """
+        members = []
+        while path is not None:
+            body = await self._get(path)
+            members.extend(model.from_json(doc) for doc in body[key])
+            path = body.get("@controls", {}).get("next", {}).get("href")
+        return members
+
+    async def _create(self, path: str, model) -> str:
+        """
+        :return: path of the new resource, from the Location header
+        """
+        response = await self._request("POST", path, json=model.to_json())
+        return response.headers["Location"]
+
+    # items
+
+    async def items(self) -> List[Item]:
+        """
+        :return: every item
+        """
+        return await self._collection("/api/items/", "items", Item)
+
+    async def item(self, name: str) -> Item:
+        """
+        :param name: name of the item
+        :return: the item
+        """
+        return Item.from_json(await self._get(f"/api/items/{_segment(name)}/"))
+
+    async def create_item(self, item: Item) -> str:
+        """
+        :param item: item to add
+        :return: path of the new item
+        """
+        return await self._create("/api/items/", item)
+
+    async def update_item(self, name: str, item: Item) -> None:
+        """
+        :param name: current name of the item
+        :param item: new state of the item
+        """
+        await self._request("PUT", f"/api/items/{_segment(name)}/", json=item.to_json())
+
+    async def delete_item(self, name: str) -> None:
+        """
+        :param name: name of the item
+        """
+        await self._request("DELETE", f"/api/items/{_segment(name)}/")
+
+    # warehouses
+
+    async def warehouses(self) -> List[Warehouse]:
+        """
+        :return: every warehouse
+        """
+        return await self._collection("/api/warehouses/", "warehouses", Warehouse)
+
+    async def warehouse(self, warehouse_id: int) -> Warehouse:
+        """
+        :param warehouse_id: ID of the warehouse
+        :return: the warehouse
+        """
+        return Warehouse.from_json(
+            await self._get(f"/api/warehouses/{_segment(warehouse_id)}/")
+        )
+
+    async def create_warehouse(self, warehouse: Warehouse) -> str:
+        """
+        :param warehouse: warehouse to add
+        :return: path of the new warehouse
+        """
+        return await self._create("/api/warehouses/", warehouse)
+
+    async def update_warehouse(self, warehouse_id: int, warehouse: Warehouse) -> None:
+        """
+        :param warehouse_id: ID of the warehouse
+        :param warehouse: new state of the warehouse
+        """
+        await self._request(
+            "PUT",
+            f"/api/warehouses/{_segment(warehouse_id)}/",
+            json=warehouse.to_json(),
+        )
+
+    async def delete_warehouse(self, warehouse_id: int) -> None:
+        """
+        :param warehouse_id: ID of the warehouse
+        """
+        await self._request("DELETE", f"/api/warehouses/{_segment(warehouse_id)}/")
+
+    # locations
+
+    async def locations(self) -> List[Location]:
+        """
+        :return: every location
+        """
+        return await self._collection("/api/locations/", "locations", Location)
+
+    async def location(self, location_id: int) -> Location:
+        """
+        :param location_id: ID of the location
+        :return: the location
+        """
+        return Location.from_json(
+            await self._get(f"/api/locations/{_segment(location_id)}/")
+        )
+
+    async def create_location(self, location: Location) -> str:
+        """
+        :param location: location to add
+        :return: path of the new location
+        """
+        return await self._create("/api/locations/", location)
+
+    async def update_location(self, location_id: int, location: Location) -> None:
+        """
+        :param location_id: ID of the location
+        :param location: new state of the location
+        """
+        await self._request(
+            "PUT",
+            f"/api/locations/{_segment(location_id)}/",
+            json=location.to_json(),
+        )
+
+    async def delete_location(self, location_id: int) -> None:
+        """
+        :param location_id: ID of the location
+        """
+        await self._request("DELETE", f"/api/locations/{_segment(location_id)}/")
+
+    # catalogue
+
+    async def catalogues(self) -> List[Catalogue]:
+        """
+        :return: every catalogue entry
+        """
+        return await self._collection("/api/catalogue/", "catalogues", Catalogue)
+
+    async def catalogues_of_item(self, item_name: str) -> List[Catalogue]:
+        """
+        :param item_name: name of the item
+        :return: catalogue entries of the item
+        """
+        return await self._collection(
+            f"/api/catalogue/item/{_segment(item_name)}/", "catalogues", Catalogue
+        )
+
+    async def catalogues_of_supplier(self, supplier: str) -> List[Catalogue]:
+        """
+        :param supplier: name of the supplier
+        :return: catalogue entries of the supplier
+        """
+        return await self._collection(
+            f"/api/catalogue/supplier/{_segment(supplier)}/", "catalogues", Catalogue
+        )
+
+    async def catalogue(self, supplier: str, item_name: str) -> Catalogue:
+        """
+        :param supplier: name of the supplier
+        :param item_name: name of the item
+        :return: the catalogue entry
+        """
+        return Catalogue.from_json(
+            await self._get(
+                f"/api/catalogue/supplier/{_segment(supplier)}"
+                f"/item/{_segment(item_name)}/"
+            )
+        )
+
+    async def create_catalogue(self, catalogue: Catalogue) -> str:
+        """
+        :param catalogue: catalogue entry to add
+        :return: path of the new catalogue entry
+        """
+        return await self._create("/api/catalogue/", catalogue)
+
+    async def update_catalogue(
+        self, supplier: str, item_name: str, catalogue: Catalogue
+    ) -> None:
+        """
+        :param supplier: name of the supplier
+        :param item_name: name of the item
+        :param catalogue: new state of the catalogue entry
+        """
+        await self._request(
+            "PUT",
+            f"/api/catalogue/supplier/{_segment(supplier)}/item/{_segment(item_name)}/",
+            json=catalogue.to_json(),
+        )
+
+    async def delete_catalogue(self, supplier: str, item_name: str) -> None:
+        """
+        :param supplier: name of the supplier
+        :param item_name: name of the item
+        """
+        await self._request(
+            "DELETE",
+            f"/api/catalogue/supplier/{_segment(supplier)}/item/{_segment(item_name)}/",
+        )
+
+    # stock
+
+    async def stocks(self) -> List[Stock]:
+        """
+        :return: every stock
+        """
+        return await self._collection("/api/stocks/", "items", Stock)
+
+    async def stocks_of_item(self, item_name: str) -> List[Stock]:
+        """
+        :param item_name: name of the item
+        :return: stocks of the item in every warehouse
+        """
+        return await self._collection(
+            f"/api/stocks/item/{_segment(item_name)}/", "items", Stock
+        )
+
+    async def stocks_of_warehouse(self, warehouse_id: int) -> List[Stock]:
+        """
+        :param warehouse_id: ID of the warehouse
+        :return: stocks of the warehouse
+        """
+        return await self._collection(
+            f"/api/stocks/warehouse/{_segment(warehouse_id)}/", "items", Stock
+        )
+
+    async def stock(self, warehouse_id: int, item_name: str) -> Stock:
+        """
+        :param warehouse_id: ID of the warehouse
+        :param item_name: name of the item
+        :return: the stock
+        """
+        return Stock.from_json(
+            await self._get(
+                f"/api/stocks/{_segment(warehouse_id)}/item/{_segment(item_name)}/"
+            )
+        )
+
+    async def create_stock(self, stock: Stock) -> str:
+        """
+        :param stock: stock to add
+        :return: path of the new stock
+        """
+        return await self._create("/api/stocks/", stock)
+
+    async def update_stock(
+        self, warehouse_id: int, item_name: str, stock: Stock
+    ) -> None:
+        """
+        :param warehouse_id: ID of the warehouse
+        :param item_name: name of the item
+        :param stock: new state of the stock
+        """
+        await self._request(
+            "PUT",
+            f"/api/stocks/{_segment(warehouse_id)}/item/{_segment(item_name)}/",
+            json=stock.to_json(),
+        )
+
+    async def delete_stock(self, warehouse_id: int, item_name: str) -> None:
+        """
+        :param warehouse_id: ID of the warehouse
+        :param item_name: name of the item
+        """
+        await self._request(
+            "DELETE",
+            f"/api/stocks/{_segment(warehouse_id)}/item/{_segment(item_name)}/",
+        )
+
+    # batch
+
+    async def batch(self, paths: List[str]) -> List[dict]:
+        """Sends several GET requests in one round trip, see
+        inventorymanager.resources.batch.
+
+        :param paths: paths of the requests, at most BATCH_LIMIT of the server
+        :return: list of dictionaries of the href, status and body of each
+            response
+        """
+        response = await self._request("POST", "/api/batch/", json={"requests": paths})
+        return response.json()["responses"]
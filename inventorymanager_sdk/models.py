@@ -0,0 +1,94 @@
+"""
+This module contains the typed models of the SDK. They mirror the serialized
+form of the database models of inventorymanager.models, as found in the
+responses of the API, without the hypermedia controls.
+"""
+
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
+
+
+class Model:
+    """
+    Base class of the models, converting them from and to the JSON documents
+    of the API.
+    """
+
+    # fields returned by the API but not accepted in requests
+    READ_ONLY = ()
+
+    @classmethod
+    def from_json(cls, doc: dict):
+        """Creates a model from a response body, ignoring the controls and
+        any field the model doesn't know.
+
+        :param doc: decoded JSON document
+        :return: model
+        """
+        names = {field.name for field in fields(cls)}
+        return cls(**{k: v for k, v in doc.items() if k in names})
+
+    def to_json(self) -> dict:
+        """Converts the model to a request body, leaving out the unset fields.
+
+        :return: JSON document
+        """
+        return {
+            k: v
+            for k, v in asdict(self).items()
+            if v is not None and k not in self.READ_ONLY
+        }
+
+
+@dataclass
+class Location(Model):
+    """A location of a warehouse."""
+
+    country: str
+    postal_code: str
+    city: str
+    street: str
+    location_id: Optional[int] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+
+@dataclass
+class Warehouse(Model):
+    """A warehouse."""
+
+    warehouse_id: Optional[int] = None
+    manager: Optional[str] = None
+    location_id: Optional[int] = None
+
+
+@dataclass
+class Item(Model):
+    """An item, identified by its name in the API."""
+
+    READ_ONLY = ("item_id",)
+
+    name: str
+    category: Optional[str] = None
+    weight: Optional[float] = None
+    item_id: Optional[int] = None
+
+
+@dataclass
+class Stock(Model):
+    """The stock of an item in a warehouse."""
+
+    quantity: int
+    item_id: Optional[int] = None
+    warehouse_id: Optional[int] = None
+    shelf_price: Optional[float] = None
+
+
+@dataclass
+class Catalogue(Model):
+    """The catalogue entry of an item at a supplier."""
+
+    supplier_name: str
+    min_order: int
+    item_id: Optional[int] = None
+    order_price: Optional[float] = None
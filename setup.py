@@ -14,5 +14,8 @@ setup(
         "jsonschema",
         "rfc3339-validator",
         "SQLAlchemy",
-    ]
+    ],
+    extras_require={
+        "sdk": ["httpx"],
+    }
 )
\ No newline at end of file
@@ -2,27 +2,45 @@
 This module contains functionality related to testing the API
 """
 
+import gzip
 import json
+import logging
 import os
 import pytest
+import sqlite3
 import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from flask.testing import FlaskClient
 from jsonschema import ValidationError, validate
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
+from sqlalchemy import event, text
 from sqlalchemy.exc import IntegrityError, StatementError
 from werkzeug.datastructures import Headers
 
 
-from inventorymanager import create_app, db
+import inventorymanager
+from inventorymanager import cache, create_app, db
+from inventorymanager.caching import (
+    LOCAL_CACHE,
+    LOCK_PREFIX,
+    TAG_VERSION_PREFIX,
+    LocalLRUCache,
+    warm_cache,
+)
 from inventorymanager.models import (
+    ApiKey,
     Location,
     Warehouse,
     Item,
     Stock,
     Catalogue,
+    generate_data,
     populate_db,
 )
+from inventorymanager.utils import ItemConverter
 
 from inventorymanager.constants import (
     ITEM_PROFILE,
@@ -48,20 +66,27 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 @pytest.fixture
 def client():
     db_fd, db_fname = tempfile.mkstemp()
-    config = {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname, "TESTING": True}
+    config = {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "TESTING": True,
+        "CACHE_TYPE": "SimpleCache",
+        "CACHE_STALE_TIMEOUTS": {},
+        "QUERY_STATS": True,
+    }
 
     app = create_app(config)
 
-    # with app.app_context():
-    db.create_all()
+    with app.app_context():
+        db.create_all()
 
-    populate_db()
+        populate_db()
 
-    # _populate_db()  # couldn't get create_dummy_data to work
+        # _populate_db()  # couldn't get create_dummy_data to work
 
-    yield app.test_client()
+        yield app.test_client()
 
-    db.session.remove()
+        db.session.remove()
+        db.engine.dispose()
     os.close(db_fd)
     os.unlink(db_fname)
 
@@ -216,6 +241,29 @@ class TestEntryPoint(object):
         _check_control_get_method(f"{NAMESPACE}:stock-all", client, body)
         _check_control_get_method(f"{NAMESPACE}:catalogues-all", client, body)
 
+    def test_templates(self, client: FlaskClient):
+        body = json.loads(client.get(self.RESOURCE_URL).data)
+        variables = {"item": "Laptop-1", "warehouse": "1"}
+        for relation, href in (
+            ("item", "/api/items/Laptop-1/"),
+            ("warehouse", "/api/warehouses/1/"),
+            ("stock-item", "/api/stocks/1/item/Laptop-1/"),
+        ):
+            ctrl = body["@controls"][f"{NAMESPACE}:{relation}"]
+            assert ctrl["isHrefTemplate"] is True
+            assert ctrl["method"] == "GET"
+            expanded = ctrl["href"]
+            for name in ctrl["schema"]["required"]:
+                expanded = expanded.replace("{" + name + "}", variables[name])
+            assert expanded == href
+            assert client.get(expanded).status_code == 200
+
+    def test_conditional(self, client: FlaskClient):
+        resp = client.get(self.RESOURCE_URL)
+        etag = resp.headers["ETag"]
+        resp = client.get(self.RESOURCE_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+
 
 class TestLocationCollection(object):
     RESOURCE_URL = "/api/locations/"
@@ -850,6 +898,26 @@ class TestStockItem(object):
         resp = client.put(self.RESOURCE_URL, json=valid)
         assert resp.status_code == 400
 
+    def test_put_if_match(self, client: FlaskClient):
+        etag = client.get(self.RESOURCE_URL).headers["ETag"]
+        valid = _get_stock_json(1, 1)
+        valid["quantity"] = 123
+        resp = client.put(self.RESOURCE_URL, json=valid, headers={"If-Match": '"old"'})
+        assert resp.status_code == 412
+        resp = client.put(self.RESOURCE_URL, json=valid, headers={"If-Match": etag})
+        assert resp.status_code == 204
+
+        # the ETag read before the write no longer matches
+        valid["quantity"] = 124
+        resp = client.put(self.RESOURCE_URL, json=valid, headers={"If-Match": etag})
+        assert resp.status_code == 412
+        resp = client.get(self.RESOURCE_URL)
+        assert json.loads(resp.data)["quantity"] == 123
+        resp = client.put(
+            self.RESOURCE_URL, json=valid, headers={"If-Match": resp.headers["ETag"]}
+        )
+        assert resp.status_code == 204
+
     def test_delete(self, client: FlaskClient):
 
         resp = client.delete(self.RESOURCE_URL)
@@ -902,3 +970,894 @@ class TestStockWarehouseCollection(object):
 
         resp = client.get(self.NOWAREHOUSE_URL)
         assert resp.status_code == 404
+
+
+class TestCacheInvalidation(object):
+
+    def test_item_rename(self, client: FlaskClient):
+        for url in (
+            "/api/catalogue/",
+            "/api/items/Laptop-1/",
+            "/api/stocks/item/Laptop-1/",
+            "/api/stocks/warehouse/1/",
+        ):
+            assert client.get(url).status_code == 200
+
+        resp = client.put("/api/items/Laptop-1/", json=_get_item_json(number=9))
+        assert resp.status_code == 204
+
+        resp = client.get("/api/items/Laptop-1/")
+        assert resp.status_code == 404
+        body = json.loads(client.get("/api/catalogue/").data)
+        hrefs = [entry["@controls"]["self"]["href"] for entry in body["catalogues"]]
+        assert any(href.endswith("/item/Laptop-9/") for href in hrefs)
+        body = json.loads(client.get("/api/stocks/warehouse/1/").data)
+        assert body["items"][0]["@controls"]["self"]["href"].endswith("/item/Laptop-9/")
+        assert client.get("/api/stocks/item/Laptop-9/").status_code == 200
+
+    def test_stock_update(self, client: FlaskClient):
+        resp = client.get("/api/stocks/warehouse/1/")
+        assert json.loads(resp.data)["items"][0]["quantity"] == 10
+        resp = client.get("/api/stocks/1/item/Laptop-1/")
+        assert json.loads(resp.data)["quantity"] == 10
+
+        valid = _get_stock_json(1, 1)
+        valid["quantity"] = 55
+        resp = client.put("/api/stocks/1/item/Laptop-1/", json=valid)
+        assert resp.status_code == 204
+
+        resp = client.get("/api/stocks/warehouse/1/")
+        assert json.loads(resp.data)["items"][0]["quantity"] == 55
+        resp = client.get("/api/stocks/1/item/Laptop-1/")
+        assert json.loads(resp.data)["quantity"] == 55
+        resp = client.get("/api/stocks/")
+        assert 55 in [stock["quantity"] for stock in json.loads(resp.data)["items"]]
+
+    def test_unrelated_entries_kept(self, client: FlaskClient):
+        assert client.get("/api/items/Smartphone-1/").status_code == 200
+        version = cache.get(TAG_VERSION_PREFIX + "item:2")
+        assert version is not None
+
+        resp = client.put("/api/items/Laptop-1/", json=_get_item_json(number=9))
+        assert resp.status_code == 204
+        assert cache.get(TAG_VERSION_PREFIX + "item:2") == version
+        assert cache.get(TAG_VERSION_PREFIX + "item:1") is not None
+
+
+class TestResponseCache(object):
+
+    def test_local_tier_bounded(self):
+        local = LocalLRUCache(2)
+        for key in ("a", "b"):
+            local.set(key, {"expires": None, "stale": 0})
+        local.get("a")
+        local.set("c", {"expires": None, "stale": 0})
+        assert len(local) == 2
+        assert local.get("b") is None
+        assert local.get("a") is not None
+        local.set("d", {"expires": time.time() - 1, "stale": 0})
+        assert local.get("d") is None
+        local.set("e", {"expires": time.time() - 1, "stale": 30})
+        assert local.get("e") is not None
+
+    def test_endpoint_timeout(self, client: FlaskClient):
+        client.application.config["CACHE_TIMEOUTS"]["api.itemcollection"] = 60
+        assert client.get("/api/items/").status_code == 200
+        assert client.get("/api/warehouses/").status_code == 200
+
+        local = client.application.extensions[LOCAL_CACHE]
+        expires = local.get("/api/items/")["expires"]
+        assert time.time() + 50 < expires <= time.time() + 60
+        expires = local.get("/api/warehouses/")["expires"]
+        assert expires > time.time() + 250
+
+    def test_warm_cache(self, client: FlaskClient):
+        local = client.application.extensions[LOCAL_CACHE]
+        count, elapsed = warm_cache(client.application)
+
+        # 5 collections, 3 items, 2 warehouses, 2 catalogue entries, 2 locations
+        # and 2 stock entries
+        assert count == 16
+        assert elapsed > 0
+        for path in ("/api/items/", "/api/catalogue/", "/api/items/Laptop-3/"):
+            assert local.get(path) is not None
+        assert local.get("/api/stocks/2/item/Smartphone-1/") is not None
+
+    def test_warm_cache_command(self, client: FlaskClient):
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=["warm-cache"])
+        assert result.exit_code == 0
+        assert "Warmed 16 cached resources" in result.output
+
+    def test_single_flight(self, client: FlaskClient):
+        app = client.application
+        statements = []
+        barrier = threading.Barrier(8)
+
+        def count_item_queries(conn, cursor, statement, *args):
+            if statement.startswith("SELECT") and "FROM item" in statement:
+                statements.append(statement)
+
+        def fetch(_):
+            thread_client = app.test_client()
+            barrier.wait()
+            return thread_client.get("/api/items/").status_code
+
+        event.listen(db.engine, "before_cursor_execute", count_item_queries)
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                codes = list(pool.map(fetch, range(8)))
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_item_queries)
+
+        assert codes == [200] * 8
+        assert len(statements) == 1
+
+    def test_single_flight_foreign_lock(self, client: FlaskClient):
+        # another process holds the render lock and never finishes
+        client.application.config["CACHE_LOCK_TIMEOUT"] = 0.3
+        cache.set(LOCK_PREFIX + "/api/items/", "other", timeout=60)
+        start = time.monotonic()
+        resp = client.get("/api/items/")
+        assert resp.status_code == 200
+        assert time.monotonic() - start >= 0.3
+        assert cache.get(LOCK_PREFIX + "/api/items/") == "other"
+
+    def test_stale_while_revalidate(self, client: FlaskClient):
+        client.application.config["CACHE_STALE_TIMEOUTS"] = {
+            "api.cataloguecollection": 30
+        }
+        resp = client.get("/api/catalogue/")
+        assert resp.headers["Cache-Control"] == "max-age=0, stale-while-revalidate=30"
+        assert len(json.loads(resp.data)["catalogues"]) == 2
+
+        resp = client.post("/api/catalogue/", json=_get_catalogue_json(3))
+        assert resp.status_code == 201
+
+        # the stale document is served while a fresh one is rendered
+        resp = client.get("/api/catalogue/")
+        assert resp.status_code == 200
+        assert len(json.loads(resp.data)["catalogues"]) == 2
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            resp = client.get("/api/catalogue/")
+            if len(json.loads(resp.data)["catalogues"]) == 3:
+                break
+            time.sleep(0.05)
+        assert len(json.loads(resp.data)["catalogues"]) == 3
+
+        # outside of the staleness window the request waits for a fresh render
+        client.application.config["CACHE_STALE_TIMEOUTS"] = {}
+        resp = client.delete("/api/catalogue/supplier/TechSupplier A/item/Laptop-3/")
+        assert resp.status_code == 204
+        resp = client.get("/api/catalogue/")
+        assert "Cache-Control" not in resp.headers
+        assert len(json.loads(resp.data)["catalogues"]) == 2
+
+    def test_conditional(self, client: FlaskClient):
+        url = "/api/stocks/1/item/Laptop-1/"
+        resp = client.get(url)
+        etag = resp.headers["ETag"]
+        last_modified = resp.headers["Last-Modified"]
+
+        resp = client.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+        resp = client.get(url, headers={"If-Modified-Since": last_modified})
+        assert resp.status_code == 304
+
+        stock = Stock.query.filter_by(warehouse_id=1).first()
+        stock.quantity += 1
+        db.session.commit()
+        resp = client.get(url, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+    def test_local_hit_skips_backend(self, client: FlaskClient, monkeypatch):
+        assert client.get("/api/stocks/").status_code == 200
+        reads = []
+        monkeypatch.setattr(
+            cache.cache, "get_many", lambda *keys: reads.append(keys) or []
+        )
+        assert client.get("/api/stocks/").status_code == 200
+        assert reads == []
+
+    def test_pruned_tag_versions(self, tmp_path):
+        db_fd, db_fname = tempfile.mkstemp()
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+                "TESTING": True,
+                "CACHE_TYPE": "FileSystemCache",
+                "CACHE_DIR": str(tmp_path / "cache"),
+                "CACHE_THRESHOLD": 20,
+                "CACHE_LOCAL_SIZE": 0,
+                "CACHE_TAG_VERSION_TTL": 0,
+                "CACHE_STALE_TIMEOUTS": {},
+            }
+        )
+        collections = ("/api/stocks/", "/api/stocks/warehouse/1/", "/api/catalogue/")
+        try:
+            with app.app_context():
+                db.create_all()
+                generate_data(
+                    locations=2,
+                    warehouses=2,
+                    items=50,
+                    stock_density=1.0,
+                    suppliers=2,
+                    suppliers_per_item=1,
+                )
+                client = app.test_client()
+                for _ in range(2):
+                    for url in collections:
+                        assert client.get(url).status_code == 200
+
+                # every item adds a row tag, more than the backend keeps
+                for item in Item.query.limit(40):
+                    assert client.get(f"/api/items/{item.name}/").status_code == 200
+                for url in collections:
+                    assert client.get(url).status_code == 200
+
+                # a version missing from the backend makes its entries stale
+                cache.delete(TAG_VERSION_PREFIX + "stock")
+                resp = client.get("/api/stocks/")
+                assert resp.status_code == 200
+                assert len(json.loads(resp.data)["items"]) == 100
+                db.session.remove()
+                db.engine.dispose()
+        finally:
+            os.close(db_fd)
+            os.unlink(db_fname)
+
+
+class TestMetrics(object):
+    RESOURCE_URL = "/metrics"
+
+    def test_get(self, client: FlaskClient):
+        for _ in range(3):
+            assert client.get("/api/items/").status_code == 200
+        assert client.get("/api/items/NotAnItem/").status_code == 404
+
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        assert resp.content_type.startswith("text/plain")
+        lines = resp.data.decode().splitlines()
+        assert "# TYPE inventorymanager_request_duration_seconds histogram" in lines
+        assert (
+            "inventorymanager_request_duration_seconds_count"
+            '{endpoint="api.itemcollection",method="GET"} 3'
+        ) in lines
+        assert (
+            "inventorymanager_requests_total"
+            '{endpoint="api.itemcollection",method="GET",status="200"} 3'
+        ) in lines
+        assert (
+            "inventorymanager_request_duration_seconds_bucket"
+            '{endpoint="api.itemcollection",method="GET",le="+Inf"} 3'
+        ) in lines
+        assert any(
+            line.startswith("inventorymanager_requests_total")
+            and 'status="404"' in line
+            for line in lines
+        )
+        size_line = next(
+            line
+            for line in lines
+            if line.startswith(
+                'inventorymanager_response_size_bytes_sum{endpoint="api.itemcollection"'
+            )
+        )
+        assert int(size_line.split()[-1]) > 0
+        # the scrape itself is in flight while the document is rendered
+        assert (
+            "inventorymanager_requests_in_flight"
+            '{endpoint="send_metrics",method="GET"} 1'
+        ) in lines
+
+    def test_exited_threads(self, client: FlaskClient):
+        metrics = client.application.extensions["metrics"]
+
+        def send():
+            resp = client.application.test_client().get("/api/items/")
+            assert resp.status_code == 200
+
+        threads = [threading.Thread(target=send) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the shards of the exited threads are merged, not kept
+        assert len(metrics._shards) == 0
+        requests, statuses, _ = metrics.collect()
+        assert statuses[("api.itemcollection", "GET", 200)] == 5
+        assert requests[("api.itemcollection", "GET")][-2] == 5
+
+    def test_converters_timed(self, client: FlaskClient, monkeypatch):
+        to_python = ItemConverter.to_python
+
+        def slow_to_python(self, value):
+            time.sleep(0.05)
+            return to_python(self, value)
+
+        monkeypatch.setattr(ItemConverter, "to_python", slow_to_python)
+        assert client.get("/api/items/Laptop-1/").status_code == 200
+        requests, _, _ = client.application.extensions["metrics"].collect()
+        assert requests[("api.itemitem", "GET")][-3] >= 0.05
+
+
+def _assert_query_budget(client, url, budget):
+    """
+    Requests url on a cold cache and checks that the number of SQL queries
+    reported in the X-Query-Count header stays within budget.
+    """
+    resp = client.get(url)
+    assert resp.status_code == 200
+    count = int(resp.headers["X-Query-Count"])
+    assert count <= budget, f"{url} issued {count} queries, budget is {budget}"
+    assert resp.headers["Server-Timing"].startswith("db;dur=")
+
+
+class TestQueryBudget(object):
+    # queries issued by each GET on the populate_db() data set
+    BUDGETS = {
+        "/api/items/": 1,
+        "/api/items/Laptop-1/": 1,
+        "/api/warehouses/": 1,
+        "/api/warehouses/1/": 1,
+        "/api/locations/": 1,
+        "/api/locations/1/": 2,
+        "/api/catalogue/": 3,
+        "/api/catalogue/supplier/TechSupplier A/item/Laptop-1/": 2,
+        "/api/catalogue/item/Laptop-1/": 4,
+        "/api/catalogue/supplier/TechSupplier A/": 3,
+        "/api/stocks/": 5,
+        "/api/stocks/1/item/Laptop-1/": 3,
+        "/api/stocks/item/Laptop-1/": 3,
+        "/api/stocks/warehouse/1/": 3,
+    }
+
+    @pytest.mark.parametrize("url", BUDGETS)
+    def test_get(self, client: FlaskClient, url):
+        _assert_query_budget(client, url, self.BUDGETS[url])
+
+    def test_cached(self, client: FlaskClient):
+        client.get("/api/stocks/")
+        _assert_query_budget(client, "/api/stocks/", 0)
+
+    def test_failed_statements(self, client: FlaskClient):
+        # failed statements leave nothing behind on the pooled connection
+        with db.engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(StatementError):
+                    conn.execute(text("SELECT * FROM missing_table"))
+            assert not conn.info.get("query_start_time")
+            conn.execute(text("SELECT 1"))
+
+
+class TestProfiling(object):
+    RESOURCE_URL = "/api/stocks/?_profile=1"
+
+    def test_get(self, client: FlaskClient, tmp_path):
+        client.application.config["PROFILE_DIR"] = str(tmp_path)
+        db.session.add(ApiKey(key=ApiKey.key_hash("admin-token"), admin=True))
+        db.session.commit()
+
+        # warm the cache, profiled requests must still render the resource
+        client.get("/api/stocks/")
+        resp = client.get(
+            self.RESOURCE_URL, headers={"InventoryManager-Api-Key": "admin-token"}
+        )
+        assert resp.status_code == 200
+        assert len(json.loads(resp.data)["items"]) == 2
+        assert "ms " in resp.headers["X-Profile-Top"]
+        assert int(resp.headers["X-Query-Count"]) > 0
+        assert (tmp_path / resp.headers["X-Profile-File"]).exists()
+
+        for headers in ({}, {"InventoryManager-Api-Key": "wrong"}):
+            resp = client.get(self.RESOURCE_URL, headers=headers)
+            assert resp.status_code == 200
+            assert "X-Profile-Top" not in resp.headers
+
+
+class TestBenchmark(object):
+    def test_run(self):
+        from benchmark import run_benchmark
+
+        report = run_benchmark(
+            {
+                "locations": 2,
+                "warehouses": 3,
+                "items": 10,
+                "stock_density": 0.5,
+                "suppliers": 3,
+            },
+            requests=2,
+            warmup=0,
+            targets=("test-client",),
+        )
+        results = report["results"]
+        assert report["meta"]["rows"]["item"] == 10
+        assert {result["method"] for result in results} == {
+            "GET",
+            "POST",
+            "PUT",
+            "DELETE",
+        }
+        for result in results:
+            assert result["errors"] == 0
+            assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+
+class TestGenerateData(object):
+    SIZES = {
+        "locations": 3,
+        "warehouses": 4,
+        "items": 20,
+        "stock_density": 0.5,
+        "suppliers": 5,
+        "suppliers_per_item": 2,
+        "chunk_size": 7,
+    }
+
+    def test_generate(self, client: FlaskClient):
+        client.get("/api/stocks/")
+        counts = generate_data(seed=1, **self.SIZES)
+        assert counts == {
+            "location": 3,
+            "warehouse": 4,
+            "item": 20,
+            "stock": 40,
+            "catalogue": 40,
+        }
+        assert Item.query.count() == 23
+        assert Stock.query.count() == 42
+
+        # the bulk inserts invalidated the cached collection
+        resp = client.get("/api/stocks/")
+        assert len(json.loads(resp.data)["items"]) == 42
+
+        # new ids follow the existing ones and every row stays consistent
+        item = Item.query.filter_by(item_id=4).first()
+        assert item.name == f"{item.category}-4"
+        for stock in Stock.query.filter(Stock.item_id > 3):
+            assert 2 < stock.warehouse_id <= 6
+            assert 2 < stock.warehouse.location_id <= 5
+
+    def test_deterministic(self, client: FlaskClient):
+        def generated_rows():
+            # warehouse ids relative to the first generated warehouse
+            first_warehouse = (
+                db.session.scalar(db.select(db.func.max(Warehouse.warehouse_id))) - 3
+            )
+            items = [item.serialize() for item in Item.query.filter(Item.item_id > 3)]
+            stocks = [
+                (stock.item_id, stock.warehouse_id - first_warehouse, stock.quantity)
+                for stock in Stock.query.filter(Stock.item_id > 3)
+            ]
+            return items, stocks
+
+        generate_data(seed=7, **self.SIZES)
+        first = generated_rows()
+        db.session.execute(Catalogue.__table__.delete().where(Catalogue.item_id > 3))
+        db.session.execute(Stock.__table__.delete().where(Stock.item_id > 3))
+        db.session.execute(Item.__table__.delete().where(Item.item_id > 3))
+        db.session.commit()
+
+        generate_data(seed=7, **self.SIZES)
+        assert generated_rows() == first
+
+    def test_invalid(self, client: FlaskClient):
+        with pytest.raises(ValueError):
+            generate_data(**{**self.SIZES, "stock_density": 2})
+        with pytest.raises(ValueError):
+            generate_data(**{**self.SIZES, "suppliers_per_item": 6})
+
+    def test_cli(self, client: FlaskClient):
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(
+            args=["populate-db", "--scale", "--items", "10", "--warehouses", "2"]
+        )
+        assert result.exit_code == 0
+        assert "10 item" in result.output
+        assert Item.query.count() == 13
+
+
+class TestSqliteProfile(object):
+    def test_pragmas(self, client: FlaskClient):
+        def pragma(name):
+            return db.session.execute(text(f"PRAGMA {name}")).scalar()
+
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1
+        assert pragma("temp_store") == 2
+        assert pragma("busy_timeout") == 5000
+        assert pragma("foreign_keys") == 1
+
+    def test_reader_not_blocked_by_writer(self, client: FlaskClient):
+        db_fname = client.application.config["SQLALCHEMY_DATABASE_URI"][10:]
+        writer = sqlite3.connect(db_fname, isolation_level=None)
+        try:
+            writer.execute("BEGIN EXCLUSIVE")
+            writer.execute("UPDATE item SET weight = 9.9 WHERE name = 'Laptop-1'")
+            start = time.perf_counter()
+            resp = client.get("/api/items/Laptop-1/")
+            assert time.perf_counter() - start < 1
+            assert resp.status_code == 200
+            assert json.loads(resp.data)["weight"] == 1.5
+            writer.execute("COMMIT")
+        finally:
+            writer.close()
+
+    def test_batch_not_blocked_by_writer(self, client: FlaskClient):
+        # the batch endpoint is sent with POST but only reads, so its
+        # transactions don't wait for the write lock
+        app = client.application
+        db_fname = app.config["SQLALCHEMY_DATABASE_URI"][10:]
+        writer = sqlite3.connect(db_fname, isolation_level=None)
+        try:
+            writer.execute("BEGIN IMMEDIATE")
+            start = time.perf_counter()
+            with app.test_request_context("/api/batch/", method="POST"):
+                assert Item.query.count() > 0
+                db.session.rollback()
+            resp = client.post(
+                "/api/batch/",
+                json={"requests": ["/api/items/Laptop-1/", "/api/stocks/"]},
+            )
+            assert time.perf_counter() - start < 1
+            assert resp.status_code == 200
+            statuses = [r["status"] for r in json.loads(resp.data)["responses"]]
+            assert statuses == [200, 200]
+            writer.execute("COMMIT")
+        finally:
+            writer.close()
+
+    def test_ignored_setting_logged(self, caplog):
+        with caplog.at_level(logging.INFO):
+            create_app(
+                {
+                    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+                    "CACHE_TYPE": "SimpleCache",
+                    "SQLITE_PRAGMAS": {"journal_mode": "WAL", "cache_size": -2000},
+                }
+            )
+        messages = [record.getMessage() for record in caplog.records]
+        assert (
+            'SQLite settings: {"journal_mode": "memory", "cache_size": -2000}'
+            in messages
+        )
+        assert (
+            "SQLite ignored journal_mode=WAL, the effective value is memory" in messages
+        )
+
+
+class TestQueryPlans(object):
+    def test_no_table_scans(self, client: FlaskClient):
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=["explain-queries"])
+        assert result.exit_code == 0
+        assert "-- /api/stocks/warehouse/1/" in result.output
+        assert "SEARCH stock USING INDEX ix_stock_warehouse_id" in result.output
+        assert "SEARCH catalogue USING INDEX ix_catalogue_supplier_name" in result.output
+        assert "no table scans in filtered queries" in result.output
+
+    def test_table_scan_reported(self, client: FlaskClient):
+        db.session.execute(text("DROP INDEX ix_stock_warehouse_id"))
+        db.session.commit()
+        runner = client.application.test_cli_runner()
+        result = runner.invoke(args=["explain-queries"])
+        assert result.exit_code == 1
+        assert "!! SCAN stock" in result.output
+        assert "1 table scans in filtered queries" in result.output
+
+        # init-db adds the indexes missing from existing tables
+        result = runner.invoke(args=["init-db"])
+        assert result.exit_code == 0
+        result = runner.invoke(args=["explain-queries"])
+        assert result.exit_code == 0
+
+
+class TestConcurrency(object):
+    RESOURCE_URL = "/api/stocks/1/item/Laptop-1/"
+    THREADS = 16
+    ROUNDS = 10
+
+    def test_pool(self, client: FlaskClient):
+        assert db.engine.pool.size() == 10
+        assert db.engine.pool._pre_ping
+
+    def test_fork_hook(self, client: FlaskClient, monkeypatch):
+        # a single hook for the process, the engines are only held weakly
+        hooks = []
+        monkeypatch.setattr(os, "register_at_fork", lambda **hook: hooks.append(hook))
+        db_fd, db_fname = tempfile.mkstemp()
+        try:
+            create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname})
+        finally:
+            os.close(db_fd)
+            os.unlink(db_fname)
+        assert hooks == []
+        assert isinstance(inventorymanager._engines, weakref.WeakSet)
+        assert db.engine in inventorymanager._engines
+
+        # a forked process drops the connections pooled by its parent
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        pool = db.engine.pool
+        assert pool.checkedin() > 0
+        inventorymanager._dispose_engines()
+        assert db.engine.pool is not pool
+        assert db.engine.pool.checkedin() == 0
+
+    def test_stock_endpoints(self, client: FlaskClient):
+        app = client.application
+
+        def hammer(number):
+            # each thread pushes its own contexts, with its own session
+            thread_client = app.test_client()
+            statuses = []
+            for round_number in range(self.ROUNDS):
+                stock = _get_stock_json(1, 1)
+                stock["quantity"] = number * self.ROUNDS + round_number
+                statuses += [
+                    thread_client.get("/api/stocks/").status_code,
+                    thread_client.get("/api/stocks/warehouse/1/").status_code,
+                    thread_client.get(self.RESOURCE_URL).status_code,
+                    thread_client.put(self.RESOURCE_URL, json=stock).status_code,
+                    thread_client.get("/api/stocks/item/Laptop-1/").status_code,
+                ]
+            return statuses
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            statuses = [
+                status
+                for thread_statuses in pool.map(hammer, range(self.THREADS))
+                for status in thread_statuses
+            ]
+        assert len(statuses) == self.THREADS * self.ROUNDS * 5
+        assert set(statuses) <= {200, 204}
+
+        # every write went through, the last one is served
+        db.session.expire_all()
+        quantity = Stock.query.filter_by(item_id=1, warehouse_id=1).first().quantity
+        assert 0 <= quantity < self.THREADS * self.ROUNDS
+        resp = client.get(self.RESOURCE_URL)
+        assert json.loads(resp.data)["quantity"] == quantity
+
+
+class TestApiDocs(object):
+    RESOURCE_URL = "/apispec_1.json"
+
+    def test_spec(self, client: FlaskClient):
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert body["info"]["title"] == "PWP Inventory Manager"
+        assert "post" in body["paths"]["/api/items/"]
+        resp = client.get("/apidocs/")
+        assert resp.status_code == 200
+
+    def test_other_working_directory(self):
+        from benchmark import cold_start
+
+        assert cold_start(1)["apispec_status"] == 200
+
+    def test_build(self, client: FlaskClient, tmp_path):
+        app = client.application
+        app.config["APIDOCS_SPEC"] = str(tmp_path / "openapi.json")
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["build-apidocs"])
+        assert result.exit_code == 0
+        with open(app.config["APIDOCS_SPEC"], encoding="utf-8") as file:
+            built = json.load(file)
+        assert built == json.loads(client.get(self.RESOURCE_URL).data)
+
+        # a spec newer than the docs is served as is
+        built["info"]["title"] = "Compiled"
+        with open(app.config["APIDOCS_SPEC"], "w", encoding="utf-8") as file:
+            json.dump(built, file)
+        app.swag.apispecs.clear()
+        resp = client.get(self.RESOURCE_URL)
+        assert json.loads(resp.data)["info"]["title"] == "Compiled"
+
+        # and an outdated one is compiled again
+        os.utime(app.config["APIDOCS_SPEC"], (0, 0))
+        app.swag.apispecs.clear()
+        resp = client.get(self.RESOURCE_URL)
+        assert json.loads(resp.data)["info"]["title"] == "PWP Inventory Manager"
+
+    def test_disabled(self):
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite://",
+                "CACHE_TYPE": "SimpleCache",
+                "SWAGGER_ENABLED": False,
+            }
+        )
+        client = app.test_client()
+        assert client.get("/apidocs/").status_code == 404
+        assert client.get(self.RESOURCE_URL).status_code == 404
+        result = app.test_cli_runner().invoke(args=["build-apidocs"])
+        assert result.exit_code == 1
+        assert "Swagger is disabled" in result.output
+
+
+class TestStaticPages(object):
+    def test_profile(self, client: FlaskClient):
+        resp = client.get(ITEM_PROFILE)
+        assert resp.status_code == 200
+        assert resp.data == b"item"
+        assert resp.mimetype == "text/html"
+        # the URLs aren't versioned, so the pages must be revalidated
+        assert resp.headers["Cache-Control"] == "public, max-age=300"
+        assert "ETag" in resp.headers
+        resp = client.get("/profiles/missing/")
+        assert resp.status_code == 404
+
+    def test_gzip(self, client: FlaskClient):
+        with open(
+            os.path.join(client.application.static_folder, "link-relations.html"),
+            "rb",
+        ) as file:
+            content = file.read()
+        resp = client.get(LINK_RELATIONS_URL)
+        assert resp.data == content
+        assert resp.headers.get("Content-Encoding") is None
+
+        resp = client.get(LINK_RELATIONS_URL, headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert len(resp.data) < len(content)
+        assert gzip.decompress(resp.data) == content
+
+    def test_etag(self, client: FlaskClient):
+        resp = client.get(LINK_RELATIONS_URL)
+        etag = resp.headers["ETag"]
+        resp = client.get(LINK_RELATIONS_URL, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+
+        resp = client.get(
+            LINK_RELATIONS_URL,
+            headers={"If-None-Match": etag, "Accept-Encoding": "gzip"},
+        )
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+
+class TestBatch(object):
+    RESOURCE_URL = "/api/batch/"
+    PATHS = [
+        "/api/stocks/1/item/Laptop-1/",
+        "/api/items/Laptop-1/",
+        "/api/stocks/item/Laptop-1/",
+        "/api/catalogue/item/Laptop-1/",
+        "/api/items/NotAnItem/",
+    ]
+
+    def test_post(self, client: FlaskClient):
+        resp = client.post(self.RESOURCE_URL, json={"requests": self.PATHS})
+        assert resp.status_code == 200
+        responses = json.loads(resp.data)["responses"]
+        assert [response["href"] for response in responses] == self.PATHS
+        for path, response in zip(self.PATHS, responses):
+            single = client.get(path)
+            assert response["status"] == single.status_code
+            if single.status_code == 200:
+                assert response["body"] == json.loads(single.data)
+        # errors keep their status and body
+        assert responses[-1]["status"] == 404
+        assert responses[-1]["body"] == client.get(self.PATHS[-1]).get_data(True)
+
+    def test_metrics(self, client: FlaskClient):
+        client.post(self.RESOURCE_URL, json={"requests": self.PATHS[:2]})
+        lines = client.get("/metrics").data.decode().splitlines()
+        assert (
+            "inventorymanager_requests_total"
+            '{endpoint="api.batch",method="POST",status="200"} 1'
+        ) in lines
+        assert (
+            "inventorymanager_requests_total"
+            '{endpoint="api.itemitem",method="GET",status="200"} 1'
+        ) in lines
+
+    def test_invalid(self, client: FlaskClient):
+        for body in (
+            {},
+            {"requests": []},
+            {"requests": ["/profiles/item/"]},
+            {"requests": ["/api/items/"] * 21},
+            {"requests": ["/api/batch/"]},
+        ):
+            resp = client.post(self.RESOURCE_URL, json=body)
+            assert resp.status_code == 400
+        resp = client.post(self.RESOURCE_URL, data="not json")
+        assert resp.status_code in (400, 415)
+
+    def test_shared_session(self, client: FlaskClient):
+        sessions = set()
+
+        @client.application.after_request
+        def record_session(response):
+            sessions.add(id(db.session()))
+            return response
+
+        client.post(self.RESOURCE_URL, json={"requests": self.PATHS[:3]})
+        assert len(sessions) == 1
+
+
+class TestStockEmbed(object):
+    RESOURCE_URL = "/api/stocks/1/item/Laptop-1/"
+
+    def test_get(self, client: FlaskClient):
+        resp = client.get(self.RESOURCE_URL + "?embed=item,warehouse,catalogue")
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        embedded = body["@embedded"]
+        assert embedded["item"]["name"] == "Laptop-1"
+        assert embedded["item"]["@controls"]["self"]["href"] == "/api/items/Laptop-1/"
+        assert embedded["warehouse"]["warehouse_id"] == 1
+        assert embedded["warehouse"]["location"]["location_id"] == (
+            embedded["warehouse"]["location_id"]
+        )
+        assert {entry["supplier_name"] for entry in embedded["catalogue"]} == {
+            entry.supplier_name
+            for entry in Item.query.filter_by(name="Laptop-1").first().catalogue
+        }
+        assert "@embedded" not in json.loads(client.get(self.RESOURCE_URL).data)
+
+    def test_collections(self, client: FlaskClient):
+        for url in (
+            "/api/stocks/",
+            "/api/stocks/item/Laptop-1/",
+            "/api/stocks/warehouse/1/",
+        ):
+            resp = client.get(url + "?embed=warehouse")
+            assert resp.status_code == 200
+            for stock in json.loads(resp.data)["items"]:
+                embedded = stock["@embedded"]
+                assert embedded["warehouse"]["warehouse_id"] == stock["warehouse_id"]
+                assert "location" in embedded["warehouse"]
+
+    def test_single_query(self, client: FlaskClient):
+        # the converters look the warehouse and item up, the stock and its
+        # related resources come in one joined query
+        _assert_query_budget(
+            client, self.RESOURCE_URL + "?embed=item,warehouse,catalogue", 3
+        )
+        _assert_query_budget(client, "/api/stocks/?embed=item,warehouse,catalogue", 1)
+
+    def test_invalid(self, client: FlaskClient):
+        resp = client.get(self.RESOURCE_URL + "?embed=item,supplier")
+        assert resp.status_code == 400
+        assert json.loads(resp.data)["@error"]["@message"] == "Invalid embed"
+
+    def test_cache(self, client: FlaskClient):
+        # cached responses only cost the lookups of the URL converters
+        url = self.RESOURCE_URL + "?embed=warehouse"
+        assert client.get(url).headers["X-Query-Count"] == "3"
+        assert client.get(url).headers["X-Query-Count"] == "2"
+        # a different embed is a different response
+        resp = client.get(self.RESOURCE_URL + "?embed=item")
+        assert "warehouse" not in json.loads(resp.data)["@embedded"]
+
+        # other parameters and the order of the names share the entry
+        resp = client.get(self.RESOURCE_URL + "?embed=item,warehouse")
+        assert resp.headers["X-Query-Count"] == "3"
+        for query in ("?embed=warehouse,item,item", "?embed=item,warehouse&a=1"):
+            resp = client.get(self.RESOURCE_URL + query)
+            assert resp.headers["X-Query-Count"] == "2"
+        assert client.get(self.RESOURCE_URL + "?a=2").headers["X-Query-Count"] == "3"
+        assert client.get(self.RESOURCE_URL + "?a=3").headers["X-Query-Count"] == "2"
+
+        # the embedded location invalidates the response
+        location = Warehouse.query.filter_by(warehouse_id=1).first().location
+        location.city = "Tampere"
+        db.session.commit()
+        resp = client.get(url)
+        assert resp.headers["X-Query-Count"] == "3"
+        assert json.loads(resp.data)["@embedded"]["warehouse"]["location"]["city"] == (
+            "Tampere"
+        )
@@ -0,0 +1,615 @@
+"""
+This module contains the benchmark suite of the API. It seeds a database of
+configurable size with the generator of "flask populate-db --scale", sends
+every GET, POST, PUT and DELETE endpoint a number of requests through the Flask
+test client and through a real WSGI server, and writes the p50/p95/p99 latency
+and the throughput of each endpoint as JSON so that runs can be compared.
+
+Run it from the root directory, e.g.
+
+    python tests/benchmark.py --warehouses 1000 --items 50000 --stock-density 0.02
+
+See python tests/benchmark.py --help for the other options.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from inventorymanager import create_app, db
+from inventorymanager.models import (
+    Catalogue,
+    Item,
+    Location,
+    Stock,
+    Warehouse,
+    generate_data,
+)
+
+TARGETS = ("test-client", "wsgi")
+
+# run in a fresh interpreter by cold_start, from another working directory
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from inventorymanager import create_app
+imported = time.perf_counter()
+app = create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+response = app.test_client().get("/apispec_1.json")
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_apispec_ms": (served - created) * 1000,
+    "apispec_status": response.status_code,
+}))
+"""
+
+
+class _KeepAliveHandler(WSGIRequestHandler):
+    """Request handler of the benchmark server, keeping connections open and
+    not logging every request."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class TestClientTarget:
+    """Sends the requests through the Flask test client."""
+
+    name = "test-client"
+
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def request(self, method: str, url: str, body=None) -> tuple:
+        """Sends a request.
+
+        :param method: HTTP method
+        :param url: request path
+        :param body: JSON body, defaults to None
+        :return: tuple of the status code and the Location header
+        """
+        resp = self.client.open(url, method=method, json=body)
+        resp.get_data()
+        return resp.status_code, resp.headers.get("Location")
+
+    def close(self) -> None:
+        pass
+
+
+class WSGITarget:
+    """Sends the requests over HTTP to a threaded WSGI server running the app,
+    with one keep-alive connection per thread."""
+
+    name = "wsgi"
+
+    def __init__(self, app):
+        self.app = app
+        self.server = make_server(
+            "127.0.0.1", 0, app, threaded=True, request_handler=_KeepAliveHandler
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(
+                "127.0.0.1", self.server.server_port
+            )
+        return connection
+
+    def request(self, method: str, url: str, body=None) -> tuple:
+        """Sends a request.
+
+        :param method: HTTP method
+        :param url: request path
+        :param body: JSON body, defaults to None
+        :return: tuple of the status code and the Location header
+        """
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection = self._connection()
+        try:
+            connection.request(method, url, body=data, headers=headers)
+            resp = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            self._local.connection = None
+            raise
+        resp.read()
+        return resp.status, resp.getheader("Location")
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.thread.join()
+
+
+def sample_rows() -> dict:
+    """Picks an existing row of each table to build the benchmarked URLs from.
+
+    :return: dictionary of item names, ids and (supplier or warehouse, item) pairs
+    """
+    stock = Stock.query.first()
+    entry = Catalogue.query.first()
+    sample = {
+        "item": Item.query.first().name,
+        "warehouse": Warehouse.query.first().warehouse_id,
+        "location": Location.query.first().location_id,
+    }
+    if stock is not None:
+        sample["stock"] = (stock.warehouse_id, stock.item.name)
+    if entry is not None:
+        sample["catalogue"] = (entry.supplier_name, entry.item.name)
+    return sample
+
+
+def read_cases(sample: dict) -> list:
+    """Builds the benchmarked GET requests from the seeded rows.
+
+    :param sample: existing rows, as returned by sample_rows
+    :return: list of (method, endpoint, url) tuples
+    """
+    item = sample["item"]
+    urls = [
+        "/api/",
+        "/api/items/",
+        f"/api/items/{item}/",
+        "/api/warehouses/",
+        f"/api/warehouses/{sample['warehouse']}/",
+        "/api/locations/",
+        f"/api/locations/{sample['location']}/",
+        "/api/stocks/",
+        f"/api/stocks/item/{item}/",
+        f"/api/stocks/warehouse/{sample['warehouse']}/",
+        "/api/catalogue/",
+    ]
+    if "stock" in sample:
+        urls.append("/api/stocks/{}/item/{}/".format(*sample["stock"]))
+    if "catalogue" in sample:
+        supplier, catalogue_item = sample["catalogue"]
+        urls.append(f"/api/catalogue/item/{catalogue_item}/")
+        urls.append(f"/api/catalogue/supplier/{supplier}/")
+        urls.append(f"/api/catalogue/supplier/{supplier}/item/{catalogue_item}/")
+    return [("GET", url) for url in urls]
+
+
+def percentile(ordered: list, rank: float) -> float:
+    """Nearest-rank percentile.
+
+    :param ordered: sorted samples
+    :param rank: percentile between 0 and 100
+    :return: the sample at the given percentile
+    """
+    return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+def measure(target, method: str, endpoint: str, requests: list, concurrency: int):
+    """Sends the requests and summarizes their latencies.
+
+    :param target: TestClientTarget or WSGITarget
+    :param method: HTTP method
+    :param endpoint: endpoint label of the result
+    :param requests: list of (url, body) tuples
+    :param concurrency: number of threads sending requests
+    :return: tuple of the result dictionary and the Location headers
+    """
+
+    def send(request) -> tuple:
+        url, body = request
+        start = time.perf_counter()
+        try:
+            status, location = target.request(method, url, body)
+        except (http.client.HTTPException, OSError):
+            status, location = None, None
+        return time.perf_counter() - start, status, location
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(send, requests))
+    else:
+        outcomes = [send(request) for request in requests]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _, _ in outcomes)
+    errors = sum(1 for _, status, _ in outcomes if status is None or status >= 400)
+    result = {
+        "target": target.name,
+        "method": method,
+        "endpoint": endpoint,
+        "requests": len(outcomes),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "throughput_rps": round(len(outcomes) / elapsed, 1),
+    }
+    return result, [location for _, _, location in outcomes]
+
+
+def _item_ids(names: list) -> list:
+    rows = db.session.execute(
+        select(Item.name, Item.item_id).where(Item.name.in_(names))
+    ).all()
+    ids = dict(rows)
+    return [ids[name] for name in names]
+
+
+def run_target(
+    target, sample: dict, requests: int, concurrency: int, warmup: int
+) -> list:
+    """Benchmarks every endpoint on a target. Write benchmarks create their
+    own rows and delete them at the end, leaving the seeded data untouched.
+
+    :param target: TestClientTarget or WSGITarget
+    :param sample: existing rows, as returned by sample_rows
+    :param requests: number of requests per endpoint and method
+    :param concurrency: number of threads sending requests
+    :param warmup: number of unmeasured requests sent to each GET endpoint first
+    :return: list of result dictionaries
+    """
+    results = []
+    for method, url in read_cases(sample):
+        for _ in range(warmup):
+            target.request(method, url)
+        result, _ = measure(target, method, url, [(url, None)] * requests, concurrency)
+        results.append(result)
+
+    prefix = f"Bench-{target.name}"
+    warehouse = sample["warehouse"]
+
+    def write(method: str, endpoint: str, requests: list) -> list:
+        result, locations = measure(target, method, endpoint, requests, concurrency)
+        results.append(result)
+        return locations
+
+    def location_json(number: int) -> dict:
+        return {
+            "country": "Finland",
+            "postal_code": "90570",
+            "city": "Oulu",
+            "street": f"{prefix} {number}",
+        }
+
+    numbers = range(requests)
+    locations = write(
+        "POST",
+        "/api/locations/",
+        [("/api/locations/", location_json(number)) for number in numbers],
+    )
+    write(
+        "PUT",
+        "/api/locations/<location>/",
+        [(url, location_json(number)) for number, url in enumerate(locations)],
+    )
+    warehouses = write(
+        "POST",
+        "/api/warehouses/",
+        [("/api/warehouses/", {"manager": "Bench Manager", "location_id": 1})]
+        * requests,
+    )
+    write(
+        "PUT",
+        "/api/warehouses/<warehouse>/",
+        [(url, {"manager": "Other Manager"}) for url in warehouses],
+    )
+
+    names = [f"{prefix}-{number}" for number in numbers]
+    items = write(
+        "POST",
+        "/api/items/",
+        [("/api/items/", {"name": name, "category": "Bench"}) for name in names],
+    )
+    write(
+        "PUT",
+        "/api/items/<item>/",
+        [
+            (url, {"name": name, "category": "Bench", "weight": 1.0})
+            for name, url in zip(names, items)
+        ],
+    )
+    with target.app.app_context():
+        item_ids = _item_ids(names)
+
+    stocks = write(
+        "POST",
+        "/api/stocks/",
+        [
+            (
+                "/api/stocks/",
+                {"item_id": item_id, "warehouse_id": warehouse, "quantity": 10},
+            )
+            for item_id in item_ids
+        ],
+    )
+    write(
+        "PUT",
+        "/api/stocks/<warehouse>/item/<item>/",
+        [
+            (url, {"item_id": item_id, "warehouse_id": warehouse, "quantity": 20})
+            for item_id, url in zip(item_ids, stocks)
+        ],
+    )
+    catalogue = write(
+        "POST",
+        "/api/catalogue/",
+        [
+            (
+                "/api/catalogue/",
+                {"item_id": item_id, "supplier_name": prefix, "min_order": 5},
+            )
+            for item_id in item_ids
+        ],
+    )
+    write(
+        "PUT",
+        "/api/catalogue/supplier/<supplier>/item/<item>/",
+        [
+            (url, {"item_id": item_id, "supplier_name": prefix, "min_order": 10})
+            for item_id, url in zip(item_ids, catalogue)
+        ],
+    )
+
+    write(
+        "DELETE",
+        "/api/catalogue/supplier/<supplier>/item/<item>/",
+        [(url, None) for url in catalogue],
+    )
+    write(
+        "DELETE",
+        "/api/stocks/<warehouse>/item/<item>/",
+        [(url, None) for url in stocks],
+    )
+    write("DELETE", "/api/items/<item>/", [(url, None) for url in items])
+    write("DELETE", "/api/warehouses/<warehouse>/", [(url, None) for url in warehouses])
+    write("DELETE", "/api/locations/<location>/", [(url, None) for url in locations])
+    return results
+
+
+def run_benchmark(
+    sizes: dict,
+    requests: int = 200,
+    concurrency: int = 1,
+    warmup: int = 5,
+    targets: tuple = TARGETS,
+    cache: bool = False,
+    seed: int = 0,
+) -> dict:
+    """Seeds a temporary database and benchmarks every endpoint on each target.
+
+    :param sizes: keyword arguments of generate_data, e.g. {"items": 1000}
+    :param cache: keep the response cache enabled, defaults to False so that
+    GET requests measure the database and serialization work
+    :return: report with the run parameters and the results
+    """
+    db_fd, db_fname = tempfile.mkstemp(suffix=".db")
+    config = {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "CACHE_TYPE": "SimpleCache" if cache else "NullCache",
+        "CACHE_LOCAL_SIZE": 256 if cache else 0,
+        "CACHE_STALE_TIMEOUTS": {},
+        "CACHE_WARM_ON_STARTUP": False,
+    }
+    parameters = {
+        **sizes,
+        "requests": requests,
+        "concurrency": concurrency,
+        "warmup": warmup,
+        "cache": cache,
+        "seed": seed,
+    }
+    try:
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            counts = generate_data(seed=seed, **sizes)
+            seconds = time.perf_counter() - start
+            sample = sample_rows()
+
+        # requests push their own application context, as in production
+        results = []
+        for name in targets:
+            target = TestClientTarget(app) if name == "test-client" else WSGITarget(app)
+            try:
+                results += run_target(target, sample, requests, concurrency, warmup)
+            finally:
+                target.close()
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        os.close(db_fd)
+        os.unlink(db_fname)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rows": counts,
+            "seed_seconds": round(seconds, 2),
+            "parameters": parameters,
+        },
+        "results": results,
+    }
+
+
+def cold_start(runs: int = 5, config: dict = None) -> dict:
+    """Starts the app in fresh interpreters, outside of the root directory,
+    and times the imports, create_app and the first request of the API spec.
+
+    :param runs: number of interpreters to start
+    :param config: extra configuration, e.g. {"SWAGGER_ENABLED": False}
+    :return: median of each timing, in milliseconds
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, "PYTHONPATH": root}
+    samples = []
+    with tempfile.TemporaryDirectory() as directory:
+        arguments = json.dumps(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///"
+                + os.path.join(directory, "cold.db"),
+                "CACHE_TYPE": "NullCache",
+                **(config or {}),
+            }
+        )
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, "-c", COLD_START_SCRIPT, arguments],
+                cwd=directory,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    timings = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        median = values[len(values) // 2]
+        timings[key] = round(median, 2) if key.endswith("_ms") else median
+    return timings
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """Compares the p95 latency of each endpoint with a previous run.
+
+    :param report: report of this run
+    :param baseline: report of the previous run
+    :return: list of (target, method, endpoint, baseline p95, p95, change %)
+    """
+    previous = {
+        (result["target"], result["method"], result["endpoint"]): result
+        for result in baseline["results"]
+    }
+    rows = []
+    for result in report["results"]:
+        key = (result["target"], result["method"], result["endpoint"])
+        if key in previous:
+            before, after = previous[key]["p95_ms"], result["p95_ms"]
+            change = (after - before) / before * 100 if before else 0.0
+            rows.append(key + (before, after, round(change, 1)))
+    return rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--warehouses", type=int, default=100)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--stock-density", type=float, default=0.1)
+    parser.add_argument("--suppliers", type=int, default=20)
+    parser.add_argument("--suppliers-per-item", type=int, default=2)
+    parser.add_argument(
+        "--requests", type=int, default=200, help="requests per endpoint and method"
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--target", choices=TARGETS, action="append")
+    parser.add_argument(
+        "--cache", action="store_true", help="keep the response cache enabled"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="defaults to benchmark-<timestamp>.json")
+    parser.add_argument("--compare", help="previous report to compare p95 with")
+    parser.add_argument(
+        "--cold-starts",
+        type=int,
+        default=5,
+        help="fresh interpreters timing the start-up, 0 to skip",
+    )
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        {
+            "locations": args.locations,
+            "warehouses": args.warehouses,
+            "items": args.items,
+            "stock_density": args.stock_density,
+            "suppliers": args.suppliers,
+            "suppliers_per_item": args.suppliers_per_item,
+        },
+        requests=args.requests,
+        concurrency=args.concurrency,
+        warmup=args.warmup,
+        targets=tuple(args.target or TARGETS),
+        cache=args.cache,
+        seed=args.seed,
+    )
+    if args.cold_starts:
+        report["meta"]["cold_start"] = cold_start(args.cold_starts)
+    output = args.output or time.strftime("benchmark-%Y%m%d-%H%M%S.json")
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"{'target':12} {'method':7} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>8}")
+    for result in report["results"]:
+        print(
+            f"{result['target']:12} {result['method']:7} "
+            f"{result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+            f"{result['p99_ms']:9.2f} {result['throughput_rps']:8.1f}  "
+            f"{result['endpoint']}"
+            + (f"  ({result['errors']} errors)" if result["errors"] else "")
+        )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print("\np95 change against", args.compare)
+        for target, method, endpoint, before, after, change in compare(
+            report, baseline
+        ):
+            print(
+                f"{target:12} {method:7} {before:9.2f} -> {after:9.2f} "
+                f"{change:+6.1f}%  {endpoint}"
+            )
+    if args.cold_starts:
+        print(
+            "\ncold start: "
+            + ", ".join(
+                f"{key} {value}" for key, value in report["meta"]["cold_start"].items()
+            )
+        )
+    print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
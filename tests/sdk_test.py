@@ -0,0 +1,177 @@
+"""
+This module contains tests of the asynchronous Python SDK, run against a mocked
+transport so that no server is needed
+"""
+
+import asyncio
+import json
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from inventorymanager_sdk import ApiError, AsyncInventoryClient, Item, Stock
+
+
+def _run(handler, call, **kwargs):
+    """
+    Runs call(client) with a client whose requests are answered by handler.
+    """
+
+    async def main():
+        client = AsyncInventoryClient("http://testserver", backoff=0, **kwargs)
+        await client._http.aclose()
+        client._http = httpx.AsyncClient(
+            base_url="http://testserver", transport=httpx.MockTransport(handler)
+        )
+        async with client:
+            return await call(client)
+
+    return asyncio.run(main())
+
+
+def _answers(*responses):
+    """
+    Handler answering with the given responses in turn, recording the requests.
+    A response that is an exception class is raised instead.
+    """
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        response = responses[min(len(sent), len(responses)) - 1]
+        if isinstance(response, type) and issubclass(response, Exception):
+            raise response("failed", request=request)
+        return response
+
+    return handler, sent
+
+
+ITEM = {
+    "item_id": 1,
+    "name": "Laptop",
+    "category": "Electronics",
+    "weight": 2.5,
+    "@controls": {"self": {"href": "/api/items/Laptop/"}},
+}
+
+
+class TestRetries(object):
+    def test_overloaded(self):
+        handler, sent = _answers(
+            httpx.Response(503), httpx.Response(502), httpx.Response(200, json=ITEM)
+        )
+        item = _run(handler, lambda client: client.item("Laptop"))
+        assert item.name == "Laptop"
+        assert len(sent) == 3
+
+    def test_exhausted(self):
+        handler, sent = _answers(httpx.Response(503, text="busy"))
+        with pytest.raises(ApiError) as error:
+            _run(handler, lambda client: client.item("Laptop"), retries=2)
+        assert error.value.status_code == 503
+        assert len(sent) == 3
+
+    def test_backoff(self, monkeypatch):
+        delays = []
+
+        async def sleep(seconds):
+            delays.append(seconds)
+
+        monkeypatch.setattr(asyncio, "sleep", sleep)
+        handler, _ = _answers(
+            httpx.Response(504), httpx.Response(504), httpx.Response(200, json=ITEM)
+        )
+
+        async def call(client):
+            client.backoff = 0.3
+            return await client.item("Laptop")
+
+        _run(handler, call)
+        assert delays == [0.3, 0.6]
+
+    def test_not_idempotent(self):
+        # a POST may have been applied by an overloaded server
+        handler, sent = _answers(httpx.Response(503))
+        with pytest.raises(ApiError):
+            _run(handler, lambda client: client.create_item(Item(name="Laptop")))
+        assert len(sent) == 1
+
+        # a POST whose connection failed was never sent
+        handler, sent = _answers(
+            httpx.ConnectError,
+            httpx.Response(201, headers={"Location": "/api/items/Laptop/"}),
+        )
+        location = _run(handler, lambda client: client.create_item(Item(name="Laptop")))
+        assert location == "/api/items/Laptop/"
+        assert len(sent) == 2
+
+        # but one that failed while reading the response may have been applied
+        handler, sent = _answers(httpx.ReadError)
+        with pytest.raises(httpx.ReadError):
+            _run(handler, lambda client: client.create_item(Item(name="Laptop")))
+        assert len(sent) == 1
+
+    def test_idempotent_transport_error(self):
+        handler, sent = _answers(httpx.ReadError, httpx.Response(200, json=ITEM))
+        assert _run(handler, lambda client: client.item("Laptop")).item_id == 1
+        assert len(sent) == 2
+
+
+class TestErrors(object):
+    def test_api_error(self):
+        handler, sent = _answers(httpx.Response(404, text="Item not found"))
+        with pytest.raises(ApiError) as error:
+            _run(handler, lambda client: client.item("Not an/item"))
+        assert error.value.status_code == 404
+        assert error.value.message == "Item not found"
+        assert error.value.url == "http://testserver/api/items/Not%20an%2Fitem/"
+        assert len(sent) == 1
+
+
+class TestModels(object):
+    def test_item(self):
+        item = Item.from_json(ITEM)
+        assert item == Item(
+            name="Laptop", category="Electronics", weight=2.5, item_id=1
+        )
+        # the item ID is assigned by the API
+        assert item.to_json() == {
+            "name": "Laptop",
+            "category": "Electronics",
+            "weight": 2.5,
+        }
+
+    def test_stock(self):
+        doc = {"item_id": 1, "warehouse_id": 2, "quantity": 5, "shelf_price": None}
+        stock = Stock.from_json(doc)
+        assert stock == Stock(quantity=5, item_id=1, warehouse_id=2)
+        assert stock.to_json() == {"item_id": 1, "warehouse_id": 2, "quantity": 5}
+
+    def test_collection(self):
+        handler, sent = _answers(
+            httpx.Response(
+                200,
+                json={
+                    "items": [
+                        {"item_id": 1, "warehouse_id": 1, "quantity": 3},
+                        {"item_id": 2, "warehouse_id": 1, "quantity": 0},
+                    ]
+                },
+            )
+        )
+        stocks = _run(handler, lambda client: client.stocks_of_warehouse(1))
+        assert [stock.item_id for stock in stocks] == [1, 2]
+        assert sent[0].url.path == "/api/stocks/warehouse/1/"
+
+    def test_update(self):
+        handler, sent = _answers(httpx.Response(204))
+        _run(
+            handler,
+            lambda client: client.update_stock(
+                1, "Laptop", Stock(quantity=4, item_id=1)
+            ),
+        )
+        assert sent[0].method == "PUT"
+        assert sent[0].url.path == "/api/stocks/1/item/Laptop/"
+        assert json.loads(sent[0].read()) == {"quantity": 4, "item_id": 1}
@@ -0,0 +1,12 @@
+"""
+Production WSGI entry point of the inventory manager API, e.g.
+
+    gunicorn --workers 4 --threads 8 wsgi:app
+    waitress-serve --threads 8 wsgi:app
+
+Settings are read from instance/config.py, see inventorymanager/README.md.
+"""
+
+from inventorymanager import create_app
+
+app = create_app()